@@ -47,6 +47,14 @@ OTP_EXPIRY_MINUTES = config('OTP_EXPIRY_MINUTES', default=5, cast=int)
 ZARINPAL_MERCHANT_ID = config('ZARINPAL_MERCHANT_ID', default='')
 ZARINPAL_SANDBOX = config('ZARINPAL_SANDBOX', default=True, cast=bool)
 ZARINPAL_ACTIVE = config('ZARINPAL_ACTIVE', default=False, cast=bool)
+# Overrides the gateway host, e.g. http://127.0.0.1:8765 for `manage.py zarinpal_stub`
+ZARINPAL_API_URL = config('ZARINPAL_API_URL', default='')
+ZARINPAL_CONNECT_TIMEOUT = config('ZARINPAL_CONNECT_TIMEOUT', default=3.05, cast=float)
+ZARINPAL_READ_TIMEOUT = config('ZARINPAL_READ_TIMEOUT', default=10, cast=float)
+ZARINPAL_VERIFY_RETRIES = config('ZARINPAL_VERIFY_RETRIES', default=2, cast=int)
+ZARINPAL_POOL_SIZE = config('ZARINPAL_POOL_SIZE', default=10, cast=int)
+ZARINPAL_BREAKER_THRESHOLD = config('ZARINPAL_BREAKER_THRESHOLD', default=5, cast=int)
+ZARINPAL_BREAKER_COOLDOWN = config('ZARINPAL_BREAKER_COOLDOWN', default=30, cast=float)
 
 
 # Application definition
@@ -114,9 +122,55 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Seconds a writer waits for the lock; checkout transactions take it up
+        # front through core.transactions.write_atomic()
+        "OPTIONS": {"timeout": 20},
     }
 }
 
+# Cache
+# LocMemCache is per process; point CACHE_BACKEND at a shared cache
+# (e.g. django.core.cache.backends.redis.RedisCache) to share across workers
+CACHES = {
+    "default": {
+        "BACKEND": config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        "LOCATION": config('CACHE_LOCATION', default='digito'),
+    }
+}
+# Version bumps only reach the worker that made them on a per-process cache;
+# entries cached until their version changes are also rebuilt this often (seconds)
+CACHE_MAX_STALENESS = config('CACHE_MAX_STALENESS', default=300, cast=int)
+
+# Catalog
+# Seconds a facet count result stays cached for one filter combination
+PRODUCT_FACET_CACHE_TIMEOUT = config('PRODUCT_FACET_CACHE_TIMEOUT', default=300, cast=int)
+# View counters are buffered per worker and flushed every N seconds or M views
+VIEW_COUNTER_FLUSH_INTERVAL = config('VIEW_COUNTER_FLUSH_INTERVAL', default=30, cast=int)
+VIEW_COUNTER_MAX_PENDING = config('VIEW_COUNTER_MAX_PENDING', default=500, cast=int)
+# 'offset' for numbered pages, 'keyset' for cursor pages with an approximate count
+PRODUCT_LISTING_PAGINATION = config('PRODUCT_LISTING_PAGINATION', default='offset')
+# Answer listing filters and sorts from a per-worker in-memory index
+PRODUCT_CATALOG_INDEX = config('PRODUCT_CATALOG_INDEX', default=False, cast=bool)
+
+# Co-purchase recommendations
+# Orders are mined once they are this old, so unpaid ones have expired
+CO_PURCHASE_ORDER_LAG_HOURS = config('CO_PURCHASE_ORDER_LAG_HOURS', default=2, cast=int)
+# Pairs bought together fewer times than this are not recommended
+CO_PURCHASE_MIN_COUNT = config('CO_PURCHASE_MIN_COUNT', default=2, cast=int)
+CO_PURCHASE_MAX_BASKET_SIZE = config('CO_PURCHASE_MAX_BASKET_SIZE', default=50, cast=int)
+# Neighbours kept per product, by score
+CO_PURCHASE_TOP_K = config('CO_PURCHASE_TOP_K', default=20, cast=int)
+
+# Responsive images
+# Widths (px) and formats of the variants generated for uploaded images
+IMAGE_VARIANT_WIDTHS = config('IMAGE_VARIANT_WIDTHS', default='160,320,640,960', cast=Csv(int))
+IMAGE_VARIANT_FORMATS = config('IMAGE_VARIANT_FORMATS', default='avif,webp', cast=Csv())
+# Encode uploads right after commit in the saving process; otherwise pages
+# show the original until generate_image_variants encodes them
+IMAGE_VARIANTS_INLINE = config('IMAGE_VARIANTS_INLINE', default=False, cast=bool)
+# Encoder processes used by generate_image_variants
+IMAGE_VARIANT_WORKERS = config('IMAGE_VARIANT_WORKERS', default=2, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
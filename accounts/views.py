@@ -9,6 +9,7 @@ from django.views.generic import FormView, UpdateView
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from django.conf import settings
+from django.db.models import F
 from datetime import timedelta
 import random
 
@@ -45,16 +46,13 @@ def dashboard(request):
     # Points (can be based on purchases)
     points = orders_count * 10  # 10 points per order
     
-    # Cancel expired pending orders
-    Order.cancel_expired_pending_orders()
-    
     # Recent orders
     recent_orders = Order.objects.filter(user=request.user).order_by('-created_at')[:5]
     
     # Recommended products (featured or best-selling products)
     recommended_products = Product.objects.filter(
-        stock__gt=0
-    ).order_by('-sales', '-created_at')[:8]
+        stock__gt=F('reserved_stock')
+    ).select_related('cover_image').order_by('-sales', '-created_at')[:8]
     
     # Check favorites for each product
     user_favorites = set(Favorite.objects.filter(user=request.user).values_list('product_id', flat=True))
@@ -128,7 +126,7 @@ class UserDetailsView(LoginRequiredMixin, UpdateView):
 @login_required
 def dashboard_favorites(request):
     """User favorites page"""
-    favorites = Favorite.objects.filter(user=request.user).select_related('product')
+    favorites = Favorite.objects.filter(user=request.user).select_related('product__cover_image')
     products = [fav.product for fav in favorites]
     return render(request, 'accounts/dashboardFavorites.html', {'products': products, 'favorites': favorites})
 
@@ -176,9 +174,6 @@ def toggle_favorite(request):
 def dashboard_orders(request):
     """User orders list"""
     from orders.models import Order
-    # Cancel expired pending orders
-    Order.cancel_expired_pending_orders()
-    
     orders = Order.objects.filter(user=request.user).order_by('-created_at')
     return render(request, 'accounts/dashboardOrders.html', {'orders': orders})
 
@@ -189,7 +184,7 @@ def dashboard_order_details(request, order_id):
     order = get_object_or_404(Order, id=order_id, user=request.user)
     return render(request, 'accounts/dashboardOrdersDetails.html', {
         'order': order,
-        'order_items': order.items.all(),
+        'order_items': order.items.select_related('product__cover_image'),
     })
 
 
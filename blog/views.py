@@ -6,6 +6,7 @@ from django.contrib import messages
 
 from .models import Post, Category, Comment
 from .forms import CommentForm
+from core.counters import record_view
 
 
 def blog(request):
@@ -85,10 +86,8 @@ def blog_detail(request, pk):
                     error_messages.append(f'{field}: {error}')
             messages.error(request, f'خطا در ثبت دیدگاه: {" ".join(error_messages)}')
     
-    # Increment view count (only for GET request)
-    if request.method == 'GET':
-        post.views += 1
-        post.save(update_fields=['views'])
+    # Buffered view count (only for GET requests from real browsers)
+    record_view(request, post)
     
     context = {
         'post': post,
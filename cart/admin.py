@@ -29,6 +29,10 @@ class CartAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        # Totals in the list come from the prefetched items
+        return super().get_queryset(request).select_related('user').with_items()
+    
     def get_total_items(self, obj):
         return obj.get_total_items()
     get_total_items.short_description = 'تعداد آیتم‌ها'
@@ -1,8 +1,16 @@
 from django.db import models
+from django.db.models import F, Prefetch, Sum
 from accounts.models import MyUser
 from products.models import Product, Color
 
 
+class CartQuerySet(models.QuerySet):
+    def with_items(self):
+        """Prefetch items with their products, covers and colors"""
+        items = CartItem.objects.select_related('product__cover_image', 'color')
+        return self.prefetch_related(Prefetch('items', queryset=items))
+
+
 class Cart(models.Model):
     user = models.OneToOneField(MyUser, on_delete=models.CASCADE, related_name='cart', verbose_name="کاربر")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاریخ ایجاد")
@@ -13,14 +21,34 @@ class Cart(models.Model):
         verbose_name_plural = "سبدهای خرید"
         ordering = ['-updated_at']
 
+    objects = CartQuerySet.as_manager()
+
     def __str__(self):
         return f"سبد خرید {self.user.phone}"
 
+    def get_totals(self):
+        """
+        (total price, total items), from prefetched items when loaded and
+        otherwise from one aggregate. Memoized on the instance; reload the
+        cart after changing its items.
+        """
+        if not hasattr(self, '_totals'):
+            items = getattr(self, '_prefetched_objects_cache', {}).get('items')
+            if items is not None:
+                self._totals = (sum(item.get_total_price() for item in items), sum(item.quantity for item in items))
+            else:
+                totals = self.items.aggregate(
+                    price=Sum(F('quantity') * F('product__price'), output_field=models.PositiveBigIntegerField()),
+                    count=Sum('quantity'),
+                )
+                self._totals = (totals['price'] or 0, totals['count'] or 0)
+        return self._totals
+
     def get_total_price(self):
-        return sum(item.get_total_price() for item in self.items.all())
+        return self.get_totals()[0]
 
     def get_total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.get_totals()[1]
 
 
 class CartItem(models.Model):
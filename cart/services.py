@@ -0,0 +1,176 @@
+"""
+Carts of the current request.
+
+Guests keep their cart in the session as
+{'<product_id>_<color_id or none>': {'product_id', 'color_id', 'quantity'}}.
+GuestCart hydrates every item with one in_bulk() for products and one for
+colors, and get_guest_cart() memoizes it on the request so the view and the
+cart context processor share a single hydration. get_user_cart() does the
+same for a signed-in user's Cart, with its items prefetched.
+merge_session_cart() folds the guest cart into the user's cart on login.
+"""
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Greatest
+
+from products.models import Product, Color
+from .models import Cart, CartItem
+
+
+def get_user_cart(request, create=False):
+    """The user's cart with items prefetched, loaded once per request"""
+    cart = getattr(request, '_user_cart', None)
+    if cart is None:
+        cart = Cart.objects.with_items().filter(user=request.user).first()
+        if cart is None and create:
+            Cart.objects.create(user=request.user)
+            cart = Cart.objects.with_items().get(user=request.user)
+        request._user_cart = cart
+    return cart
+
+
+def get_session_cart(request):
+    """Get cart from session"""
+    if 'cart' not in request.session:
+        request.session['cart'] = {}
+    return request.session['cart']
+
+
+def _parse_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class GuestCartItem:
+    item_key: str
+    product: Product
+    color: Color | None
+    quantity: int
+
+    def get_total_price(self):
+        return self.product.price * self.quantity
+
+
+class GuestCart:
+    """Session cart items with their products and colors loaded"""
+
+    def __init__(self, request):
+        self.request = request
+        self.session_cart = request.session.get('cart') or {}
+        product_ids = {_parse_id(data.get('product_id')) for data in self.session_cart.values()} - {None}
+        color_ids = {_parse_id(data.get('color_id')) for data in self.session_cart.values()} - {None}
+        products = Product.objects.select_related('cover_image').in_bulk(product_ids) if product_ids else {}
+        colors = Color.objects.in_bulk(color_ids) if color_ids else {}
+
+        self.items = []
+        for item_key, data in self.session_cart.items():
+            product = products.get(_parse_id(data.get('product_id')))
+            color_id = _parse_id(data.get('color_id'))
+            # Items whose product or color was deleted are skipped
+            if product is None or (color_id is not None and color_id not in colors):
+                continue
+            self.items.append(GuestCartItem(item_key, product, colors.get(color_id), data.get('quantity', 1)))
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, item_key):
+        return next((item for item in self.items if item.item_key == item_key), None)
+
+    def set_quantity(self, item_key, quantity):
+        self.session_cart[item_key]['quantity'] = quantity
+        self.request.session.modified = True
+        item = self.get(item_key)
+        if item is not None:
+            item.quantity = quantity
+
+    def remove(self, item_key):
+        del self.session_cart[item_key]
+        self.request.session.modified = True
+        self.items = [item for item in self.items if item.item_key != item_key]
+
+    def get_total_price(self):
+        return sum(item.get_total_price() for item in self.items)
+
+    def get_total_items(self):
+        return sum(item.quantity for item in self.items)
+
+
+def get_guest_cart(request):
+    """The request's guest cart, hydrated once per request"""
+    guest_cart = getattr(request, '_guest_cart', None)
+    if guest_cart is None:
+        guest_cart = request._guest_cart = GuestCart(request)
+    return guest_cart
+
+
+def forget_guest_cart(request):
+    """Drop the memoized cart after the session cart changed behind its back"""
+    request.__dict__.pop('_guest_cart', None)
+
+
+def merge_session_cart(user, session_cart):
+    """
+    Add the session cart's quantities to the user's cart in a fixed number
+    of queries, however many items the guest collected. Items of deleted
+    products or colors are dropped, quantities are clamped to available stock
+    and items with none left are removed.
+    """
+    wanted = Counter()
+    for data in session_cart.values():
+        product_id = _parse_id(data.get('product_id'))
+        if product_id is not None:
+            wanted[(product_id, _parse_id(data.get('color_id')))] += data.get('quantity', 1)
+    if not wanted:
+        return
+
+    product_ids = set(Product.objects.filter(id__in={product_id for product_id, _ in wanted}).values_list('id', flat=True))
+    color_ids = {color_id for _, color_id in wanted} - {None}
+    color_ids = set(Color.objects.filter(id__in=color_ids).values_list('id', flat=True)) if color_ids else set()
+    wanted = {
+        (product_id, color_id): quantity for (product_id, color_id), quantity in wanted.items()
+        if product_id in product_ids and (color_id is None or color_id in color_ids)
+    }
+    if not wanted:
+        return
+
+    with transaction.atomic():
+        # The cart lock serializes merges into the same cart
+        cart, _ = Cart.objects.select_for_update().get_or_create(user=user)
+        existing = {
+            (product_id, color_id): pk
+            for pk, product_id, color_id in CartItem.objects.filter(
+                cart=cart, product_id__in=product_ids,
+            ).values_list('pk', 'product_id', 'color_id')
+        }
+        increments, created = defaultdict(list), []
+        for key, quantity in wanted.items():
+            pk = existing.get(key)
+            if pk is None:
+                created.append(CartItem(cart=cart, product_id=key[0], color_id=key[1], quantity=quantity))
+            else:
+                increments[quantity].append(pk)
+        # Added in SQL so a concurrent change to the row is kept; one UPDATE per distinct quantity
+        for quantity, pks in increments.items():
+            CartItem.objects.filter(pk__in=pks).update(quantity=F('quantity') + quantity)
+        # A colored item added concurrently by another request keeps its own quantity
+        CartItem.objects.bulk_create(created, ignore_conflicts=True)
+
+        CartItem.objects.filter(
+            cart=cart, product_id__in=product_ids, product__stock__lte=F('product__reserved_stock'),
+        ).delete()
+        available = Product.objects.filter(pk=OuterRef('product_id')).values(
+            available=Greatest(F('stock') - F('reserved_stock'), 0),
+        )
+        CartItem.objects.filter(
+            cart=cart, product_id__in=product_ids, quantity__gt=F('product__stock') - F('product__reserved_stock'),
+        ).update(quantity=Subquery(available))
@@ -1,3 +1,194 @@
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-# Create your tests here.
+from accounts.models import MyUser
+from products.models import Product, Category, Color
+from .models import Cart, CartItem
+from .services import merge_session_cart
+
+TEST_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class GuestCartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='موبایل')
+        cls.products = [
+            Product.objects.create(title=f'گوشی {i}', description='-', category=category, price=100 * (i + 1), stock=5)
+            for i in range(3)
+        ]
+        cls.colors = [Color.objects.create(name=name, hex_code='#000000') for name in ('مشکی', 'سفید')]
+
+    def fill_session(self, *items):
+        session = self.client.session
+        session['cart'] = {
+            f'{product.pk}_{color.pk if color else "none"}': {
+                'product_id': str(product.pk),
+                'color_id': str(color.pk) if color else None,
+                'quantity': quantity,
+            }
+            for product, color, quantity in items
+        }
+        session.save()
+
+    def test_cart_page_hydrates_items_once(self):
+        self.fill_session((self.products[0], self.colors[0], 1))
+        self.client.get(reverse('cart'))
+        with CaptureQueriesContext(connection) as one_item:
+            self.client.get(reverse('cart'))
+
+        self.fill_session(
+            (self.products[0], self.colors[0], 1),
+            (self.products[1], self.colors[1], 2),
+            (self.products[2], None, 3),
+        )
+        with self.assertNumQueries(len(one_item)):
+            response = self.client.get(reverse('cart'))
+        self.assertEqual([item.get_total_price() for item in response.context['cart_items']], [100, 400, 900])
+        self.assertEqual(response.context['total_price'], 1400)
+        self.assertEqual(response.context['cart_total_price'], 1400)
+        self.assertEqual(response.context['cart_items_count'], 6)
+
+    def test_deleted_products_are_skipped(self):
+        self.fill_session((self.products[0], None, 1), (self.products[1], self.colors[0], 1))
+        self.products[1].delete()
+        response = self.client.get(reverse('cart'))
+        self.assertEqual([item.product for item in response.context['cart_items']], [self.products[0]])
+
+    def test_update_and_remove_return_totals(self):
+        self.fill_session((self.products[0], None, 1), (self.products[1], None, 1))
+        key = f'{self.products[0].pk}_none'
+
+        response = self.client.post(reverse('update_session_cart_item', args=[key]), {'quantity': 3}).json()
+        self.assertEqual((response['item_total'], response['cart_total'], response['cart_items_count']), (300, 500, 4))
+        response = self.client.post(reverse('update_session_cart_item', args=[key]), {'quantity': 9})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(reverse('remove_session_cart_item', args=[key])).json()
+        self.assertEqual((response['cart_total'], response['cart_items_count']), (200, 1))
+        self.assertEqual(list(self.client.session['cart']), [f'{self.products[1].pk}_none'])
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class UserCartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(phone='09120000000')
+        category = Category.objects.create(name='موبایل')
+        cls.products = [
+            Product.objects.create(title=f'گوشی {i}', description='-', category=category, price=100 * (i + 1), stock=5)
+            for i in range(4)
+        ]
+        cls.color = Color.objects.create(name='مشکی', hex_code='#000000')
+        cls.cart = Cart.objects.create(user=cls.user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def add(self, product, quantity=1, color=None):
+        return CartItem.objects.create(cart=self.cart, product=product, quantity=quantity, color=color)
+
+    def assertQueriesDoNotGrow(self, url):
+        """Queries for url stay the same when the cart grows from one item to four"""
+        self.add(self.products[0], color=self.color)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as one_item:
+            self.client.get(url)
+        for product in self.products[1:]:
+            self.add(product, quantity=2)
+        with self.assertNumQueries(len(one_item)):
+            return self.client.get(url)
+
+    def test_totals_use_one_aggregate(self):
+        self.add(self.products[0], quantity=2)
+        self.add(self.products[1], quantity=3)
+        cart = Cart.objects.get(pk=self.cart.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.get_total_price(), 800)
+            self.assertEqual(cart.get_total_items(), 5)
+
+    def test_prefetched_totals_need_no_queries(self):
+        self.add(self.products[0], quantity=2)
+        cart = Cart.objects.with_items().get(pk=self.cart.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(cart.get_totals(), (200, 2))
+            self.assertEqual([item.product.cover_image for item in cart.items.all()], [None])
+
+    def test_empty_cart_totals(self):
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).get_totals(), (0, 0))
+
+    def test_cart_page_queries_do_not_grow(self):
+        response = self.assertQueriesDoNotGrow(reverse('cart'))
+        self.assertEqual(response.context['total_price'], 100 + 2 * (200 + 300 + 400))
+        self.assertEqual(response.context['cart_items_count'], 7)
+
+    def test_header_mini_cart_queries_do_not_grow(self):
+        response = self.assertQueriesDoNotGrow(reverse('home_page'))
+        self.assertEqual(response.context['cart_total_price'], 1900)
+
+
+class MergeSessionCartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(phone='09120000000')
+        category = Category.objects.create(name='موبایل')
+        cls.products = [
+            Product.objects.create(title=f'گوشی {i}', description='-', category=category, price=100, stock=5)
+            for i in range(6)
+        ]
+        cls.colors = [Color.objects.create(name=name, hex_code='#000000') for name in ('مشکی', 'سفید')]
+
+    def session_cart(self, *items):
+        return {
+            f'{product_id}_{color_id or "none"}': {'product_id': str(product_id), 'color_id': color_id, 'quantity': quantity}
+            for product_id, color_id, quantity in items
+        }
+
+    def quantities(self):
+        return {
+            (item.product_id, item.color_id): item.quantity
+            for item in CartItem.objects.filter(cart__user=self.user)
+        }
+
+    def test_merge_adds_clamps_and_drops(self):
+        cart = Cart.objects.create(user=self.user)
+        first, second, third, sold_out, reserved = self.products[:5]
+        Product.objects.filter(pk=sold_out.pk).update(stock=0)
+        Product.objects.filter(pk=reserved.pk).update(reserved_stock=5)
+        CartItem.objects.create(cart=cart, product=first, quantity=2)
+        CartItem.objects.create(cart=cart, product=second, color=self.colors[0], quantity=1)
+        CartItem.objects.create(cart=cart, product=sold_out, quantity=1)
+        merge_session_cart(self.user, self.session_cart(
+            (first.pk, None, 2),
+            (second.pk, str(self.colors[0].pk), 9),
+            (third.pk, str(self.colors[1].pk), 1),
+            (third.pk, '999', 1),
+            (999, None, 1),
+            (sold_out.pk, None, 1),
+            (reserved.pk, None, 1),
+        ))
+        self.assertEqual(self.quantities(), {
+            (first.pk, None): 4,
+            (second.pk, self.colors[0].pk): 5,
+            (third.pk, self.colors[1].pk): 1,
+        })
+
+    def test_merge_creates_missing_cart(self):
+        merge_session_cart(self.user, self.session_cart((self.products[0].pk, None, 1)))
+        self.assertEqual(self.quantities(), {(self.products[0].pk, None): 1})
+
+    def test_queries_do_not_grow_with_cart_size(self):
+        Cart.objects.create(user=self.user)
+        with CaptureQueriesContext(connection) as one_item:
+            merge_session_cart(self.user, self.session_cart((self.products[0].pk, str(self.colors[0].pk), 1)))
+        CartItem.objects.all().delete()
+        items = [(product.pk, str(color.pk), 1) for product in self.products for color in self.colors]
+        with self.assertNumQueries(len(one_item)):
+            merge_session_cart(self.user, self.session_cart(*items))
+        self.assertEqual(len(self.quantities()), 12)
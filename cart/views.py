@@ -6,16 +6,10 @@ from django.views.decorators.csrf import csrf_exempt
 import json
 
 from .models import Cart, CartItem
+from .services import get_session_cart, get_guest_cart, forget_guest_cart, get_user_cart, merge_session_cart
 from products.models import Product, Color
 
 
-def get_session_cart(request):
-    """Get cart from session"""
-    if 'cart' not in request.session:
-        request.session['cart'] = {}
-    return request.session['cart']
-
-
 def get_cart_total_from_session(request):
     """Calculate total cart items count from session"""
     cart = get_session_cart(request)
@@ -31,81 +25,31 @@ def sync_session_cart_to_user_cart(request):
     if not session_cart:
         return
     
-    cart_obj, created = Cart.objects.get_or_create(user=request.user)
-    
-    for item_key, item_data in session_cart.items():
-        try:
-            product_id = item_data.get('product_id')
-            color_id = item_data.get('color_id')
-            quantity = item_data.get('quantity', 1)
-            
-            product = Product.objects.get(id=product_id)
-            color = None
-            if color_id:
-                color = Color.objects.get(id=color_id)
-            
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart_obj,
-                product=product,
-                color=color,
-                defaults={'quantity': quantity}
-            )
-            
-            if not created:
-                cart_item.quantity += quantity
-                if cart_item.quantity > product.stock:
-                    cart_item.quantity = product.stock
-                cart_item.save()
-        except (Product.DoesNotExist, Color.DoesNotExist):
-            continue
+    merge_session_cart(request.user, session_cart)
     
     # Clear session cart after sync
     request.session['cart'] = {}
+    forget_guest_cart(request)
 
 
 def cart(request):
     """Display cart - for logged-in and guest users"""
     if request.user.is_authenticated:
-        cart_obj, created = Cart.objects.get_or_create(user=request.user)
-        cart_items = cart_obj.items.all()
-        total_price = cart_obj.get_total_price()
+        # Shared with the header mini-cart through the context processor
+        cart_obj = get_user_cart(request, create=True)
         
         return render(request, 'cart/cart.html', {
             'cart': cart_obj,
-            'cart_items': cart_items,
-            'total_price': total_price,
+            'cart_items': cart_obj.items.all(),
+            'total_price': cart_obj.get_total_price(),
             'is_authenticated': True,
         })
     else:
-        # Display cart from session
-        session_cart = get_session_cart(request)
-        cart_items = []
-        total_price = 0
-        
-        for item_key, item_data in session_cart.items():
-            try:
-                product = Product.objects.get(id=item_data.get('product_id'))
-                color = None
-                if item_data.get('color_id'):
-                    color = Color.objects.get(id=item_data.get('color_id'))
-                
-                quantity = item_data.get('quantity', 1)
-                item_total = product.price * quantity
-                total_price += item_total
-                
-                cart_items.append({
-                    'product': product,
-                    'color': color,
-                    'quantity': quantity,
-                    'item_key': item_key,
-                    'get_total_price': lambda: item_total
-                })
-            except (Product.DoesNotExist, Color.DoesNotExist):
-                continue
-        
+        # Display cart from session, hydrated once for the view and the context processor
+        guest_cart = get_guest_cart(request)
         return render(request, 'cart/cart.html', {
-            'cart_items': cart_items,
-            'total_price': total_price,
+            'cart_items': guest_cart.items,
+            'total_price': guest_cart.get_total_price(),
             'is_authenticated': False,
         })
 
@@ -121,7 +65,7 @@ def add_to_cart(request):
         product = Product.objects.get(id=product_id)
         
         # Check stock
-        if product.stock < quantity:
+        if product.available_stock < quantity:
             return JsonResponse({
                 'success': False,
                 'error': 'موجودی کافی نیست'
@@ -145,8 +89,8 @@ def add_to_cart(request):
 
             if not created:
                 cart_item.quantity += quantity
-                if cart_item.quantity > product.stock:
-                    cart_item.quantity = product.stock
+                if cart_item.quantity > product.available_stock:
+                    cart_item.quantity = product.available_stock
                 cart_item.save()
 
             cart_total = cart_obj.get_total_items()
@@ -160,8 +104,8 @@ def add_to_cart(request):
             if item_key in session_cart:
                 # Update quantity
                 session_cart[item_key]['quantity'] += quantity
-                if session_cart[item_key]['quantity'] > product.stock:
-                    session_cart[item_key]['quantity'] = product.stock
+                if session_cart[item_key]['quantity'] > product.available_stock:
+                    session_cart[item_key]['quantity'] = product.available_stock
             else:
                 # Add new item
                 session_cart[item_key] = {
@@ -172,6 +116,7 @@ def add_to_cart(request):
             
             request.session['cart'] = session_cart
             request.session.modified = True
+            forget_guest_cart(request)
             cart_total = get_cart_total_from_session(request)
 
         return JsonResponse({
@@ -208,7 +153,7 @@ def update_cart_item(request, item_id):
                 'message': 'آیتم حذف شد'
             })
 
-        if quantity > cart_item.product.stock:
+        if quantity > cart_item.product.available_stock:
             return JsonResponse({
                 'success': False,
                 'error': 'موجودی کافی نیست'
@@ -279,91 +224,63 @@ def update_session_cart_item(request, item_key):
     """Update item quantity in session cart"""
     quantity = int(request.POST.get('quantity', 1))
     
-    session_cart = get_session_cart(request)
+    guest_cart = get_guest_cart(request)
     
-    if item_key not in session_cart:
+    if item_key not in guest_cart.session_cart:
         return JsonResponse({
             'success': False,
             'error': 'آیتم یافت نشد'
         }, status=404)
     
-    try:
-        product = Product.objects.get(id=session_cart[item_key].get('product_id'))
-        
-        if quantity <= 0:
-            del session_cart[item_key]
-            request.session.modified = True
-            return JsonResponse({
-                'success': True,
-                'message': 'آیتم حذف شد',
-                'cart_total': 0,
-                'cart_items_count': get_cart_total_from_session(request)
-            })
-        
-        if quantity > product.stock:
-            return JsonResponse({
-                'success': False,
-                'error': 'موجودی کافی نیست'
-            }, status=400)
-        
-        session_cart[item_key]['quantity'] = quantity
-        request.session.modified = True
-        
-        # Calculate total price
-        total_price = 0
-        for item_data in session_cart.values():
-            try:
-                prod = Product.objects.get(id=item_data.get('product_id'))
-                qty = item_data.get('quantity', 1)
-                total_price += prod.price * qty
-            except Product.DoesNotExist:
-                continue
-        
-        # Calculate item price
-        item_total = product.price * quantity
-        
+    item = guest_cart.get(item_key)
+    if item is None:
+        return JsonResponse({
+            'success': False,
+            'error': 'محصول یافت نشد'
+        }, status=404)
+    
+    if quantity <= 0:
+        guest_cart.remove(item_key)
         return JsonResponse({
             'success': True,
-            'item_total': item_total,
-            'cart_total': total_price,
-            'cart_items_count': get_cart_total_from_session(request)
+            'message': 'آیتم حذف شد',
+            'cart_total': guest_cart.get_total_price(),
+            'cart_items_count': guest_cart.get_total_items()
         })
     
-    except Product.DoesNotExist:
+    if quantity > item.product.available_stock:
         return JsonResponse({
             'success': False,
-            'error': 'محصول یافت نشد'
-        }, status=404)
+            'error': 'موجودی کافی نیست'
+        }, status=400)
+    
+    guest_cart.set_quantity(item_key, quantity)
+    
+    return JsonResponse({
+        'success': True,
+        'item_total': item.get_total_price(),
+        'cart_total': guest_cart.get_total_price(),
+        'cart_items_count': guest_cart.get_total_items()
+    })
 
 
 @require_http_methods(["POST"])
 @csrf_exempt
 def remove_session_cart_item(request, item_key):
     """Remove item from session cart"""
-    session_cart = get_session_cart(request)
+    guest_cart = get_guest_cart(request)
     
-    if item_key not in session_cart:
+    if item_key not in guest_cart.session_cart:
         return JsonResponse({
             'success': False,
             'error': 'آیتم یافت نشد'
         }, status=404)
     
-    del session_cart[item_key]
-    request.session.modified = True
-    
-    # Calculate total price
-    total_price = 0
-    for item_data in session_cart.values():
-        try:
-            product = Product.objects.get(id=item_data.get('product_id'))
-            quantity = item_data.get('quantity', 1)
-            total_price += product.price * quantity
-        except Product.DoesNotExist:
-            continue
+    guest_cart.remove(item_key)
     
     return JsonResponse({
         'success': True,
         'message': 'آیتم حذف شد',
-        'cart_total': total_price,
-        'cart_items_count': get_cart_total_from_session(request)
+        'cart_total': guest_cart.get_total_price(),
+        'cart_items_count': guest_cart.get_total_items()
     })
@@ -1,11 +1,4 @@
-from cart.models import Cart
-
-
-def get_session_cart(request):
-    """Get cart from session"""
-    if 'cart' not in request.session:
-        request.session['cart'] = {}
-    return request.session['cart']
+from cart.services import get_guest_cart, get_user_cart
 
 
 def cart_context(request):
@@ -17,29 +10,16 @@ def cart_context(request):
     }
     
     if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.prefetch_related('items__product__images').get(user=request.user)
+        cart = get_user_cart(request)
+        if cart is not None:
             context['cart'] = cart
             context['cart_items_count'] = cart.get_total_items()
             context['cart_total_price'] = cart.get_total_price()
-        except Cart.DoesNotExist:
-            pass
-    else:
-        # Calculate from session for guest users
-        session_cart = get_session_cart(request)
-        context['cart_items_count'] = sum(item.get('quantity', 0) for item in session_cart.values())
-        
-        # Calculate total price
-        from products.models import Product
-        total_price = 0
-        for item_data in session_cart.values():
-            try:
-                product = Product.objects.get(id=item_data.get('product_id'))
-                quantity = item_data.get('quantity', 1)
-                total_price += product.price * quantity
-            except Product.DoesNotExist:
-                continue
-        context['cart_total_price'] = total_price
+    elif request.session.get('cart'):
+        # Calculate from session for guest users, sharing the view's hydration
+        guest_cart = get_guest_cart(request)
+        context['cart_items_count'] = guest_cart.get_total_items()
+        context['cart_total_price'] = guest_cart.get_total_price()
     
     return context
 
@@ -47,17 +27,9 @@ def cart_context(request):
 def categories_context(request):
     """Context processor for displaying categories in navigation with MPTT tree structure"""
     try:
-        from products.models import Category
-        # Only root level, but prefetch all subcategories for faster template rendering
-        categories = (
-            Category.objects.filter(parent__isnull=True)
-            .exclude(slug='')
-            .prefetch_related(
-                'children__children__children'  # Up to three levels
-            )
-            .order_by('name')
-        )
-        return {'categories': categories}
+        from products.category_tree import get_category_tree
+        # Root categories with up to three cached levels, shared by the worker
+        return {'categories': get_category_tree().roots}
     except Exception as e:
         # Better to log error for easier debugging
         import logging
@@ -69,9 +41,8 @@ def categories_context(request):
 def contact_info_context(request):
     """Context processor for displaying contact information in header and footer"""
     try:
-        from core.models import ContactInfo
-        contact_info = ContactInfo.objects.filter(is_active=True).first()
-        return {'contact_info': contact_info}
+        from core.site_config import get_site_config
+        return {'contact_info': get_site_config().contact_info}
     except Exception:
         return {'contact_info': None}
 
@@ -79,15 +50,12 @@ def contact_info_context(request):
 def footer_context(request):
     """Context processor for displaying footer information"""
     try:
-        from core.models import FooterLinkGroup, SocialMedia, FooterSettings
-        footer_groups = FooterLinkGroup.objects.filter(is_active=True).prefetch_related('links').order_by('order')
-        social_media = SocialMedia.objects.filter(is_active=True).order_by('order')
-        footer_settings = FooterSettings.objects.filter(is_active=True).first()
-        
+        from core.site_config import get_site_config
+        config = get_site_config()
         return {
-            'footer_groups': footer_groups,
-            'social_media': social_media,
-            'footer_settings': footer_settings,
+            'footer_groups': config.footer_groups,
+            'social_media': config.social_media,
+            'footer_settings': config.footer_settings,
         }
     except Exception:
         return {
@@ -95,4 +63,3 @@ def footer_context(request):
             'social_media': [],
             'footer_settings': None,
         }
-
@@ -18,3 +18,7 @@ class CoreConfig(AppConfig):
                 update_hidden_models()
         
         post_save.connect(refresh_hidden_models, sender=AdminSettings)
+
+        from core import images, site_config
+        images.connect_signals()
+        site_config.connect_signals()
@@ -0,0 +1,36 @@
+"""
+Versioned cache keys shared by the catalog caches
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+
+
+def _version_key(name):
+    return f'cache-version:{name}'
+
+
+def get_version(name):
+    """Current version number of a cache namespace"""
+    version = cache.get(_version_key(name))
+    if version is None:
+        # add() keeps a concurrent bump from being overwritten
+        cache.add(_version_key(name), 1, timeout=None)
+        version = cache.get(_version_key(name), 1)
+    return version
+
+
+def bump_version(name):
+    """Invalidate every key built on a namespace by moving to a new version"""
+    try:
+        return cache.incr(_version_key(name))
+    except ValueError:
+        cache.set(_version_key(name), 2, timeout=None)
+        return 2
+
+
+def make_key(name, *parts):
+    """Build a cache key from a namespace, its current version and a digest of parts"""
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+    return f'{name}:{get_version(name)}:{digest}'
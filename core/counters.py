@@ -0,0 +1,156 @@
+"""
+Write-behind view counters.
+
+Page views are accumulated in process memory and written in batches of
+`UPDATE ... SET views = views + n`, instead of one row write per request.
+A worker flushes when its buffer holds VIEW_COUNTER_MAX_PENDING views,
+from a daemon timer VIEW_COUNTER_FLUSH_INTERVAL seconds after the first
+pending view, and again at exit. The most a crashed worker can lose is one
+interval's worth of views.
+
+These UPDATEs send no model signals; views_flushed tells listeners (the
+catalog index) which rows of a model changed.
+"""
+import atexit
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import F
+from django.dispatch import Signal
+
+logger = logging.getLogger(__name__)
+
+# Sent once per model after a flush, with the pks whose counters were written
+views_flushed = Signal()
+
+BOT_USER_AGENT_RE = re.compile(
+    r'bot|crawl|spider|slurp|archiver|preview|headless|lighthouse|curl|wget|python-requests|httpx|go-http-client',
+    re.IGNORECASE,
+)
+
+
+def is_bot(request):
+    """Treat empty and well-known automated user agents as bots"""
+    user_agent = request.META.get('HTTP_USER_AGENT', '')
+    return not user_agent or bool(BOT_USER_AGENT_RE.search(user_agent))
+
+
+class ViewCounterBuffer:
+    """Thread-safe in-process buffer of pending view increments"""
+
+    def __init__(self, field='views'):
+        self.field = field
+        self._lock = threading.Lock()
+        self._pending = defaultdict(int)
+        self._pending_total = 0
+        self._last_flush = time.monotonic()
+        self._timer = None
+        self._pid = os.getpid()
+
+    def record(self, obj):
+        key = (obj._meta.label_lower, obj.pk)
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked worker: the parent flushes its own views, and its timer did not survive the fork
+                self._pid = os.getpid()
+                self._pending, self._pending_total, self._timer = defaultdict(int), 0, None
+            self._pending[key] += 1
+            self._pending_total += 1
+            due = (
+                self._pending_total >= settings.VIEW_COUNTER_MAX_PENDING
+                or time.monotonic() - self._last_flush >= settings.VIEW_COUNTER_FLUSH_INTERVAL
+            )
+            if not due:
+                self._arm_timer()
+        if due:
+            self.flush()
+
+    def _arm_timer(self):
+        """Schedule a flush one interval from now unless one is pending; call with the lock held"""
+        if self._timer is None:
+            self._timer = threading.Timer(settings.VIEW_COUNTER_FLUSH_INTERVAL, self._flush_on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_on_timer(self):
+        """Flush from the timer thread, which then closes its own database connections"""
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to flush view counts")
+        finally:
+            connections.close_all()
+
+    def pending(self, obj):
+        """Views recorded for obj but not yet written"""
+        with self._lock:
+            return self._pending.get((obj._meta.label_lower, obj.pk), 0)
+
+    def _take(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+            self._pending_total = 0
+            self._last_flush = time.monotonic()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        return pending
+
+    def flush(self):
+        """Write every pending increment; returns the number of UPDATE statements"""
+        pending = self._take()
+        if not pending:
+            return 0
+
+        # Group by model and increment so each group is one UPDATE
+        groups = defaultdict(list)
+        for (label, pk), count in pending.items():
+            groups[(label, count)].append(pk)
+
+        statements = 0
+        flushed = defaultdict(list)
+        for (label, count), pks in groups.items():
+            model = apps.get_model(label)
+            try:
+                model.objects.filter(pk__in=pks).update(**{self.field: F(self.field) + count})
+                statements += 1
+                flushed[model] += pks
+            except DatabaseError:
+                logger.exception("Failed to flush %s view counts for %s", count, label)
+                self._restore(label, pks, count)
+        for model, pks in flushed.items():
+            views_flushed.send(sender=model, pks=pks)
+        return statements
+
+    def _restore(self, label, pks, count):
+        """Put increments back after a failed write so the next flush retries them"""
+        with self._lock:
+            for pk in pks:
+                self._pending[(label, pk)] += count
+                self._pending_total += count
+            self._arm_timer()
+
+
+view_counter = ViewCounterBuffer()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        view_counter.flush()
+    except Exception:
+        logger.exception("Failed to flush view counts at exit")
+
+
+def record_view(request, obj):
+    """Count a page view of obj unless the request comes from a bot"""
+    if request.method != 'GET' or is_bot(request):
+        return
+    view_counter.record(obj)
@@ -0,0 +1,168 @@
+"""
+Responsive image variants.
+
+Uploaded images are re-encoded as WebP/AVIF at each configured width
+(IMAGE_VARIANT_WIDTHS) into `<upload dir>/variants/`, named after a hash
+of their content so they can be cached forever. The resulting paths are
+stored on the model's `variants` JSON field:
+
+    {'source': 'products/gallery/a.jpg', 'width': 1200, 'height': 900,
+     'webp': {'320': 'products/gallery/variants/a-320w.1f2e....webp', ...},
+     'avif': {...}}
+
+Encoding is CPU-heavy, so web workers do not do it: until the
+generate_image_variants command (run from cron or after imports) has
+encoded an upload, get_variants() returns nothing and pages show the
+original. Setting IMAGE_VARIANTS_INLINE encodes right after commit in the
+saving process instead, for development and tests.
+"""
+import hashlib
+import io
+import logging
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# Image field of every model that carries a `variants` field
+VARIANT_FIELDS = {
+    'products.ProductImage': 'image',
+    'products.Category': 'image',
+    'products.Brand': 'logo',
+    'core.Banner': 'image',
+}
+
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp'}
+QUALITY = {'avif': 55, 'webp': 80}
+
+
+def available_formats():
+    """Configured formats this Pillow build can encode"""
+    return [fmt for fmt in settings.IMAGE_VARIANT_FORMATS if fmt in MIME_TYPES and features.check(fmt)]
+
+
+def render_variants(data, widths, formats):
+    """
+    Encode the image in `data` at every width narrower than the source
+    (or the source width when all are wider). Runs in worker processes,
+    so it only takes and returns plain bytes and numbers.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        source = ImageOps.exif_transpose(source)
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+        source_width, source_height = source.size
+        targets = sorted({width for width in widths if width < source_width}) or [source_width]
+
+        rendered = []
+        for width in targets:
+            height = max(1, round(source_height * width / source_width))
+            resized = source if width == source_width else source.resize((width, height), Image.LANCZOS)
+            for fmt in formats:
+                buffer = io.BytesIO()
+                resized.save(buffer, format=fmt.upper(), quality=QUALITY[fmt])
+                rendered.append((fmt, width, buffer.getvalue()))
+    return source_width, source_height, rendered
+
+
+def variant_name(source_name, fmt, width, content):
+    """Content-hashed name next to the source, under variants/"""
+    directory, filename = os.path.split(source_name)
+    stem = os.path.splitext(filename)[0]
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return f'{directory}/variants/{stem}-{width}w.{digest}.{fmt}'
+
+
+def store_variants(model, pk, field_name, source_name, result):
+    """Save rendered variants and record them, unless the image changed meanwhile"""
+    source_width, source_height, rendered = result
+    field = model._meta.get_field(field_name)
+    storage = field.storage
+    variants = {'source': source_name, 'width': source_width, 'height': source_height}
+    for fmt, width, content in rendered:
+        name = variant_name(source_name, fmt, width, content)
+        if not storage.exists(name):
+            name = storage.save(name, ContentFile(content))
+        variants.setdefault(fmt, {})[str(width)] = name
+
+    old = model.objects.filter(pk=pk, **{field_name: source_name}).values_list('variants', flat=True).first()
+    updated = model.objects.filter(pk=pk, **{field_name: source_name}).update(variants=variants)
+    if not updated:
+        # Replaced or deleted while encoding
+        delete_variant_files(storage, variants)
+    elif old:
+        delete_variant_files(storage, old, keep=variants)
+    return variants
+
+
+def delete_variant_files(storage, variants, keep=None):
+    kept = set(variant_paths(keep or {}))
+    for name in variant_paths(variants):
+        if name not in kept:
+            storage.delete(name)
+
+
+def variant_paths(variants):
+    for fmt in MIME_TYPES:
+        yield from variants.get(fmt, {}).values()
+
+
+def generate_variants(instance, field_name=None):
+    """Encode and store variants for one instance in this process"""
+    field_name = field_name or VARIANT_FIELDS[instance._meta.label]
+    file = getattr(instance, field_name)
+    with file.open('rb') as source:
+        data = source.read()
+    result = render_variants(data, settings.IMAGE_VARIANT_WIDTHS, available_formats())
+    variants = store_variants(type(instance), instance.pk, field_name, file.name, result)
+    instance.variants = variants
+    return variants
+
+
+def needs_variants(instance, field_name):
+    file = getattr(instance, field_name)
+    return bool(file) and (instance.variants or {}).get('source') != file.name
+
+
+def schedule_variants(sender, instance, raw=False, **kwargs):
+    """post_save: with IMAGE_VARIANTS_INLINE, (re)generate variants once a new upload is committed"""
+    field_name = VARIANT_FIELDS[sender._meta.label]
+    if raw or not settings.IMAGE_VARIANTS_INLINE or not needs_variants(instance, field_name):
+        return
+
+    def run():
+        try:
+            generate_variants(instance, field_name)
+        except Exception:
+            logger.exception("Failed to generate image variants for %s %s", sender._meta.label, instance.pk)
+
+    transaction.on_commit(run)
+
+
+def discard_variants(sender, instance, **kwargs):
+    """post_delete: remove the variant files of a deleted image"""
+    if instance.variants:
+        field = sender._meta.get_field(VARIANT_FIELDS[sender._meta.label])
+        transaction.on_commit(lambda: delete_variant_files(field.storage, instance.variants))
+
+
+def connect_signals():
+    for label in VARIANT_FIELDS:
+        model = apps.get_model(label)
+        post_save.connect(schedule_variants, sender=model, dispatch_uid=f'image-variants-{label}')
+        post_delete.connect(discard_variants, sender=model, dispatch_uid=f'image-variants-delete-{label}')
+
+
+def get_variants(obj):
+    """Variants of obj when they match its current image, else an empty dict"""
+    variants = getattr(obj, 'variants', None) or {}
+    field_name = VARIANT_FIELDS.get(obj._meta.label)
+    if not field_name or variants.get('source') != getattr(obj, field_name).name:
+        return {}
+    return variants
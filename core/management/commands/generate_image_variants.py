@@ -0,0 +1,82 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.images import VARIANT_FIELDS, available_formats, needs_variants, render_variants, store_variants
+
+# Images being encoded at once per worker process; bounds the source and
+# encoded bytes held in memory
+JOBS_PER_WORKER = 2
+
+
+class Command(BaseCommand):
+    help = 'ساخت نسخه‌های WebP/AVIF تصاویر در اندازه‌های مختلف'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            action='append',
+            choices=sorted(VARIANT_FIELDS),
+            help='فقط این مدل (قابل تکرار)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='ساخت دوباره حتی برای تصاویری که نسخه دارند',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.IMAGE_VARIANT_WORKERS or 1,
+            help='تعداد پردازه‌های تبدیل تصویر',
+        )
+
+    def handle(self, *args, **options):
+        formats = available_formats()
+        if not formats:
+            raise CommandError('هیچ‌کدام از فرمت‌های IMAGE_VARIANT_FORMATS پشتیبانی نمی‌شود')
+
+        self.stored = self.failed = 0
+        workers = max(1, options['workers'])
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for label in options['model'] or VARIANT_FIELDS:
+                model = apps.get_model(label)
+                field_name = VARIANT_FIELDS[label]
+                pending = [
+                    obj for obj in model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+                    if options['force'] or needs_variants(obj, field_name)
+                ]
+                jobs = {}
+                for obj in pending:
+                    file = getattr(obj, field_name)
+                    try:
+                        with file.open('rb') as source:
+                            data = source.read()
+                    except OSError as exc:
+                        self.failed += 1
+                        self.stdout.write(self.style.WARNING(f'{label} {obj.pk}: {exc}'))
+                        continue
+                    future = executor.submit(render_variants, data, settings.IMAGE_VARIANT_WIDTHS, formats)
+                    jobs[future] = (obj.pk, file.name)
+                    if len(jobs) >= workers * JOBS_PER_WORKER:
+                        done, _ = wait(jobs, return_when=FIRST_COMPLETED)
+                        self.store(model, field_name, label, jobs, done)
+                self.store(model, field_name, label, jobs, list(jobs))
+                self.stdout.write(f'{label}: {len(pending)} تصویر')
+
+        self.stdout.write(self.style.SUCCESS(f'✓ نسخه‌های {self.stored} تصویر ساخته شد ({", ".join(formats)})'))
+        if self.failed:
+            self.stdout.write(self.style.WARNING(f'{self.failed} تصویر ناموفق بود'))
+
+    def store(self, model, field_name, label, jobs, futures):
+        """Store finished encodings and drop them from the in-flight jobs"""
+        for future in futures:
+            pk, source_name = jobs.pop(future)
+            try:
+                store_variants(model, pk, field_name, source_name, future.result())
+                self.stored += 1
+            except Exception as exc:
+                self.failed += 1
+                self.stdout.write(self.style.WARNING(f'{label} {pk}: {exc}'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_alter_about_image_alter_banner_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='banner',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='نسخه\u200cهای تصویر'),
+        ),
+    ]
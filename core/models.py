@@ -188,6 +188,7 @@ class Banner(models.Model):
         verbose_name="تصویر",
         help_text="سایز بهینه: بنر اصلی (Hero): 1920x384 پیکسل | بنر کناری: 300x600 پیکسل (نسبت 1:2) | بنر پایین: 1200x675 پیکسل (نسبت 16:9)"
     )
+    variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name="نسخه‌های تصویر")
     link = models.URLField(blank=True, null=True, verbose_name="لینک")
     banner_type = models.CharField(max_length=20, choices=BANNER_TYPE_CHOICES, default='hero', verbose_name="نوع بنر")
     order = models.PositiveIntegerField(default=0, verbose_name="ترتیب نمایش")
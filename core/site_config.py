@@ -0,0 +1,68 @@
+"""
+Site-wide contact and footer settings.
+
+Every page shows the contact info, footer link groups, social links and
+footer settings, which change a few times a year. They are read once into
+a SiteConfig snapshot stored in the shared cache under a versioned key;
+saving or deleting any of the source models bumps the version. The
+snapshot also expires after CACHE_MAX_STALENESS, so workers on a
+per-process cache, which never see another worker's bump, catch up.
+"""
+from dataclasses import dataclass
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from .cache_utils import bump_version, make_key
+
+CACHE_NAMESPACE = 'site-config'
+
+SOURCE_MODELS = ('core.ContactInfo', 'core.FooterLinkGroup', 'core.FooterLink', 'core.SocialMedia', 'core.FooterSettings')
+
+
+@dataclass(frozen=True)
+class SiteConfig:
+    contact_info: object
+    footer_groups: tuple
+    social_media: tuple
+    footer_settings: object
+
+    @classmethod
+    def build(cls):
+        from .models import ContactInfo, FooterLinkGroup, SocialMedia, FooterSettings
+        return cls(
+            contact_info=ContactInfo.objects.filter(is_active=True).first(),
+            footer_groups=tuple(FooterLinkGroup.objects.filter(is_active=True).prefetch_related('links').order_by('order')),
+            social_media=tuple(SocialMedia.objects.filter(is_active=True).order_by('order')),
+            footer_settings=FooterSettings.objects.filter(is_active=True).first(),
+        )
+
+
+def get_site_config():
+    """The cached snapshot, rebuilt after any change to its models"""
+    key = make_key(CACHE_NAMESPACE, 'snapshot')
+    config = cache.get(key)
+    if config is None:
+        config = SiteConfig.build()
+        cache.set(key, config, settings.CACHE_MAX_STALENESS)
+    return config
+
+
+def invalidate_site_config(sender, **kwargs):
+    bump_version(CACHE_NAMESPACE)
+
+
+def invalidate_site_config_on_links(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_version(CACHE_NAMESPACE)
+
+
+def connect_signals():
+    for label in SOURCE_MODELS:
+        model = apps.get_model(label)
+        post_save.connect(invalidate_site_config, sender=model, dispatch_uid=f'site-config-{label}')
+        post_delete.connect(invalidate_site_config, sender=model, dispatch_uid=f'site-config-delete-{label}')
+    links = apps.get_model('core.FooterLinkGroup').links.through
+    m2m_changed.connect(invalidate_site_config_on_links, sender=links, dispatch_uid='site-config-links')
@@ -0,0 +1,83 @@
+"""
+Unique slug allocation.
+
+A taken slug gets the first free numeric suffix: 'base', 'base-1',
+'base-2', ... The free suffix is found from one `slug LIKE 'base%'` query
+instead of one exists() query per candidate. allocate_slugs() does the
+same for a whole batch, and save_with_unique_slug() retries when a
+concurrent insert takes the slug first.
+"""
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+SLUG_SAVE_ATTEMPTS = 3
+# Keeps the OR of startswith lookups in bulk mode to a sane SQL size
+BULK_QUERY_CHUNK = 200
+
+
+def first_free_slug(base, taken):
+    """'base' when free, otherwise 'base-N' with the smallest free N"""
+    if base not in taken:
+        return base
+    suffix = re.compile(rf'^{re.escape(base)}-(\d+)$')
+    used = {int(match.group(1)) for match in map(suffix.match, taken) if match}
+    counter = 1
+    while counter in used:
+        counter += 1
+    return f'{base}-{counter}'
+
+
+def taken_slugs(model, bases, field='slug', exclude_pk=None):
+    """Existing slugs starting with any of the bases"""
+    taken = set()
+    bases = sorted(set(bases))
+    for start in range(0, len(bases), BULK_QUERY_CHUNK):
+        condition = Q()
+        for base in bases[start:start + BULK_QUERY_CHUNK]:
+            condition |= Q(**{f'{field}__startswith': base})
+        queryset = model._default_manager.filter(condition)
+        if exclude_pk is not None:
+            queryset = queryset.exclude(pk=exclude_pk)
+        taken.update(queryset.values_list(field, flat=True))
+    return taken
+
+
+def allocate_slug(model, base, field='slug', exclude_pk=None):
+    """Next free slug for base, with one query"""
+    return first_free_slug(base, taken_slugs(model, [base], field, exclude_pk))
+
+
+def allocate_slugs(model, bases, field='slug'):
+    """
+    Free slugs for a batch of new rows, in order, with one query per
+    BULK_QUERY_CHUNK distinct bases. Duplicates within the batch get
+    successive suffixes.
+    """
+    taken = taken_slugs(model, bases, field)
+    slugs = []
+    for base in bases:
+        slug = first_free_slug(base, taken)
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def save_with_unique_slug(instance, base, save, *args, field='slug', **kwargs):
+    """
+    Allocate instance.<field> from base and call save(*args, **kwargs).
+    A unique-constraint race with a concurrent insert re-allocates and
+    retries; other integrity errors propagate.
+    """
+    model = type(instance)
+    for attempt in range(SLUG_SAVE_ATTEMPTS):
+        setattr(instance, field, allocate_slug(model, base, field, instance.pk))
+        try:
+            with transaction.atomic():
+                return save(*args, **kwargs)
+        except IntegrityError:
+            slug = getattr(instance, field)
+            lost_race = model._default_manager.filter(**{field: slug}).exclude(pk=instance.pk).exists()
+            if not lost_race or attempt == SLUG_SAVE_ATTEMPTS - 1:
+                raise
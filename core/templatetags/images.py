@@ -0,0 +1,44 @@
+from django import template
+
+from core.images import MIME_TYPES, VARIANT_FIELDS, get_variants
+
+register = template.Library()
+
+
+def _storage_url(obj, name):
+    field = obj._meta.get_field(VARIANT_FIELDS[obj._meta.label])
+    return field.storage.url(name)
+
+
+@register.filter
+def srcset(obj, fmt='webp'):
+    """'url 160w, url 320w, ...' for one variant format of an image object"""
+    if not obj:
+        return ''
+    widths = get_variants(obj).get(fmt, {})
+    return ', '.join(
+        f'{_storage_url(obj, name)} {width}w'
+        for width, name in sorted(widths.items(), key=lambda item: int(item[0]))
+    )
+
+
+@register.inclusion_tag('core/picture.html')
+def picture(obj, alt='', css_class='', sizes='160px'):
+    """<picture> with AVIF/WebP sources when variants exist, the original otherwise"""
+    variants = get_variants(obj) if obj else {}
+    sources = [
+        {'type': mime, 'srcset': srcset(obj, fmt)}
+        for fmt, mime in MIME_TYPES.items()
+        if variants.get(fmt)
+    ]
+    field_name = VARIANT_FIELDS[obj._meta.label] if obj else None
+    return {
+        'src': getattr(obj, field_name).url if obj else '',
+        'sources': sources,
+        'alt': alt,
+        'css_class': css_class,
+        'sizes': sizes,
+        # Intrinsic size, so the browser reserves the box before the image loads
+        'width': variants.get('width'),
+        'height': variants.get('height'),
+    }
@@ -1,3 +1,233 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.template import Context, Template
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+from blog.models import Post
+from products.models import Product, Category, Brand
+from . import slugs
+from .images import get_variants
+from .counters import ViewCounterBuffer, is_bot
+from .models import ContactInfo, FooterLink, FooterLinkGroup, SocialMedia
+from .site_config import get_site_config
+from .transactions import write_atomic
+
+
+@override_settings(VIEW_COUNTER_FLUSH_INTERVAL=3600, VIEW_COUNTER_MAX_PENDING=1000)
+class ViewCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='موبایل')
+        cls.products = [
+            Product.objects.create(title=f'محصول {i}', description='-', category=category, price=1)
+            for i in range(3)
+        ]
+        cls.post = Post.objects.create(title='پست', slug='post', content='-', status='published')
+
+    def test_views_are_buffered_until_flush(self):
+        buffer = ViewCounterBuffer()
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                buffer.record(self.products[0])
+            buffer.record(self.products[1])
+            buffer.record(self.post)
+        self.assertEqual(buffer.pending(self.products[0]), 3)
+
+        # One UPDATE per (model, increment) group
+        with self.assertNumQueries(3):
+            self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).views, 3)
+        self.assertEqual(Product.objects.get(pk=self.products[1].pk).views, 1)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).views, 1)
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_flushes_when_buffer_is_full(self):
+        buffer = ViewCounterBuffer()
+        with self.settings(VIEW_COUNTER_MAX_PENDING=2):
+            buffer.record(self.products[2])
+            buffer.record(self.products[2])
+        self.assertEqual(Product.objects.get(pk=self.products[2].pk).views, 2)
+        self.assertEqual(buffer.pending(self.products[2]), 0)
+
+    def test_timer_flushes_within_the_interval(self):
+        buffer = ViewCounterBuffer()
+        with mock.patch('core.counters.threading.Timer') as timer, self.settings(VIEW_COUNTER_FLUSH_INTERVAL=5):
+            buffer.record(self.products[0])
+            buffer.record(self.products[0])
+        # One timer per batch of pending views, started with the interval
+        timer.assert_called_once_with(5, buffer._flush_on_timer)
+        timer.return_value.start.assert_called_once_with()
+        with mock.patch('core.counters.connections.close_all') as close_all:
+            buffer._flush_on_timer()
+        close_all.assert_called_once_with()
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).views, 2)
+        timer.return_value.cancel.assert_called_once_with()
+
+    def test_bot_detection(self):
+        factory = RequestFactory()
+        self.assertTrue(is_bot(factory.get('/', HTTP_USER_AGENT='Googlebot/2.1')))
+        self.assertTrue(is_bot(factory.get('/')))
+        self.assertFalse(is_bot(factory.get('/', HTTP_USER_AGENT='Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0')))
+
+
+class SlugAllocatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='موبایل')
+
+    def create(self, title='گوشی سامسونگ'):
+        return Product.objects.create(title=title, description='-', category=self.category, price=1)
+
+    def test_first_free_suffix(self):
+        self.assertEqual(slugs.first_free_slug('a', set()), 'a')
+        self.assertEqual(slugs.first_free_slug('a', {'a', 'a-1', 'a-3', 'a-b', 'ab-2'}), 'a-2')
+
+    def test_duplicate_titles_cost_one_lookup_each(self):
+        self.assertEqual([self.create().slug for _ in range(3)], ['گوشی-سامسونگ', 'گوشی-سامسونگ-1', 'گوشی-سامسونگ-2'])
+        with self.assertNumQueries(1):
+            slug = slugs.allocate_slug(Product, 'گوشی-سامسونگ')
+        self.assertEqual(slug, 'گوشی-سامسونگ-3')
+
+    def test_bulk_allocation(self):
+        self.create()
+        with self.assertNumQueries(1):
+            allocated = slugs.allocate_slugs(Product, ['گوشی-سامسونگ', 'گوشی-سامسونگ', 'لپ-تاپ'])
+        self.assertEqual(allocated, ['گوشی-سامسونگ-1', 'گوشی-سامسونگ-2', 'لپ-تاپ'])
+
+    def test_retries_after_losing_a_race(self):
+        self.create()
+        # The first allocation returns a slug another writer has just taken
+        taken_then_free = ['گوشی-سامسونگ', 'گوشی-سامسونگ-1']
+        with mock.patch.object(slugs, 'allocate_slug', side_effect=taken_then_free) as allocate:
+            product = self.create()
+        self.assertEqual(product.slug, 'گوشی-سامسونگ-1')
+        self.assertEqual(allocate.call_count, 2)
+
+
+def png(width, height, color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, format='PNG')
+    return ContentFile(buffer.getvalue(), name='logo.png')
+
+
+class SiteConfigTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        ContactInfo.objects.create(email='info@example.com', phone='021', address='-', working_hours='9-17')
+        self.group = FooterLinkGroup.objects.create(title='راهنما')
+
+    def test_snapshot_served_from_cache(self):
+        get_site_config()
+        with self.assertNumQueries(0):
+            config = get_site_config()
+            self.assertEqual(config.contact_info.phone, '021')
+            self.assertEqual(list(config.footer_groups[0].links.all()), [])
+
+    @override_settings(CACHE_MAX_STALENESS=60)
+    def test_snapshot_expires(self):
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            get_site_config()
+        self.assertEqual(cache_set.call_args.args[2], 60)
+
+    def test_changes_invalidate_snapshot(self):
+        get_site_config()
+        link = FooterLink.objects.create(title='قوانین', url='/rules/')
+        self.group.links.add(link)
+        self.assertEqual([l.title for l in get_site_config().footer_groups[0].links.all()], ['قوانین'])
+
+        SocialMedia.objects.create(platform='telegram', url='https://t.me/x')
+        self.assertEqual(len(get_site_config().social_media), 1)
+
+        ContactInfo.objects.update(phone='022')
+        self.assertEqual(get_site_config().contact_info.phone, '021')
+        ContactInfo.objects.get().delete()
+        self.assertIsNone(get_site_config().contact_info)
+
+
+@override_settings(IMAGE_VARIANT_WIDTHS=[32, 64, 500], IMAGE_VARIANT_FORMATS=['webp'], IMAGE_VARIANTS_INLINE=True)
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def create_brand(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Brand.objects.create(name='سامسونگ', logo=png(200, 100))
+
+    def test_variants_are_generated_after_upload(self):
+        brand = self.create_brand()
+        brand.refresh_from_db()
+        variants = brand.variants
+        self.assertEqual(variants['source'], brand.logo.name)
+        self.assertEqual((variants['width'], variants['height']), (200, 100))
+        # Never upscaled past the source width
+        self.assertEqual(sorted(variants['webp']), ['32', '64'])
+        name = variants['webp']['64']
+        self.assertRegex(name, r'^brands/variants/logo[^/]*-64w\.[0-9a-f]{12}\.webp$')
+        with brand.logo.storage.open(name) as file, Image.open(file) as image:
+            self.assertEqual(image.size, (64, 32))
+
+    def test_replaced_image_drops_old_variants(self):
+        brand = self.create_brand()
+        brand.refresh_from_db()
+        old = list(brand.variants['webp'].values())
+        with self.captureOnCommitCallbacks(execute=True):
+            brand.logo = png(100, 100, 'blue')
+            brand.save()
+        brand.refresh_from_db()
+        self.assertEqual(brand.variants['source'], brand.logo.name)
+        self.assertFalse(any(brand.logo.storage.exists(name) for name in old))
+
+    @override_settings(IMAGE_VARIANTS_INLINE=False)
+    def test_uploads_wait_for_the_command(self):
+        brands = [self.create_brand() for _ in range(3)]
+        self.assertEqual(get_variants(brands[0]), {})
+        out = io.StringIO()
+        with mock.patch('core.management.commands.generate_image_variants.JOBS_PER_WORKER', 1):
+            call_command('generate_image_variants', model=['products.Brand'], workers=1, stdout=out)
+        self.assertIn('products.Brand: 3', out.getvalue())
+        for brand in brands:
+            brand.refresh_from_db()
+            self.assertEqual(sorted(get_variants(brand)['webp']), ['32', '64'])
+
+    def test_srcset_only_uses_current_variants(self):
+        brand = self.create_brand()
+        brand.refresh_from_db()
+        template = Template('{% load images %}{{ brand|srcset:"webp" }}')
+        rendered = template.render(Context({'brand': brand}))
+        self.assertIn('-32w.', rendered)
+        self.assertTrue(rendered.endswith(' 64w'))
+
+        brand.logo.name = 'brands/other.png'
+        self.assertEqual(template.render(Context({'brand': brand})), '')
+
+    def test_picture_reserves_the_image_size(self):
+        brand = self.create_brand()
+        brand.refresh_from_db()
+        template = Template('{% load images %}{% picture brand "logo" %}')
+        self.assertIn('width="200" height="100"', template.render(Context({'brand': brand})))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'BEGIN IMMEDIATE is SQLite only')
+class WriteAtomicTests(TransactionTestCase):
+    def test_only_write_atomic_begins_immediate(self):
+        with CaptureQueriesContext(connection) as queries:
+            with write_atomic():
+                with write_atomic():
+                    ContactInfo.objects.count()
+            with transaction.atomic():
+                ContactInfo.objects.count()
+        begins = [query['sql'] for query in queries if query['sql'].startswith('BEGIN')]
+        self.assertEqual(begins, ['BEGIN IMMEDIATE', 'BEGIN'])
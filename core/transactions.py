@@ -0,0 +1,35 @@
+"""
+Transactions that write after reading.
+
+SQLite starts transactions DEFERRED: they take the write lock only at
+their first write. Two that both read first and then write deadlock on
+the upgrade, and one of them fails at once with "database is locked"
+instead of waiting out the busy timeout. write_atomic() opens its
+transaction with BEGIN IMMEDIATE, so such a transaction waits for the
+write lock up front. Every other transaction keeps the default, so
+read-mostly requests do not queue behind writers.
+"""
+from contextlib import contextmanager
+
+from django.db import transaction
+
+
+@contextmanager
+def write_atomic(using=None):
+    """transaction.atomic() that holds SQLite's write lock from its first statement"""
+    connection = transaction.get_connection(using)
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        # Other databases lock rows instead; nested blocks live in the outer transaction
+        with transaction.atomic(using=using):
+            yield
+        return
+    # Connecting resets transaction_mode from the settings, so connect first
+    connection.ensure_connection()
+    mode = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic(using=using):
+            connection.transaction_mode = mode
+            yield
+    finally:
+        connection.transaction_mode = mode
@@ -14,11 +14,12 @@ class HomePageView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Best-selling products (based on sales)
-        context['bestseller_products'] = Product.objects.order_by('-sales')[:10]
+        products = Product.objects.select_related('cover_image')
+        context['bestseller_products'] = products.order_by('-sales')[:10]
         # Amazing products
-        context['amazing_products'] = Product.objects.filter(is_amazing=True)[:10]
+        context['amazing_products'] = products.filter(is_amazing=True)[:10]
         # Latest products
-        context['latest_products'] = Product.objects.order_by('-created_at')[:10]
+        context['latest_products'] = products.order_by('-created_at')[:10]
         # Latest blog posts
         context['latest_posts'] = Post.objects.filter(status='published').order_by('-created_at')[:6]
         # Categories - using context processor, no need to override
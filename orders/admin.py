@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from core.admin_utils import format_date_for_admin
-from .models import Order, OrderItem
+from .models import Order, OrderItem, PaymentAttempt
 
 
 class OrderItemInline(admin.TabularInline):
@@ -17,6 +17,17 @@ class OrderItemInline(admin.TabularInline):
     get_total_price.short_description = 'جمع'
 
 
+class PaymentAttemptInline(admin.TabularInline):
+    model = PaymentAttempt
+    extra = 0
+    fields = ['authority', 'amount', 'status', 'ref_id', 'created_at', 'verified_at']
+    readonly_fields = fields
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 # Admin class for hidden model OrderItem (only displayed in advanced mode)
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['order', 'product', 'color', 'quantity', 'price', 'get_total_price', 'jalali_created']
@@ -40,7 +51,7 @@ class OrderAdmin(admin.ModelAdmin):
     list_filter = ['status', 'payment_status', 'payment_method', 'created_at']
     search_fields = ['order_number', 'user__phone', 'user__fullname']
     readonly_fields = ['order_number', 'updated_at', 'jalali_created', 'jalali_updated', 'get_full_address']
-    inlines = [OrderItemInline]
+    inlines = [OrderItemInline, PaymentAttemptInline]
     list_editable = ['status']
     list_per_page = 25
     date_hierarchy = 'created_at'
@@ -67,6 +78,7 @@ class OrderAdmin(admin.ModelAdmin):
             'shipped': '#8b5cf6',
             'delivered': '#059669',
             'cancelled': '#ef4444',
+            'refund_pending': '#be123c',
         }
         color = status_colors.get(obj.status, '#6b7280')
         return format_html(
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from orders.models import OrderNumberCounter
+from orders.order_numbers import BLOCK_SIZE, OrderNumberAllocator, is_valid_order_number
+
+COUNTER_NAME = 'benchmark'
+
+
+class Command(BaseCommand):
+    help = 'سنجش سرعت تولید شماره سفارش و بررسی یکتایی و رقم کنترلی'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help='تعداد شماره‌ها')
+        parser.add_argument('--workers', type=int, default=4, help='تعداد تخصیص‌دهنده‌ها (مانند پردازه‌های جدا)')
+        parser.add_argument('--threads', type=int, default=2, help='تعداد نخ‌ها برای هر تخصیص‌دهنده')
+
+    def handle(self, *args, **options):
+        allocators = [OrderNumberAllocator(name=COUNTER_NAME) for _ in range(options['workers'])]
+        thread_count = options['workers'] * options['threads']
+        per_thread = options['count'] // thread_count
+        numbers = []
+        lock = threading.Lock()
+
+        def worker(allocator):
+            try:
+                generated = [allocator.next() for _ in range(per_thread)]
+                with lock:
+                    numbers.extend(generated)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(allocator,))
+            for allocator in allocators for _ in range(options['threads'])
+        ]
+        try:
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            blocks = OrderNumberCounter.objects.get(name=COUNTER_NAME).last_block
+            self.stdout.write(
+                f"{len(numbers)} numbers in {elapsed:.2f} s ({len(numbers) / elapsed:,.0f}/s), "
+                f"{blocks} blocks of {BLOCK_SIZE} reserved ({blocks} UPDATEs)"
+            )
+            duplicates = len(numbers) - len(set(numbers))
+            invalid = sum(not is_valid_order_number(number) for number in numbers)
+            unparsed = sum(allocators[0].parse(number) is None for number in numbers)
+            if duplicates or invalid or unparsed:
+                self.stdout.write(self.style.ERROR(
+                    f'{duplicates} تکراری، {invalid} با رقم کنترلی نادرست، {unparsed} غیرقابل بازگشت'
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS('همه شماره‌ها یکتا و معتبر هستند'))
+        finally:
+            OrderNumberCounter.objects.filter(name=COUNTER_NAME).delete()
@@ -0,0 +1,82 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+
+from accounts.models import MyUser
+from cart.models import Cart, CartItem
+from orders.services import place_order, OutOfStock
+from products.models import Product, Category
+
+PHONE_PREFIX = '0999'
+
+
+class Command(BaseCommand):
+    help = 'ثبت هم‌زمان سفارش برای یک محصول با موجودی محدود و بررسی عدم فروش بیش از موجودی'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='تعداد نخ‌های هم‌زمان')
+        parser.add_argument('--orders', type=int, default=100, help='تعداد سبدهای خرید')
+        parser.add_argument('--stock', type=int, default=30, help='موجودی اولیه محصول')
+        parser.add_argument('--quantity', type=int, default=1, help='تعداد محصول در هر سبد')
+
+    def handle(self, *args, **options):
+        category = Category.objects.create(name='benchmark', slug='benchmark-order-placement')
+        product = Product.objects.create(
+            title='benchmark', description='-', category=category, price=1000, stock=options['stock'],
+        )
+        users = [
+            MyUser.objects.create_user(phone=f'{PHONE_PREFIX}{i:07d}') for i in range(options['orders'])
+        ]
+        carts = Cart.objects.bulk_create([Cart(user=user) for user in users])
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=options['quantity']) for cart in carts
+        ])
+
+        results = {'placed': 0, 'out_of_stock': 0, 'locked': 0}
+        lock = threading.Lock()
+
+        def worker(batch):
+            try:
+                for cart in batch:
+                    try:
+                        place_order(cart, address=None, payment_method='cash', shipping_cost=0)
+                        outcome = 'placed'
+                    except OutOfStock:
+                        outcome = 'out_of_stock'
+                    except OperationalError:
+                        # SQLite gives up on a busy database instead of waiting on a row lock
+                        outcome = 'locked'
+                    with lock:
+                        results[outcome] += 1
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(carts[i::options['threads']],))
+            for i in range(options['threads'])
+        ]
+        try:
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            product.refresh_from_db()
+            sold = results['placed'] * options['quantity']
+            self.stdout.write(
+                f"orders: {results['placed']} placed, {results['out_of_stock']} out of stock, "
+                f"{results['locked']} lock timeouts in {elapsed:.2f} s "
+                f"({len(carts) / elapsed:.0f} attempts/s)"
+            )
+            self.stdout.write(f"stock: {options['stock']} -> {product.stock}, sold {sold}, sales {product.sales}")
+            if sold > options['stock'] or product.stock != options['stock'] - sold:
+                self.stdout.write(self.style.ERROR('فروش بیش از موجودی رخ داد'))
+            else:
+                self.stdout.write(self.style.SUCCESS('بدون فروش بیش از موجودی'))
+        finally:
+            MyUser.objects.filter(phone__startswith=PHONE_PREFIX, pk__in=[user.pk for user in users]).delete()
+            category.delete()
@@ -0,0 +1,58 @@
+import threading
+import time
+
+import requests
+from django.core.management.base import BaseCommand
+
+from orders.payment import ZarinpalClient
+from orders.zarinpal_stub import StubGateway
+
+
+class Command(BaseCommand):
+    help = 'سنجش کلاینت زرین‌پال با اتصال‌های مشترک در برابر اتصال جدید برای هر درخواست، روی درگاه آزمایشی'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='تعداد درخواست‌های تایید')
+        parser.add_argument('--threads', type=int, default=8, help='تعداد نخ‌های هم‌زمان')
+        parser.add_argument('--latency', type=float, default=0, help='تأخیر هر پاسخ درگاه (ثانیه)')
+
+    def handle(self, *args, **options):
+        gateway = StubGateway(latency=options['latency']).start()
+        try:
+            client = ZarinpalClient('benchmark', gateway.url, gateway.url, pool_size=options['threads'])
+            _, authority = client.request_payment(1000, 'benchmark', 'http://localhost/callback')
+            gateway.pay(authority)
+            payload = {'merchant_id': 'benchmark', 'amount': 1000, 'authority': authority}
+            verify_url = f'{gateway.url}/pg/v4/payment/verify.json'
+
+            def pooled():
+                return client.verify_payment(authority, 1000)[0]
+
+            def fresh():
+                return requests.post(verify_url, json=payload, timeout=10).json()['data']['code']
+
+            for name, call in (('pooled session', pooled), ('requests.post', fresh)):
+                elapsed, codes = self.run(call, options['requests'], options['threads'])
+                self.stdout.write(
+                    f"{name}: {options['requests']} verifies in {elapsed:.2f} s "
+                    f"({options['requests'] / elapsed:,.0f}/s), codes {sorted(codes)}"
+                )
+        finally:
+            gateway.stop()
+
+    def run(self, call, count, thread_count):
+        codes = set()
+        lock = threading.Lock()
+
+        def worker(calls):
+            seen = {call() for _ in range(calls)}
+            with lock:
+                codes.update(seen)
+
+        threads = [threading.Thread(target=worker, args=(count // thread_count,)) for _ in range(thread_count)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started, codes
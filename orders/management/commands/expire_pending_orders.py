@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.services import expire_pending_orders
+
+
+class Command(BaseCommand):
+    help = 'لغو سفارش‌های پرداخت‌نشده‌ای که مهلت پرداختشان تمام شده و آزادسازی موجودی رزرو شده'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='تعداد سفارش‌ها در هر دستور UPDATE',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='اجرای مداوم با فاصله (ثانیه)؛ صفر یعنی یک بار اجرا',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            cancelled = expire_pending_orders(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'✓ {cancelled} سفارش منقضی لغو شد'))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
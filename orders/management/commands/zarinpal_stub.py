@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from orders.zarinpal_stub import StubGateway
+
+
+class Command(BaseCommand):
+    help = 'اجرای درگاه آزمایشی زرین‌پال برای تست بار بدون اینترنت (ZARINPAL_API_URL را روی آن تنظیم کنید)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765, help='پورت')
+        parser.add_argument('--latency', type=float, default=0, help='تأخیر هر پاسخ (ثانیه)')
+        parser.add_argument('--failure-rate', type=float, default=0, help='سهم پاسخ‌های 503')
+
+    def handle(self, *args, **options):
+        gateway = StubGateway(port=options['port'], latency=options['latency'], failure_rate=options['failure_rate'])
+        self.stdout.write(self.style.SUCCESS(f'درگاه آزمایشی روی {gateway.url} (ZARINPAL_API_URL={gateway.url})'))
+        try:
+            gateway.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            gateway.server.server_close()
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_alter_address_options_alter_myuser_options_and_more'),
+        ('orders', '0003_stock_reservation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'payment_status', 'created_at'], name='orders_order_expiry'),
+        ),
+    ]
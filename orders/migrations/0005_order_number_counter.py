@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_order_expiry_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNumberCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='نام')),
+                ('last_block', models.PositiveBigIntegerField(default=0, verbose_name='آخرین بلوک')),
+            ],
+            options={
+                'verbose_name': 'شمارنده شماره سفارش',
+                'verbose_name_plural': 'شمارنده\u200cهای شماره سفارش',
+            },
+        ),
+    ]
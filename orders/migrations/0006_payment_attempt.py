@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_order_number_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('authority', models.CharField(max_length=64, unique=True, verbose_name='کد authority')),
+                ('amount', models.PositiveIntegerField(verbose_name='مبلغ')),
+                ('status', models.CharField(choices=[('pending', 'در انتظار پرداخت'), ('paid', 'پرداخت شده'), ('failed', 'ناموفق')], default='pending', max_length=20, verbose_name='وضعیت')),
+                ('ref_id', models.CharField(blank=True, max_length=64, verbose_name='کد پیگیری')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ثبت')),
+                ('verified_at', models.DateTimeField(blank=True, null=True, verbose_name='تاریخ تایید')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_attempts', to='orders.order', verbose_name='سفارش')),
+            ],
+            options={
+                'verbose_name': 'تلاش پرداخت',
+                'verbose_name_plural': 'تلاش\u200cهای پرداخت',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_order_refund_pending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentattempt',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='تاریخ شروع بررسی'),
+        ),
+        migrations.AlterField(
+            model_name='paymentattempt',
+            name='status',
+            field=models.CharField(choices=[('pending', 'در انتظار پرداخت'), ('verifying', 'در حال بررسی'), ('paid', 'پرداخت شده'), ('failed', 'ناموفق')], default='pending', max_length=20, verbose_name='وضعیت'),
+        ),
+    ]
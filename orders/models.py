@@ -1,9 +1,14 @@
+from datetime import timedelta
+
 from django.db import models
 from django.utils import timezone
 from persiantools.jdatetime import JalaliDateTime
 from accounts.models import MyUser, Address
 from products.models import Product, Color
 
+# How long an online order waits for payment before its stock is released
+PAYMENT_WINDOW = timedelta(hours=1)
+
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -13,6 +18,8 @@ class Order(models.Model):
         ('shipped', 'ارسال شده'),
         ('delivered', 'تحویل داده شده'),
         ('cancelled', 'لغو شده'),
+        # Paid after its stock was released and sold out; needs a refund
+        ('refund_pending', 'در انتظار بازگشت وجه'),
     ]
 
     PAYMENT_METHOD_CHOICES = [
@@ -37,6 +44,10 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Serves the expire_pending_orders sweep
+            models.Index(fields=['status', 'payment_status', 'created_at'], name='orders_order_expiry'),
+        ]
         verbose_name = 'سفارش'
         verbose_name_plural = 'سفارش‌ها'
 
@@ -52,41 +63,37 @@ class Order(models.Model):
         return JalaliDateTime(self.created_at).strftime('%Y/%m/%d - %H:%M')
 
     def is_pending_payment_expired(self):
-        """Check if pending payment order is older than 1 hour"""
-        if self.status != 'pending' or self.payment_status:
+        """Check if an unpaid online order is older than the payment window"""
+        if self.payment_method != 'online' or self.status != 'pending' or self.payment_status:
             return False
-        from datetime import timedelta
         time_diff = timezone.now() - self.created_at
-        return time_diff > timedelta(hours=1)
+        return time_diff > PAYMENT_WINDOW
     
     def get_remaining_payment_time(self):
-        """Get remaining time in seconds for payment (max 1 hour)"""
+        """Get remaining time in seconds for payment (max the payment window)"""
         if self.status != 'pending' or self.payment_status:
             return 0
-        from datetime import timedelta
         time_diff = timezone.now() - self.created_at
-        remaining = timedelta(hours=1) - time_diff
+        remaining = PAYMENT_WINDOW - time_diff
         return max(0, int(remaining.total_seconds()))
 
     def save(self, *args, **kwargs):
         if not self.order_number:
-            import random
-            import string
-            self.order_number = ''.join(random.choices(string.digits, k=10))
+            from .order_numbers import next_order_number
+            self.order_number = next_order_number()
         super().save(*args, **kwargs)
     
+    def get_status_display(self):
+        # Until the expire_pending_orders sweep runs, expired orders read as cancelled
+        if self.is_pending_payment_expired():
+            return dict(self.STATUS_CHOICES)['cancelled']
+        return dict(self.STATUS_CHOICES).get(self.status, self.status)
+
     @classmethod
     def cancel_expired_pending_orders(cls):
-        """Cancel orders that are pending payment for more than 1 hour"""
-        from datetime import timedelta
-        expired_time = timezone.now() - timedelta(hours=1)
-        expired_orders = cls.objects.filter(
-            status='pending',
-            payment_status=False,
-            created_at__lt=expired_time
-        )
-        count = expired_orders.update(status='cancelled')
-        return count
+        """Cancel orders that are pending payment past the payment window, releasing their stock"""
+        from .services import expire_pending_orders
+        return expire_pending_orders()
 
 
 class OrderItem(models.Model):
@@ -109,3 +116,60 @@ class OrderItem(models.Model):
         price = self.price or 0
         quantity = self.quantity or 0
         return price * quantity
+
+
+class StockReservation(models.Model):
+    """Units held for an unpaid online order until it is paid or expires"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations', verbose_name="سفارش")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations', verbose_name="محصول")
+    quantity = models.PositiveIntegerField(verbose_name="تعداد")
+    expires_at = models.DateTimeField(db_index=True, verbose_name="زمان انقضا")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاریخ ثبت")
+
+    class Meta:
+        verbose_name = 'رزرو موجودی'
+        verbose_name_plural = 'رزروهای موجودی'
+
+    def __str__(self):
+        return f"{self.product_id} × {self.quantity} - سفارش {self.order_id}"
+
+
+class PaymentAttempt(models.Model):
+    """One gateway payment of an order, found by its authority when the gateway calls back"""
+    STATUS_CHOICES = [
+        ('pending', 'در انتظار پرداخت'),
+        # Claimed by a callback that is asking the gateway
+        ('verifying', 'در حال بررسی'),
+        ('paid', 'پرداخت شده'),
+        ('failed', 'ناموفق'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payment_attempts', verbose_name="سفارش")
+    authority = models.CharField(max_length=64, unique=True, verbose_name="کد authority")
+    amount = models.PositiveIntegerField(verbose_name="مبلغ")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="وضعیت")
+    ref_id = models.CharField(max_length=64, blank=True, verbose_name="کد پیگیری")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاریخ ثبت")
+    claimed_at = models.DateTimeField(null=True, blank=True, verbose_name="تاریخ شروع بررسی")
+    verified_at = models.DateTimeField(null=True, blank=True, verbose_name="تاریخ تایید")
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'تلاش پرداخت'
+        verbose_name_plural = 'تلاش‌های پرداخت'
+
+    def __str__(self):
+        return f"{self.authority} - سفارش {self.order_id}"
+
+
+class OrderNumberCounter(models.Model):
+    """Last block of order numbers reserved by any worker, see orders.order_numbers"""
+    name = models.CharField(max_length=50, unique=True, verbose_name="نام")
+    last_block = models.PositiveBigIntegerField(default=0, verbose_name="آخرین بلوک")
+
+    class Meta:
+        verbose_name = 'شمارنده شماره سفارش'
+        verbose_name_plural = 'شمارنده‌های شماره سفارش'
+
+    def __str__(self):
+        return f"{self.name}: {self.last_block}"
@@ -0,0 +1,153 @@
+"""
+Order numbers without a round-trip per order.
+
+Each worker reserves a block of BLOCK_SIZE numbers at a time by bumping
+OrderNumberCounter.last_block, then hands them out from memory. A number
+is the block followed by a Feistel permutation of the position inside it
+and a Luhn check digit:
+
+    <100000 + block><4-digit permuted offset><check digit>
+
+so numbers grow with the block, which keeps inserts into the unique index
+clustered, while consecutive orders within a block do not give away their
+neighbours. The permutation is keyed from SECRET_KEY and reversible, and
+the check digit catches mistyped numbers before any lookup.
+
+Blocks are never handed out twice as long as the counter update commits.
+The worker's shared blocks are therefore only reserved outside a
+transaction, which is why place_order() asks for its number before opening
+its own. Called inside a transaction (Order.save() in the admin, say),
+next_order_number() reserves a block for that one number instead, and
+the reservation commits or rolls back together with the order.
+"""
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import OrderNumberCounter
+
+BLOCK_BITS = 10
+BLOCK_SIZE = 1 << BLOCK_BITS
+BLOCK_BASE = 100000
+OFFSET_DIGITS = len(str(BLOCK_SIZE - 1))
+FEISTEL_ROUNDS = 4
+
+
+def luhn_check_digit(digits):
+    """Luhn check digit for a string of digits"""
+    total = 0
+    for index, digit in enumerate(reversed(digits)):
+        value = int(digit)
+        if index % 2 == 0:
+            value *= 2
+            if value > 9:
+                value -= 9
+        total += value
+    return str(-total % 10)
+
+
+def is_valid_order_number(number):
+    """Whether number is all digits with a correct trailing Luhn digit"""
+    return len(number) > 1 and number.isdigit() and luhn_check_digit(number[:-1]) == number[-1]
+
+
+class FeistelPermutation:
+    """Keyed, reversible shuffle of the integers below 2**bits (bits must be even)"""
+
+    def __init__(self, bits, key, rounds=FEISTEL_ROUNDS):
+        self.half_bits = bits // 2
+        self.mask = (1 << self.half_bits) - 1
+        self.round_keys = [
+            hashlib.blake2b(f'order-number:{round_index}'.encode(), key=key[:64], digest_size=16).digest()
+            for round_index in range(rounds)
+        ]
+
+    def _round(self, value, round_key):
+        digest = hashlib.blake2b(value.to_bytes(4, 'big'), key=round_key, digest_size=4).digest()
+        return int.from_bytes(digest, 'big') & self.mask
+
+    def permute(self, value):
+        left, right = value >> self.half_bits, value & self.mask
+        for round_key in self.round_keys:
+            left, right = right, left ^ self._round(right, round_key)
+        return left << self.half_bits | right
+
+    def invert(self, value):
+        left, right = value >> self.half_bits, value & self.mask
+        for round_key in reversed(self.round_keys):
+            left, right = right ^ self._round(left, round_key), left
+        return left << self.half_bits | right
+
+
+def allocate_block(name):
+    """Reserve the next block of the named counter in the database"""
+    with transaction.atomic():
+        counter = OrderNumberCounter.objects.filter(name=name)
+        if not counter.update(last_block=F('last_block') + 1):
+            # First block of this counter; get_or_create absorbs a concurrent creation
+            OrderNumberCounter.objects.get_or_create(name=name)
+            counter.update(last_block=F('last_block') + 1)
+        return counter.values_list('last_block', flat=True).get()
+
+
+class OrderNumberAllocator:
+    """Hands out order numbers from blocks reserved with allocate_block()"""
+
+    def __init__(self, name='orders', key=None):
+        self.name = name
+        self.permutation = FeistelPermutation(BLOCK_BITS, key or settings.SECRET_KEY.encode())
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.block = None
+        self.offset = BLOCK_SIZE
+
+    def format(self, block, offset):
+        digits = f'{BLOCK_BASE + block}{self.permutation.permute(offset):0{OFFSET_DIGITS}d}'
+        return digits + luhn_check_digit(digits)
+
+    def parse(self, number):
+        """(block, offset) of a number this allocator produced, or None"""
+        if not is_valid_order_number(number):
+            return None
+        body = number[:-1]
+        block, permuted = int(body[:-OFFSET_DIGITS]) - BLOCK_BASE, int(body[-OFFSET_DIGITS:])
+        if block < 1 or permuted >= BLOCK_SIZE:
+            return None
+        return block, self.permutation.invert(permuted)
+
+    def next(self):
+        with self.lock:
+            if self.offset >= BLOCK_SIZE:
+                self.block = allocate_block(self.name)
+                self.offset = 0
+            offset = self.offset
+            self.offset += 1
+            return self.format(self.block, offset)
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def get_allocator():
+    """This process's allocator; a forked worker must not reuse its parent's block"""
+    global _allocator
+    allocator = _allocator
+    if allocator is None or allocator.pid != os.getpid():
+        with _allocator_lock:
+            if _allocator is None or _allocator.pid != os.getpid():
+                _allocator = OrderNumberAllocator()
+            allocator = _allocator
+    return allocator
+
+
+def next_order_number():
+    """The next order number of this worker"""
+    if transaction.get_connection().in_atomic_block:
+        # A block reserved here is only taken if the caller commits
+        return OrderNumberAllocator().next()
+    return get_allocator().next()
@@ -1,207 +1,294 @@
 """
 Payment Gateway Integration (Zarinpal)
+
+ZarinpalClient keeps one keep-alive requests.Session per worker, so calls
+reuse pooled TLS connections instead of opening one per payment. Connect
+and read timeouts are separate and short on connect. Verify calls are
+idempotent on Zarinpal's side (a repeat answers 101, "already verified")
+and are retried with jittered backoff; payment requests are not, since a
+retry would open a second authority.
+
+A circuit breaker counts consecutive gateway failures and, once open,
+fails calls immediately for a cooldown instead of tying up workers on a
+gateway that is down. orders.zarinpal_stub serves the same API locally;
+point ZARINPAL_API_URL at it to run the payment flow offline.
 """
-import requests
 import logging
+import random
+import threading
+import time
+
+import requests
 from django.conf import settings
-from django.urls import reverse
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
+SANDBOX_URL = "https://sandbox.zarinpal.com"
+API_URL = "https://api.zarinpal.com"
+START_PAY_URL = "https://www.zarinpal.com"
+
+
+class GatewayError(Exception):
+    pass
+
+
+class GatewayUnavailable(GatewayError):
+    pass
+
+
+class CircuitOpen(GatewayError):
+    pass
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and lets one trial call through after `cooldown` seconds"""
+
+    def __init__(self, threshold, cooldown, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.clock() - self.opened_at >= self.cooldown:
+                # Half-open: the next failure re-opens it for another cooldown
+                self.opened_at = self.clock()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = self.clock()
+
+
+class ZarinpalClient:
+    """Pooled Zarinpal v4 API client"""
+
+    def __init__(self, merchant_id, api_url, start_pay_url, *, connect_timeout=3.05, read_timeout=10,
+                 verify_retries=2, retry_backoff=0.5, pool_size=10, breaker=None):
+        self.merchant_id = merchant_id
+        self.api_url = api_url.rstrip('/')
+        self.start_pay_url = start_pay_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.verify_retries = verify_retries
+        self.retry_backoff = retry_backoff
+        self.breaker = breaker or CircuitBreaker(threshold=5, cooldown=30)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_settings(cls):
+        sandbox = settings.ZARINPAL_SANDBOX
+        api_url = settings.ZARINPAL_API_URL or (SANDBOX_URL if sandbox else API_URL)
+        start_pay_url = settings.ZARINPAL_API_URL or (SANDBOX_URL if sandbox else START_PAY_URL)
+        return cls(
+            settings.ZARINPAL_MERCHANT_ID,
+            api_url,
+            start_pay_url,
+            connect_timeout=settings.ZARINPAL_CONNECT_TIMEOUT,
+            read_timeout=settings.ZARINPAL_READ_TIMEOUT,
+            verify_retries=settings.ZARINPAL_VERIFY_RETRIES,
+            pool_size=settings.ZARINPAL_POOL_SIZE,
+            breaker=CircuitBreaker(settings.ZARINPAL_BREAKER_THRESHOLD, settings.ZARINPAL_BREAKER_COOLDOWN),
+        )
+
+    def _post(self, path, payload):
+        """POST to the gateway through the breaker, returning the decoded JSON"""
+        if not self.breaker.allow():
+            raise CircuitOpen("Zarinpal is unavailable, try again later")
+        try:
+            response = self.session.post(f"{self.api_url}{path}", json=payload, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            raise GatewayUnavailable(f"Error connecting to Zarinpal: HTTP {response.status_code}")
+        self.breaker.record_success()
+        if response.status_code != 200:
+            logger.error(f"ZarinPal HTTP Error - Path: {path}, Status Code: {response.status_code}, "
+                         f"Response Text: {response.text}")
+            raise GatewayError(f"Error connecting to Zarinpal: HTTP {response.status_code}")
+        return response.json()
+
+    def _backoff(self, attempt):
+        # Full jitter keeps retrying workers from hitting the gateway in lockstep
+        time.sleep(random.uniform(0, self.retry_backoff * 2 ** attempt))
+
+    def request_payment(self, amount, description, callback_url, order_id=None):
+        """Open a payment; returns (payment_url, authority) or raises GatewayError"""
+        payload = {
+            'merchant_id': self.merchant_id,
+            'amount': amount,  # Amount in Rials
+            'description': description,
+            'callback_url': callback_url,
+            'metadata': {
+                'order_id': str(order_id)
+            } if order_id else {}
+        }
+        logger.debug(f"ZarinPal Request Payload: {payload}")
+        result = self._post('/pg/v4/payment/request.json', payload)
+        logger.debug(f"ZarinPal Response: {result}")
+        data = result.get('data') or {}
+        if data.get('code') != 100:
+            # Zarinpal sends an empty list for errors on success and a dict on failure
+            errors = result.get('errors') or {}
+            if not isinstance(errors, dict):
+                errors = {}
+            logger.error(
+                f"ZarinPal Payment Request Failed - Order ID: {order_id}, "
+                f"Error Code: {data.get('code')}, Full Error Details: {errors}, Response: {result}"
+            )
+            raise GatewayError(errors.get('message', 'Error creating payment request'))
+        authority = data['authority']
+        return f"{self.start_pay_url}/pg/StartPay/{authority}", authority
+
+    def verify_payment(self, authority, amount):
+        """Verify a payment; returns (code, ref_id, message), retrying transport failures"""
+        payload = {
+            'merchant_id': self.merchant_id,
+            'amount': amount,  # Amount in Rials
+            'authority': authority
+        }
+        for attempt in range(self.verify_retries + 1):
+            try:
+                result = self._post('/pg/v4/payment/verify.json', payload)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, GatewayUnavailable) as e:
+                if attempt == self.verify_retries:
+                    raise
+                logger.warning(f"ZarinPal Verify Retry - Authority: {authority}, Attempt: {attempt + 1}, Error: {e}")
+                self._backoff(attempt)
+        logger.debug(f"ZarinPal Verify Response: {result}")
+        data = result.get('data') or {}
+        errors = result.get('errors') or {}
+        if not isinstance(errors, dict):
+            errors = {}
+        message = data.get('message') or errors.get('message') or 'Payment failed'
+        return data.get('code', errors.get('code')), data.get('ref_id'), message
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The worker's shared ZarinpalClient"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ZarinpalClient.from_settings()
+    return _client
+
+
+@receiver(setting_changed)
+def reset_client(setting, **kwargs):
+    global _client
+    if setting.startswith('ZARINPAL_'):
+        _client = None
+
 
 def get_zarinpal_payment_url(amount, description, callback_url, order_id=None):
     """Get payment URL from Zarinpal gateway"""
-    merchant_id = settings.ZARINPAL_MERCHANT_ID
-    sandbox = settings.ZARINPAL_SANDBOX
-    
     logger.info(
         f"ZarinPal Payment Request - Order ID: {order_id}, Amount: {amount}, "
-        f"Sandbox: {sandbox}, Description: {description}"
+        f"Sandbox: {settings.ZARINPAL_SANDBOX}, Description: {description}"
     )
-    
-    if not merchant_id:
+
+    if not settings.ZARINPAL_MERCHANT_ID:
         error_msg = "Merchant ID is not configured"
         logger.error(f"ZarinPal Error: {error_msg}")
         return None, error_msg
-    
-    # URL based on sandbox or production
-    if sandbox:
-        url = "https://sandbox.zarinpal.com/pg/v4/payment/request.json"
-    else:
-        url = "https://api.zarinpal.com/pg/v4/payment/request.json"
-    
-    payload = {
-        'merchant_id': merchant_id,
-        'amount': amount,  # Amount in Rials
-        'description': description,
-        'callback_url': callback_url,
-        'metadata': {
-            'order_id': str(order_id)
-        } if order_id else {}
-    }
-    
+
     try:
-        logger.debug(f"ZarinPal Request URL: {url}, Payload: {payload}")
-        response = requests.post(url, json=payload, timeout=10)
-        
-        if response.status_code == 200:
-            result = response.json()
-            logger.debug(f"ZarinPal Response: {result}")
-            
-            if result.get('data', {}).get('code') == 100:
-                authority = result['data']['authority']
-                if sandbox:
-                    payment_url = f"https://sandbox.zarinpal.com/pg/StartPay/{authority}"
-                else:
-                    payment_url = f"https://www.zarinpal.com/pg/StartPay/{authority}"
-                
-                logger.info(
-                    f"ZarinPal Payment URL Created Successfully - Order ID: {order_id}, "
-                    f"Authority: {authority}, Payment URL: {payment_url}"
-                )
-                return payment_url, authority
-            else:
-                error_code = result.get('data', {}).get('code')
-                error_message = result.get('errors', {}).get('message', 'Error creating payment request')
-                error_details = result.get('errors', {})
-                
-                logger.error(
-                    f"ZarinPal Payment Request Failed - Order ID: {order_id}, "
-                    f"Error Code: {error_code}, Error Message: {error_message}, "
-                    f"Full Error Details: {error_details}, Response: {result}"
-                )
-                return None, error_message
-        else:
-            error_msg = f"Error connecting to Zarinpal: HTTP {response.status_code}"
-            logger.error(
-                f"ZarinPal HTTP Error - Order ID: {order_id}, Status Code: {response.status_code}, "
-                f"Response Text: {response.text}"
-            )
-            return None, error_msg
-            
+        payment_url, authority = get_client().request_payment(amount, description, callback_url, order_id)
     except requests.exceptions.Timeout as e:
-        error_msg = f"Timeout connecting to Zarinpal: {str(e)}"
-        logger.error(
-            f"ZarinPal Timeout Error - Order ID: {order_id}, Error: {str(e)}",
-            exc_info=True
-        )
-        return None, error_msg
+        logger.error(f"ZarinPal Timeout Error - Order ID: {order_id}, Error: {str(e)}", exc_info=True)
+        return None, f"Timeout connecting to Zarinpal: {str(e)}"
     except requests.exceptions.ConnectionError as e:
-        error_msg = f"Connection error to Zarinpal: {str(e)}"
-        logger.error(
-            f"ZarinPal Connection Error - Order ID: {order_id}, Error: {str(e)}",
-            exc_info=True
-        )
-        return None, error_msg
+        logger.error(f"ZarinPal Connection Error - Order ID: {order_id}, Error: {str(e)}", exc_info=True)
+        return None, f"Connection error to Zarinpal: {str(e)}"
     except requests.exceptions.RequestException as e:
-        error_msg = f"Error connecting to Zarinpal: {str(e)}"
-        logger.error(
-            f"ZarinPal Request Exception - Order ID: {order_id}, Error: {str(e)}",
-            exc_info=True
-        )
-        return None, error_msg
+        logger.error(f"ZarinPal Request Exception - Order ID: {order_id}, Error: {str(e)}", exc_info=True)
+        return None, f"Error connecting to Zarinpal: {str(e)}"
+    except GatewayError as e:
+        logger.error(f"ZarinPal Gateway Error - Order ID: {order_id}, Error: {str(e)}")
+        return None, str(e)
     except Exception as e:
-        error_msg = f"Unexpected error: {str(e)}"
-        logger.exception(
-            f"ZarinPal Unexpected Error - Order ID: {order_id}, Error: {str(e)}"
-        )
-        return None, error_msg
+        logger.exception(f"ZarinPal Unexpected Error - Order ID: {order_id}, Error: {str(e)}")
+        return None, f"Unexpected error: {str(e)}"
+
+    logger.info(
+        f"ZarinPal Payment URL Created Successfully - Order ID: {order_id}, "
+        f"Authority: {authority}, Payment URL: {payment_url}"
+    )
+    return payment_url, authority
 
 
 def verify_zarinpal_payment(authority, amount):
     """Verify Zarinpal payment"""
-    merchant_id = settings.ZARINPAL_MERCHANT_ID
-    sandbox = settings.ZARINPAL_SANDBOX
-    
     logger.info(
         f"ZarinPal Payment Verification - Authority: {authority}, Amount: {amount}, "
-        f"Sandbox: {sandbox}"
+        f"Sandbox: {settings.ZARINPAL_SANDBOX}"
     )
-    
-    if not merchant_id:
+
+    if not settings.ZARINPAL_MERCHANT_ID:
         error_msg = "Merchant ID is not configured"
         logger.error(f"ZarinPal Verification Error: {error_msg}")
         return False, None, error_msg
-    
-    # URL based on sandbox or production
-    if sandbox:
-        url = "https://sandbox.zarinpal.com/pg/v4/payment/verify.json"
-    else:
-        url = "https://api.zarinpal.com/pg/v4/payment/verify.json"
-    
-    payload = {
-        'merchant_id': merchant_id,
-        'amount': amount,  # Amount in Rials
-        'authority': authority
-    }
-    
+
     try:
-        logger.debug(f"ZarinPal Verify Request URL: {url}, Payload: {payload}")
-        response = requests.post(url, json=payload, timeout=10)
-        
-        if response.status_code == 200:
-            result = response.json()
-            data = result.get('data', {})
-            logger.debug(f"ZarinPal Verify Response: {result}")
-            
-            if data.get('code') == 100:
-                # Payment successful
-                ref_id = data.get('ref_id')
-                logger.info(
-                    f"ZarinPal Payment Verified Successfully - Authority: {authority}, "
-                    f"Ref ID: {ref_id}, Amount: {amount}"
-                )
-                return True, ref_id, "Payment completed successfully"
-            elif data.get('code') == 101:
-                # Payment already verified
-                ref_id = data.get('ref_id')
-                logger.info(
-                    f"ZarinPal Payment Already Verified - Authority: {authority}, "
-                    f"Ref ID: {ref_id}, Amount: {amount}"
-                )
-                return True, ref_id, "Payment already verified"
-            else:
-                error_code = data.get('code')
-                error_message = data.get('message', 'Payment failed')
-                logger.error(
-                    f"ZarinPal Payment Verification Failed - Authority: {authority}, "
-                    f"Error Code: {error_code}, Error Message: {error_message}, "
-                    f"Amount: {amount}, Full Response: {result}"
-                )
-                return False, None, error_message
-        else:
-            error_msg = f"Error connecting to Zarinpal: HTTP {response.status_code}"
-            logger.error(
-                f"ZarinPal Verify HTTP Error - Authority: {authority}, "
-                f"Status Code: {response.status_code}, Response Text: {response.text}"
-            )
-            return False, None, error_msg
-            
+        code, ref_id, message = get_client().verify_payment(authority, amount)
     except requests.exceptions.Timeout as e:
-        error_msg = f"Timeout connecting to Zarinpal: {str(e)}"
-        logger.error(
-            f"ZarinPal Verify Timeout Error - Authority: {authority}, Error: {str(e)}",
-            exc_info=True
-        )
-        return False, None, error_msg
+        logger.error(f"ZarinPal Verify Timeout Error - Authority: {authority}, Error: {str(e)}", exc_info=True)
+        return False, None, f"Timeout connecting to Zarinpal: {str(e)}"
     except requests.exceptions.ConnectionError as e:
-        error_msg = f"Connection error to Zarinpal: {str(e)}"
-        logger.error(
-            f"ZarinPal Verify Connection Error - Authority: {authority}, Error: {str(e)}",
-            exc_info=True
-        )
-        return False, None, error_msg
+        logger.error(f"ZarinPal Verify Connection Error - Authority: {authority}, Error: {str(e)}", exc_info=True)
+        return False, None, f"Connection error to Zarinpal: {str(e)}"
     except requests.exceptions.RequestException as e:
-        error_msg = f"Error connecting to Zarinpal: {str(e)}"
-        logger.error(
-            f"ZarinPal Verify Request Exception - Authority: {authority}, Error: {str(e)}",
-            exc_info=True
-        )
-        return False, None, error_msg
+        logger.error(f"ZarinPal Verify Request Exception - Authority: {authority}, Error: {str(e)}", exc_info=True)
+        return False, None, f"Error connecting to Zarinpal: {str(e)}"
+    except GatewayError as e:
+        logger.error(f"ZarinPal Verify Gateway Error - Authority: {authority}, Error: {str(e)}")
+        return False, None, str(e)
     except Exception as e:
-        error_msg = f"Unexpected error: {str(e)}"
-        logger.exception(
-            f"ZarinPal Verify Unexpected Error - Authority: {authority}, Error: {str(e)}"
-        )
-        return False, None, error_msg
+        logger.exception(f"ZarinPal Verify Unexpected Error - Authority: {authority}, Error: {str(e)}")
+        return False, None, f"Unexpected error: {str(e)}"
 
+    if code == 100:
+        # Payment successful
+        logger.info(
+            f"ZarinPal Payment Verified Successfully - Authority: {authority}, "
+            f"Ref ID: {ref_id}, Amount: {amount}"
+        )
+        return True, ref_id, "Payment completed successfully"
+    if code == 101:
+        # Payment already verified
+        logger.info(
+            f"ZarinPal Payment Already Verified - Authority: {authority}, "
+            f"Ref ID: {ref_id}, Amount: {amount}"
+        )
+        return True, ref_id, "Payment already verified"
+    logger.error(
+        f"ZarinPal Payment Verification Failed - Authority: {authority}, "
+        f"Error Code: {code}, Error Message: {message}, Amount: {amount}"
+    )
+    return False, None, message
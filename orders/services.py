@@ -0,0 +1,284 @@
+"""
+Order placement and stock reservations.
+
+place_order() turns a cart into an order inside one transaction. Product
+rows are locked in id order, so concurrent checkouts of overlapping carts
+queue up instead of deadlocking. Stock is claimed with a conditional
+`UPDATE ... WHERE stock - reserved_stock >= q`, which cannot oversell even
+where row locks are unavailable, and the order items are written with one
+bulk_create. A shortfall on any product rolls the whole order back.
+Transactions that move stock run under write_atomic(), so on SQLite they
+queue for the write lock instead of failing on a lock upgrade.
+
+Cash orders take their stock right away. Online orders only reserve it:
+Product.reserved_stock grows and a StockReservation row records the hold
+until PAYMENT_WINDOW after the order. confirm_payment() turns the hold into
+sold stock; release_expired_reservations() hands expired holds back to
+sale in batches of set-based UPDATEs.
+"""
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from cart.models import CartItem
+from core.cache_utils import bump_version
+from core.transactions import write_atomic
+from products import catalog_index
+from products.facets import CACHE_NAMESPACE as CATALOG_CACHE
+from products.models import Product
+from .models import Order, OrderItem, PaymentAttempt, StockReservation, PAYMENT_WINDOW
+from .order_numbers import next_order_number
+from .payment import verify_zarinpal_payment
+
+logger = logging.getLogger(__name__)
+
+# A verifying claim older than this is presumed abandoned by a crashed
+# worker; it outlasts the gateway client's retries and timeouts
+VERIFY_CLAIM_TIMEOUT = timedelta(minutes=2)
+
+
+class EmptyCart(Exception):
+    pass
+
+
+class OutOfStock(Exception):
+    def __init__(self, product):
+        self.product = product
+        super().__init__(f'موجودی محصول {product.title} کافی نیست')
+
+
+def take_stock(quantities, products):
+    """Decrement stock and count sales for {product_id: quantity}, in id order"""
+    for product_id in sorted(quantities):
+        quantity = quantities[product_id]
+        taken = Product.objects.filter(pk=product_id, stock__gte=F('reserved_stock') + quantity).update(
+            stock=F('stock') - quantity, sales=F('sales') + quantity,
+        )
+        if not taken:
+            raise OutOfStock(products[product_id])
+
+
+def reserve_stock(quantities, products):
+    """Hold {product_id: quantity} out of the available stock, in id order"""
+    for product_id in sorted(quantities):
+        quantity = quantities[product_id]
+        held = Product.objects.filter(pk=product_id, stock__gte=F('reserved_stock') + quantity).update(
+            reserved_stock=F('reserved_stock') + quantity,
+        )
+        if not held:
+            raise OutOfStock(products[product_id])
+
+
+def stock_changed(product_ids):
+    """Refresh listings after stock moved through UPDATE, which skips Product signals"""
+    bump_version(CATALOG_CACHE)
+    catalog_index.schedule_refresh(*product_ids)
+
+
+def place_order(cart, *, address, payment_method, shipping_cost, notes=''):
+    """Create the cart's order, take its stock and empty the cart, all or nothing"""
+    # Outside the transaction, so a rollback cannot hand the number's block out twice
+    order_number = next_order_number()
+    with write_atomic():
+        # Read inside the transaction, not from a cart prefetched before it
+        items = list(CartItem.objects.filter(cart=cart))
+        if not items:
+            raise EmptyCart()
+
+        quantities = Counter()
+        for item in items:
+            quantities[item.product_id] += item.quantity
+        locked = Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk')
+        products = {product.pk: product for product in locked}
+        reserve = payment_method == 'online'
+        if reserve:
+            reserve_stock(quantities, products)
+        else:
+            take_stock(quantities, products)
+
+        order = Order.objects.create(
+            user_id=cart.user_id,
+            order_number=order_number,
+            address=address,
+            payment_method=payment_method,
+            total_price=sum(products[item.product_id].price * item.quantity for item in items),
+            shipping_cost=shipping_cost,
+            notes=notes,
+            status='pending',
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product_id=item.product_id,
+                color_id=item.color_id,
+                quantity=item.quantity,
+                price=products[item.product_id].price,
+            )
+            for item in items
+        ])
+        if reserve:
+            expires_at = order.created_at + PAYMENT_WINDOW
+            StockReservation.objects.bulk_create([
+                StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+                for product_id, quantity in quantities.items()
+            ])
+        # Reserving moves availability as much as taking does
+        stock_changed(quantities)
+        CartItem.objects.filter(pk__in=[item.pk for item in items]).delete()
+    return order
+
+
+def confirm_payment(order):
+    """
+    Mark the order paid and turn its reservations into sold stock. An online
+    order paid after its hold was released claims the stock again; when it
+    has sold out meanwhile the order is flagged 'refund_pending' for manual
+    review instead of being marked paid. `order` is updated in place.
+    """
+    with write_atomic():
+        locked = Order.objects.select_for_update().get(pk=order.pk)
+        if not locked.payment_status:
+            reservations = list(StockReservation.objects.select_for_update().filter(order=locked).order_by('product_id'))
+            for reservation in reservations:
+                # Greatest() guards against stock lowered by hand below the reservation
+                Product.objects.filter(pk=reservation.product_id).update(
+                    stock=Greatest(F('stock') - reservation.quantity, 0),
+                    reserved_stock=Greatest(F('reserved_stock') - reservation.quantity, 0),
+                    sales=F('sales') + reservation.quantity,
+                )
+            locked.status = 'paid'
+            if reservations:
+                StockReservation.objects.filter(pk__in=[reservation.pk for reservation in reservations]).delete()
+                stock_changed({reservation.product_id for reservation in reservations})
+            elif locked.payment_method == 'online':
+                quantities = Counter()
+                for product_id, quantity in locked.items.filter(product__isnull=False).values_list('product_id', 'quantity'):
+                    quantities[product_id] += quantity
+                try:
+                    # A savepoint, so a shortfall undoes the products already claimed
+                    with transaction.atomic():
+                        take_stock(quantities, Product.objects.in_bulk(quantities))
+                except OutOfStock as e:
+                    logger.error("Order %s was paid after its reservation was released: %s", locked.pk, e)
+                    locked.status = 'refund_pending'
+                else:
+                    stock_changed(quantities)
+            locked.payment_status = True
+            locked.save()
+    order.status, order.payment_status = locked.status, locked.payment_status
+
+
+def _release_rows(rows):
+    """Release (pk, product_id) reservation rows: one UPDATE for all touched products, one DELETE"""
+    if not rows:
+        return
+    ids = [pk for pk, _ in rows]
+    held = (
+        StockReservation.objects.filter(pk__in=ids, product=OuterRef('pk'))
+        .order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    product_ids = {product_id for _, product_id in rows}
+    Product.objects.filter(pk__in=product_ids).update(
+        reserved_stock=Greatest(F('reserved_stock') - Subquery(held), 0),
+    )
+    StockReservation.objects.filter(pk__in=ids).delete()
+    stock_changed(product_ids)
+
+
+def release_reservations(reservations):
+    """Hand the reserved units of a reservation queryset back to sale and delete the rows"""
+    _release_rows(list(reservations.values_list('pk', 'product_id')))
+
+
+def release_expired_reservations(batch_size=500, now=None):
+    """
+    Release reservations past their expiry in batches and cancel their
+    unpaid orders. Returns (reservations released, orders cancelled).
+    """
+    now = now or timezone.now()
+    released = cancelled = 0
+    while True:
+        with write_atomic():
+            # Rows another worker is releasing or confirming are left to it
+            rows = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now).order_by('pk')
+                .values_list('pk', 'product_id', 'order_id')[:batch_size]
+            )
+            _release_rows([(pk, product_id) for pk, product_id, _ in rows])
+            cancelled += Order.objects.filter(
+                pk__in={order_id for _, _, order_id in rows}, status='pending', payment_status=False,
+            ).update(status='cancelled')
+        released += len(rows)
+        if len(rows) < batch_size:
+            return released, cancelled
+
+
+def expire_pending_orders(batch_size=500, now=None):
+    """
+    Cancel unpaid online orders older than PAYMENT_WINDOW, releasing their
+    stock, batch_size rows per UPDATE. Returns the number of orders cancelled.
+    Cash orders are paid on delivery and stay pending until staff act on them.
+    """
+    now = now or timezone.now()
+    _, cancelled = release_expired_reservations(batch_size, now)
+    # Online orders placed before reservations existed
+    expired = Order.objects.filter(
+        payment_method='online', status='pending', payment_status=False, created_at__lt=now - PAYMENT_WINDOW
+    )
+    while True:
+        ids = list(expired.order_by('created_at').values_list('pk', flat=True)[:batch_size])
+        if ids:
+            cancelled += expired.filter(pk__in=ids).update(status='cancelled')
+        if len(ids) < batch_size:
+            return cancelled
+
+
+def cancel_order(order):
+    """Cancel an unpaid order and release its reservations"""
+    with write_atomic():
+        release_reservations(order.reservations.all())
+        order.status = 'cancelled'
+        order.save()
+
+
+def verify_payment_attempt(attempt):
+    """
+    Verify a gateway payment once, whoever calls back and however often.
+    The callback first claims the attempt (pending → verifying) in its own
+    short write, then asks the gateway with no transaction open, so a slow
+    gateway never holds the database write lock. Only the final attempt and
+    order update runs in a transaction. A claim left behind by a crashed
+    worker can be taken over after VERIFY_CLAIM_TIMEOUT; re-verifying is
+    safe, the gateway answers 101 for a payment it already verified.
+    Returns (attempt, message); attempt.status is 'paid' on success.
+    """
+    claimed_at = timezone.now()
+    claimed = PaymentAttempt.objects.filter(
+        Q(status='pending') | Q(status='verifying', claimed_at__lt=claimed_at - VERIFY_CLAIM_TIMEOUT),
+        pk=attempt.pk,
+    ).update(status='verifying', claimed_at=claimed_at)
+    if not claimed:
+        attempt = PaymentAttempt.objects.select_related('order').get(pk=attempt.pk)
+        if attempt.status == 'paid':
+            return attempt, "Payment already verified"
+        return attempt, "Payment is being verified" if attempt.status == 'verifying' else "Payment failed"
+
+    ours = PaymentAttempt.objects.filter(pk=attempt.pk, status='verifying', claimed_at=claimed_at)
+    success, ref_id, message = verify_zarinpal_payment(attempt.authority, attempt.amount)
+    if not success:
+        # Back to pending: the failure may be the gateway's, and the next callback retries
+        ours.update(status='pending')
+        return PaymentAttempt.objects.select_related('order').get(pk=attempt.pk), message
+
+    with write_atomic():
+        # Lost only if this worker outlived its claim and another finished first
+        if ours.update(status='paid', ref_id=str(ref_id or ''), verified_at=timezone.now()):
+            attempt = PaymentAttempt.objects.select_related('order').get(pk=attempt.pk)
+            confirm_payment(attempt.order)
+    return PaymentAttempt.objects.select_related('order').get(pk=attempt.pk), message
@@ -0,0 +1,11 @@
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from .models import Order
+from .services import release_reservations
+
+
+@receiver(pre_delete, sender=Order)
+def release_order_reservations(sender, instance, **kwargs):
+    """Return held stock before the reservations go with the order's cascade"""
+    release_reservations(instance.reservations.all())
@@ -1,3 +1,479 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import MyUser, Address
+from cart.models import Cart, CartItem
+from products.models import Product, Category, Color
+from .models import Order, OrderNumberCounter, PaymentAttempt, StockReservation
+from .payment import CircuitBreaker, ZarinpalClient, GatewayUnavailable, CircuitOpen, verify_zarinpal_payment
+from .zarinpal_stub import StubGateway
+from . import order_numbers
+from .order_numbers import BLOCK_SIZE, OrderNumberAllocator, FeistelPermutation, is_valid_order_number
+from .services import (
+    place_order, confirm_payment, release_expired_reservations, expire_pending_orders, verify_payment_attempt, OutOfStock,
+)
+
+TEST_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(phone='09120000000')
+        category = Category.objects.create(name='موبایل')
+        cls.products = [
+            Product.objects.create(title=f'گوشی {i}', description='-', category=category, price=100 * (i + 1), stock=5)
+            for i in range(4)
+        ]
+        cls.cart = Cart.objects.create(user=cls.user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_empty_cart_redirects(self):
+        self.assertRedirects(self.client.get(reverse('checkout')), reverse('cart'), fetch_redirect_response=False)
+
+    def test_checkout_queries_do_not_grow(self):
+        CartItem.objects.create(cart=self.cart, product=self.products[0])
+        self.client.get(reverse('checkout'))
+        with CaptureQueriesContext(connection) as one_item:
+            self.client.get(reverse('checkout'))
+        for product in self.products[1:]:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+        with self.assertNumQueries(len(one_item)):
+            response = self.client.get(reverse('checkout'))
+        self.assertEqual(response.context['total_price'], 1900)
+        self.assertEqual(response.context['final_price'], 1900 + response.context['shipping_cost'])
+
+
+class PlaceOrderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(phone='09120000000')
+        category = Category.objects.create(name='موبایل')
+        cls.products = [
+            Product.objects.create(title=f'گوشی {i}', description='-', category=category, price=100 * (i + 1), stock=3)
+            for i in range(4)
+        ]
+        cls.colors = [Color.objects.create(name=name, hex_code='#000000') for name in ('مشکی', 'سفید')]
+        cls.cart = Cart.objects.create(user=cls.user)
+
+    def add(self, product, quantity=1, color=None):
+        return CartItem.objects.create(cart=self.cart, product=product, quantity=quantity, color=color)
+
+    def place(self):
+        return place_order(self.cart, address=None, payment_method='cash', shipping_cost=10)
+
+    def stock(self):
+        return list(Product.objects.order_by('id').values_list('stock', 'sales'))
+
+    def test_order_takes_stock_and_empties_cart(self):
+        self.add(self.products[0], 1, self.colors[0])
+        self.add(self.products[0], 2, self.colors[1])
+        self.add(self.products[1], 1)
+        order = self.place()
+        self.assertEqual(order.total_price, 100 * 3 + 200)
+        self.assertEqual(order.get_final_price(), 510)
+        self.assertEqual(
+            sorted(order.items.values_list('product_id', 'color_id', 'quantity', 'price')),
+            sorted([
+                (self.products[0].pk, self.colors[0].pk, 1, 100),
+                (self.products[0].pk, self.colors[1].pk, 2, 100),
+                (self.products[1].pk, None, 1, 200),
+            ]),
+        )
+        self.assertEqual(self.stock(), [(0, 3), (2, 1), (3, 0), (3, 0)])
+        self.assertFalse(self.cart.items.exists())
+
+    def test_shortfall_rolls_back_everything(self):
+        self.add(self.products[0], 1)
+        self.add(self.products[1], 4)
+        with self.assertRaises(OutOfStock) as raised:
+            self.place()
+        self.assertEqual(raised.exception.product, self.products[1])
+        self.assertEqual(self.stock(), [(3, 0)] * 4)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.cart.items.count(), 2)
+
+    def test_queries_do_not_grow_with_cart_size(self):
+        # Inside the test transaction each order reserves a block of its own
+        OrderNumberCounter.objects.create(name='orders')
+        self.add(self.products[0])
+        with CaptureQueriesContext(connection) as one_product:
+            self.place()
+        for product in self.products[1:]:
+            self.add(product)
+        # One conditional UPDATE per distinct product, everything else is fixed
+        with self.assertNumQueries(len(one_product) + 2):
+            self.place()
+
+    @override_settings(STORAGES=TEST_STORAGES)
+    def test_create_order_view(self):
+        address = Address.objects.create(
+            user=self.user, first_name='علی', last_name='رضایی', province='تهران', city='تهران',
+            address_details='-', phone_number='0912', postal_code='1',
+        )
+        self.add(self.products[0], 4)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('create_order'), {'address_id': address.pk, 'payment_method': 'cash'})
+        self.assertRedirects(response, reverse('cart'), fetch_redirect_response=False)
+
+        CartItem.objects.update(quantity=2)
+        response = self.client.post(reverse('create_order'), {'address_id': address.pk, 'payment_method': 'cash'})
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('checkout_complete', args=[order.pk]), fetch_redirect_response=False)
+        self.assertEqual(self.stock()[0], (1, 2))
+
+
+class StockReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(phone='09120000000')
+        category = Category.objects.create(name='موبایل')
+        cls.products = [
+            Product.objects.create(title=f'گوشی {i}', description='-', category=category, price=100, stock=3)
+            for i in range(2)
+        ]
+        cls.cart = Cart.objects.create(user=cls.user)
+
+    def place(self, payment_method='online', **quantities):
+        for index, quantity in quantities.items():
+            CartItem.objects.create(cart=self.cart, product=self.products[int(index[1:])], quantity=quantity)
+        return place_order(self.cart, address=None, payment_method=payment_method, shipping_cost=0)
+
+    def stock(self):
+        return list(Product.objects.order_by('id').values_list('stock', 'reserved_stock', 'sales'))
+
+    def test_online_order_reserves_until_paid(self):
+        order = self.place(p0=2, p1=1)
+        self.assertEqual(self.stock(), [(3, 2, 0), (3, 1, 0)])
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).available_stock, 1)
+        reservation = order.reservations.get(product=self.products[0])
+        self.assertEqual(reservation.expires_at, order.created_at + timedelta(hours=1))
+
+        # Reserved units cannot be sold twice
+        with self.assertRaises(OutOfStock):
+            self.place(payment_method='cash', p0=2)
+        CartItem.objects.all().delete()
+
+        confirm_payment(order)
+        self.assertEqual(self.stock(), [(1, 0, 2), (2, 0, 1)])
+        self.assertFalse(StockReservation.objects.exists())
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_status), ('paid', True))
+
+    def test_late_payment_claims_stock_again(self):
+        order = self.place(p0=2)
+        StockReservation.objects.update(expires_at=timezone.now())
+        release_expired_reservations()
+        confirm_payment(order)
+        self.assertEqual(self.stock()[0], (1, 0, 2))
+        self.assertEqual((order.status, order.payment_status), ('paid', True))
+
+    def test_late_payment_without_stock_is_flagged_for_refund(self):
+        order = self.place(p0=2, p1=1)
+        StockReservation.objects.update(expires_at=timezone.now())
+        release_expired_reservations()
+        CartItem.objects.all().delete()
+        self.place(payment_method='cash', p1=3)
+        confirm_payment(order)
+        # Nothing is claimed when one product falls short
+        self.assertEqual(self.stock(), [(3, 0, 0), (0, 0, 3)])
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_status), ('refund_pending', True))
+
+    def test_confirming_through_a_stale_instance_is_a_no_op(self):
+        order = self.place(p0=1)
+        stale = Order.objects.get(pk=order.pk)
+        confirm_payment(order)
+        confirm_payment(stale)
+        self.assertEqual(self.stock()[0], (2, 0, 1))
+        self.assertEqual((stale.status, stale.payment_status), ('paid', True))
+
+    def test_expired_reservations_are_released_in_batches(self):
+        orders = [self.place(p0=1), self.place(p0=1, p1=1), self.place(p1=2)]
+        StockReservation.objects.filter(order__in=orders[:2]).update(expires_at=timezone.now() - timedelta(minutes=1))
+        # A full batch of two and a short one: select, update, delete and cancel in a savepoint each
+        with self.assertNumQueries(2 * 6):
+            self.assertEqual(release_expired_reservations(batch_size=2), (3, 2))
+        self.assertEqual(self.stock(), [(3, 0, 0), (3, 2, 0)])
+        self.assertEqual(
+            list(Order.objects.order_by('id').values_list('status', flat=True)), ['cancelled', 'cancelled', 'pending'],
+        )
+
+    def test_release_skips_paid_orders_status(self):
+        order = self.place(p0=1)
+        Order.objects.filter(pk=order.pk).update(status='processing')
+        StockReservation.objects.update(expires_at=timezone.now())
+        self.assertEqual(release_expired_reservations(), (1, 0))
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'processing')
+        self.assertEqual(self.stock()[0], (3, 0, 0))
+
+    def test_deleting_an_order_releases_its_reservations(self):
+        self.place(p0=2).delete()
+        self.assertEqual(self.stock()[0], (3, 0, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class ExpirePendingOrdersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(phone='09120000000')
+        cls.orders = [
+            Order.objects.create(user=cls.user, total_price=100, payment_method=payment_method, status=status, payment_status=paid)
+            for payment_method, status, paid in [
+                ('cash', 'pending', False),
+                ('online', 'pending', False),
+                ('online', 'paid', True),
+                ('online', 'pending', False),
+            ]
+        ]
+        # All but the last one are past the payment window
+        Order.objects.exclude(pk=cls.orders[-1].pk).update(created_at=timezone.now() - timedelta(hours=2))
+
+    def statuses(self):
+        return list(Order.objects.order_by('id').values_list('status', flat=True))
+
+    def test_sweep_cancels_expired_orders_in_batches(self):
+        self.assertEqual(expire_pending_orders(batch_size=1), 1)
+        self.assertEqual(self.statuses(), ['pending', 'cancelled', 'paid', 'pending'])
+
+    def test_cash_orders_are_left_alone(self):
+        cash = Order.objects.get(pk=self.orders[0].pk)
+        self.assertFalse(cash.is_pending_payment_expired())
+        self.assertEqual(cash.get_status_display(), dict(Order.STATUS_CHOICES)['pending'])
+        expire_pending_orders()
+        self.assertEqual(Order.objects.get(pk=cash.pk).status, 'pending')
+
+    def test_dashboard_only_reads(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('dashboard-orders'))
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
+        self.assertEqual(self.statuses(), ['pending', 'pending', 'paid', 'pending'])
+        # Expired orders already read as cancelled
+        self.assertContains(response, 'لغو شده', count=1)
+
+
+class OrderNumberTests(TestCase):
+    def test_permutation_is_reversible(self):
+        permutation = FeistelPermutation(10, b'key')
+        shuffled = [permutation.permute(value) for value in range(BLOCK_SIZE)]
+        self.assertEqual(sorted(shuffled), list(range(BLOCK_SIZE)))
+        self.assertNotEqual(shuffled, list(range(BLOCK_SIZE)))
+        self.assertEqual([permutation.invert(value) for value in shuffled], list(range(BLOCK_SIZE)))
+
+    def test_numbers_are_unique_valid_and_grow_by_block(self):
+        first, second = OrderNumberAllocator(name='test', key=b'key'), OrderNumberAllocator(name='test', key=b'key')
+        OrderNumberCounter.objects.create(name='test')
+        # One UPDATE and one SELECT in a savepoint per block of BLOCK_SIZE numbers
+        with self.assertNumQueries(3 * 4):
+            numbers = [first.next() for _ in range(BLOCK_SIZE)] + [second.next(), first.next()]
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertTrue(all(is_valid_order_number(number) for number in numbers))
+        self.assertEqual([first.parse(number)[0] for number in numbers[-3:]], [1, 2, 3])
+        self.assertEqual(first.parse(numbers[5]), (1, 5))
+        self.assertEqual(OrderNumberCounter.objects.get(name='test').last_block, 3)
+
+    def test_check_digit_catches_typos(self):
+        number = OrderNumberAllocator(name='test', key=b'key').next()
+        typo = number[:3] + str((int(number[3]) + 1) % 10) + number[4:]
+        self.assertFalse(is_valid_order_number(typo))
+        self.assertIsNone(OrderNumberAllocator(name='test', key=b'key').parse(typo))
+
+    def test_numbers_in_a_transaction_use_their_own_block(self):
+        with mock.patch.object(order_numbers, '_allocator', None), transaction.atomic():
+            order_numbers.next_order_number()
+            order_numbers.next_order_number()
+            self.assertIsNone(order_numbers._allocator)
+        self.assertEqual(OrderNumberCounter.objects.get(name='orders').last_block, 2)
+
+    def test_forked_worker_gets_its_own_allocator(self):
+        allocator = OrderNumberAllocator()
+        with mock.patch.object(order_numbers, '_allocator', allocator):
+            self.assertIs(order_numbers.get_allocator(), allocator)
+            with mock.patch('orders.order_numbers.os.getpid', return_value=allocator.pid + 1):
+                self.assertIsNot(order_numbers.get_allocator(), allocator)
+
+    def test_orders_get_numbers(self):
+        user = MyUser.objects.create_user(phone='09120000000')
+        orders = [Order.objects.create(user=user, total_price=100) for _ in range(3)]
+        self.assertEqual(len({order.order_number for order in orders}), 3)
+        self.assertTrue(all(is_valid_order_number(order.order_number) for order in orders))
+
+
+class ZarinpalClientTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.gateway = StubGateway().start()
+        cls.addClassCleanup(cls.gateway.stop)
+
+    def setUp(self):
+        self.gateway.failure_rate = 0
+
+    def client_for(self, **kwargs):
+        return ZarinpalClient('merchant', self.gateway.url, self.gateway.url, retry_backoff=0, **kwargs)
+
+    def test_request_pay_and_verify(self):
+        client = self.client_for()
+        payment_url, authority = client.request_payment(1000, 'test', 'http://testserver/callback', order_id=1)
+        self.assertEqual(payment_url, f'{self.gateway.url}/pg/StartPay/{authority}')
+        self.assertEqual(client.verify_payment(authority, 1000)[0], -51)
+
+        redirect = requests.get(payment_url, allow_redirects=False)
+        self.assertEqual(redirect.headers['Location'], f'http://testserver/callback?Authority={authority}&Status=OK')
+        code, ref_id, _ = client.verify_payment(authority, 1000)
+        self.assertEqual(code, 100)
+        self.assertEqual(client.verify_payment(authority, 1000)[:2], (101, ref_id))
+        self.assertEqual(client.verify_payment(authority, 999)[0], -50)
+
+    def test_verify_retries_then_breaker_fails_fast(self):
+        client = self.client_for(verify_retries=2, breaker=CircuitBreaker(threshold=4, cooldown=60))
+        self.gateway.failure_rate = 1
+        with self.assertRaises(GatewayUnavailable):
+            client.verify_payment('S1', 1000)
+        self.assertEqual(client.breaker.failures, 3)
+        # The fourth failure opens the circuit and the rest of the retries fail fast
+        with self.assertRaises(CircuitOpen):
+            client.verify_payment('S1', 1000)
+        self.assertEqual(client.breaker.failures, 4)
+
+    def test_breaker_half_opens_after_cooldown(self):
+        now = [0]
+        breaker = CircuitBreaker(threshold=2, cooldown=30, clock=lambda: now[0])
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        now[0] = 30
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+
+    def test_wrapper_reports_gateway_errors(self):
+        with self.settings(ZARINPAL_MERCHANT_ID='merchant', ZARINPAL_API_URL=self.gateway.url):
+            self.assertEqual(verify_zarinpal_payment('unknown', 1000), (False, None, 'Session is not valid'))
+
+    @override_settings(STORAGES=TEST_STORAGES, ZARINPAL_ACTIVE=True, ZARINPAL_MERCHANT_ID='merchant')
+    def test_online_checkout_through_stub(self):
+        user = MyUser.objects.create_user(phone='09120000000')
+        address = Address.objects.create(
+            user=user, first_name='علی', last_name='رضایی', province='تهران', city='تهران',
+            address_details='-', phone_number='0912', postal_code='1',
+        )
+        category = Category.objects.create(name='موبایل')
+        product = Product.objects.create(title='گوشی', description='-', category=category, price=100, stock=3)
+        CartItem.objects.create(cart=Cart.objects.create(user=user), product=product, quantity=2)
+        self.client.force_login(user)
+
+        with self.settings(ZARINPAL_API_URL=self.gateway.url):
+            response = self.client.post(reverse('create_order'), {'address_id': address.pk, 'payment_method': 'online'})
+            self.assertTrue(response['Location'].startswith(f'{self.gateway.url}/pg/StartPay/'))
+            callback = requests.get(response['Location'], allow_redirects=False).headers['Location']
+            # The callback may land on another node, without the customer's session
+            self.client.logout()
+            response = self.client.get(callback)
+
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('checkout_complete', args=[order.pk]), fetch_redirect_response=False)
+        self.assertEqual((order.status, order.payment_status), ('paid', True))
+        product.refresh_from_db()
+        self.assertEqual((product.stock, product.reserved_stock, product.sales), (1, 0, 2))
+
+
+@override_settings(ZARINPAL_MERCHANT_ID='merchant')
+class PaymentCallbackTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.gateway = StubGateway().start()
+        cls.addClassCleanup(cls.gateway.stop)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(phone='09120000000')
+        category = Category.objects.create(name='موبایل')
+        cls.product = Product.objects.create(title='گوشی', description='-', category=category, price=100, stock=3)
+        cart = Cart.objects.create(user=cls.user)
+        CartItem.objects.create(cart=cart, product=cls.product, quantity=1)
+        cls.order = place_order(cart, address=None, payment_method='online', shipping_cost=0)
+
+    def setUp(self):
+        self.enterContext(self.settings(ZARINPAL_API_URL=self.gateway.url))
+        _, authority = ZarinpalClient('merchant', self.gateway.url, self.gateway.url).request_payment(
+            100, 'test', 'http://testserver/callback',
+        )
+        self.attempt = PaymentAttempt.objects.create(order=self.order, authority=authority, amount=100)
+
+    def callback(self, status='OK'):
+        return self.client.get(reverse('zarinpal_callback'), {'Authority': self.attempt.authority, 'Status': status})
+
+    def test_replayed_callbacks_verify_once(self):
+        self.gateway.pay(self.attempt.authority)
+        with mock.patch('orders.services.verify_zarinpal_payment', wraps=verify_zarinpal_payment) as verify:
+            for _ in range(3):
+                response = self.callback()
+                self.assertRedirects(response, reverse('checkout_complete', args=[self.order.pk]), fetch_redirect_response=False)
+                self.assertNotIn('sessionid', response.cookies)
+        self.assertEqual(verify.call_count, 1)
+        self.attempt.refresh_from_db()
+        self.assertEqual(self.attempt.status, 'paid')
+        self.assertTrue(self.attempt.ref_id)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved_stock), (2, 0))
+
+    def test_gateway_is_asked_outside_any_transaction(self):
+        self.gateway.pay(self.attempt.authority)
+        depth = len(connection.atomic_blocks)
+        statuses = []
+
+        def verify(authority, amount):
+            statuses.append((len(connection.atomic_blocks), PaymentAttempt.objects.get(pk=self.attempt.pk).status))
+            return verify_zarinpal_payment(authority, amount)
+
+        with mock.patch('orders.services.verify_zarinpal_payment', side_effect=verify):
+            attempt, _ = verify_payment_attempt(self.attempt)
+        self.assertEqual(statuses, [(depth, 'verifying')])
+        self.assertEqual(attempt.status, 'paid')
+        self.assertTrue(attempt.order.payment_status)
+
+    def test_claimed_attempt_is_left_to_its_verifier(self):
+        self.gateway.pay(self.attempt.authority)
+        PaymentAttempt.objects.filter(pk=self.attempt.pk).update(status='verifying', claimed_at=timezone.now())
+        with mock.patch('orders.services.verify_zarinpal_payment') as verify:
+            response = self.callback()
+        verify.assert_not_called()
+        self.assertRedirects(response, reverse('order_detail', args=[self.order.pk]), fetch_redirect_response=False)
+
+        # A claim abandoned by a crashed worker is taken over
+        PaymentAttempt.objects.filter(pk=self.attempt.pk).update(claimed_at=timezone.now() - timedelta(minutes=5))
+        attempt, _ = verify_payment_attempt(self.attempt)
+        self.assertEqual(attempt.status, 'paid')
+
+    def test_unpaid_callback_stays_pending(self):
+        response = self.callback()
+        self.assertRedirects(response, reverse('checkout'), fetch_redirect_response=False)
+        self.attempt.refresh_from_db()
+        self.assertEqual(self.attempt.status, 'pending')
+        self.assertFalse(Order.objects.get(pk=self.order.pk).payment_status)
+
+    def test_cancelled_and_unknown_callbacks(self):
+        self.callback(status='NOK')
+        self.assertEqual(PaymentAttempt.objects.get(pk=self.attempt.pk).status, 'failed')
+        response = self.client.get(reverse('zarinpal_callback'), {'Authority': 'unknown', 'Status': 'OK'})
+        self.assertRedirects(response, reverse('checkout'), fetch_redirect_response=False)
@@ -8,9 +8,11 @@ from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.urls import reverse
 
-from .models import Order, OrderItem
-from .payment import get_zarinpal_payment_url, verify_zarinpal_payment
-from cart.models import Cart, CartItem
+from .models import Order, PaymentAttempt
+from .payment import get_zarinpal_payment_url
+from .services import place_order, confirm_payment, cancel_order, verify_payment_attempt, EmptyCart, OutOfStock
+from cart.models import Cart
+from cart.services import get_user_cart
 from accounts.models import Address
 
 logger = logging.getLogger(__name__)
@@ -19,9 +21,10 @@ logger = logging.getLogger(__name__)
 @login_required
 def checkout(request):
     """Checkout page"""
-    cart = Cart.objects.filter(user=request.user).first()
+    # Shared with the header mini-cart through the context processor
+    cart = get_user_cart(request)
     
-    if not cart or cart.items.count() == 0:
+    if not cart or cart.get_total_items() == 0:
         messages.warning(request, 'سبد خرید شما خالی است')
         return redirect('cart')
     
@@ -49,10 +52,6 @@ def create_order(request):
     try:
         cart = Cart.objects.get(user=request.user)
         
-        if cart.items.count() == 0:
-            messages.warning(request, 'سبد خرید شما خالی است')
-            return redirect('cart')
-        
         address_id = request.POST.get('address_id')
         payment_method = request.POST.get('payment_method', 'online')
         notes = request.POST.get('notes', '')
@@ -67,44 +66,25 @@ def create_order(request):
             messages.error(request, 'آدرس یافت نشد')
             return redirect('checkout')
         
-        # Check product stock
-        for item in cart.items.all():
-            if item.product.stock < item.quantity:
-                messages.error(request, f'موجودی محصول {item.product.title} کافی نیست')
-                return redirect('cart')
-        
         # Calculate shipping cost based on shipping type
         shipping_type = request.POST.get('send', '4')
         shipping_cost = 19000 if shipping_type == '4' else 32000
         
-        # Create order
-        order = Order.objects.create(
-            user=request.user,
-            address=address,
-            payment_method=payment_method,
-            total_price=cart.get_total_price(),
-            shipping_cost=shipping_cost,
-            notes=notes,
-            status='pending'
-        )
-        
-        # Create order items and reduce stock
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                color=cart_item.color,
-                quantity=cart_item.quantity,
-                price=cart_item.product.price
+        # Create order, take stock and clear cart in one transaction
+        try:
+            order = place_order(
+                cart,
+                address=address,
+                payment_method=payment_method,
+                shipping_cost=shipping_cost,
+                notes=notes,
             )
-            
-            # Reduce stock
-            cart_item.product.stock -= cart_item.quantity
-            cart_item.product.sales += cart_item.quantity
-            cart_item.product.save()
-        
-        # Clear cart
-        cart.items.all().delete()
+        except EmptyCart:
+            messages.warning(request, 'سبد خرید شما خالی است')
+            return redirect('cart')
+        except OutOfStock as e:
+            messages.error(request, str(e))
+            return redirect('cart')
         
         # Process payment
         if payment_method == 'online':
@@ -129,10 +109,8 @@ def create_order(request):
                 )
                 
                 if payment_url and payment_url.strip():
-                    # Store authority in session for use in callback
-                    request.session['zarinpal_authority'] = authority
-                    request.session['zarinpal_order_id'] = order.id
-                    request.session.modified = True  # Ensure session is saved
+                    # The callback finds the order by this authority, not through the session
+                    PaymentAttempt.objects.create(order=order, authority=authority, amount=final_price)
                     logger.info(
                         f"Redirecting to ZarinPal payment - Order ID: {order.id}, "
                         f"User: {request.user.phone}, Authority: {authority}, "
@@ -149,9 +127,7 @@ def create_order(request):
                     return redirect('checkout')
             else:
                 # Auto payment (for testing)
-                order.payment_status = True
-                order.status = 'paid'
-                order.save()
+                confirm_payment(order)
                 messages.success(request, 'سفارش شما با موفقیت ثبت و پرداخت شد')
                 return redirect('checkout_complete', order_id=order.id)
         else:
@@ -197,82 +173,71 @@ def order_detail(request, order_id):
     })
 
 
-@login_required
 def zarinpal_callback(request):
-    """Zarinpal payment callback after payment"""
+    """
+    Zarinpal payment callback after payment.
+
+    The order is found by the stored authority alone, without touching the
+    session, so any node can handle the callback even if the customer's
+    session is gone. Repeated callbacks do not verify twice.
+    """
     authority = request.GET.get('Authority')
     status = request.GET.get('Status')
     
     logger.info(
         f"ZarinPal Callback Received - Authority: {authority}, Status: {status}, "
-        f"User: {request.user.phone}, GET Params: {dict(request.GET)}"
+        f"GET Params: {dict(request.GET)}"
     )
     
-    # Get data from session
-    session_authority = request.session.get('zarinpal_authority')
-    order_id = request.session.get('zarinpal_order_id')
-    
-    if not order_id:
-        logger.error(
-            f"ZarinPal Callback Error: Order ID not found in session - "
-            f"User: {request.user.phone}, Authority: {authority}, Status: {status}"
-        )
+    attempt = PaymentAttempt.objects.select_related('order').filter(authority=authority).first() if authority else None
+    if attempt is None:
+        logger.error(f"ZarinPal Callback Error: Unknown authority - Authority: {authority}, Status: {status}")
         messages.error(request, 'سفارش یافت نشد')
         return redirect('checkout')
+    order = attempt.order
     
-    try:
-        order = get_object_or_404(Order, id=order_id, user=request.user)
-    except Exception as e:
-        logger.error(
-            f"ZarinPal Callback Error: Order not found - Order ID: {order_id}, "
-            f"User: {request.user.phone}, Error: {str(e)}",
-            exc_info=True
+    if status != 'OK':
+        PaymentAttempt.objects.filter(pk=attempt.pk, status='pending').update(status='failed')
+        logger.warning(
+            f"ZarinPal Payment Cancelled or Invalid - Order ID: {order.id}, "
+            f"Status: {status}, Authority: {authority}"
         )
-        messages.error(request, 'سفارش یافت نشد')
+        messages.warning(request, 'پرداخت لغو شد')
         return redirect('checkout')
     
-    # Clear session
-    if 'zarinpal_authority' in request.session:
-        del request.session['zarinpal_authority']
-    if 'zarinpal_order_id' in request.session:
-        del request.session['zarinpal_order_id']
+    logger.info(
+        f"ZarinPal Callback Verification Started - Order ID: {order.id}, "
+        f"Authority: {authority}, Amount: {attempt.amount}"
+    )
+    attempt, message = verify_payment_attempt(attempt)
     
-    if status == 'OK' and authority == session_authority:
-        # Verify payment
-        final_price = order.get_final_price()
+    if attempt.status == 'paid' and attempt.order.status == 'refund_pending':
+        logger.error(
+            f"ZarinPal Payment Needs Refund - Order ID: {order.id}, "
+            f"Ref ID: {attempt.ref_id}, Authority: {authority}"
+        )
+        messages.warning(
+            request,
+            f'پرداخت انجام شد اما موجودی سفارش به پایان رسیده است و مبلغ به شما بازگردانده می‌شود. کد پیگیری: {attempt.ref_id}'
+        )
+        return redirect('checkout_complete', order_id=order.id)
+    elif attempt.status == 'verifying':
+        # Another callback for this payment is still asking the gateway
+        messages.info(request, 'پرداخت شما در حال بررسی است')
+        return redirect('order_detail', order_id=order.id)
+    elif attempt.status == 'paid':
         logger.info(
-            f"ZarinPal Callback Verification Started - Order ID: {order.id}, "
-            f"Authority: {authority}, Amount: {final_price}, User: {request.user.phone}"
+            f"ZarinPal Payment Completed Successfully - Order ID: {order.id}, "
+            f"Ref ID: {attempt.ref_id}, Authority: {authority}"
         )
-        
-        success, ref_id, message = verify_zarinpal_payment(authority, final_price)
-        
-        if success:
-            order.payment_status = True
-            order.status = 'paid'
-            # You can store ref_id in a field if needed
-            order.save()
-            logger.info(
-                f"ZarinPal Payment Completed Successfully - Order ID: {order.id}, "
-                f"Ref ID: {ref_id}, Authority: {authority}, User: {request.user.phone}"
-            )
-            messages.success(request, f'پرداخت با موفقیت انجام شد. کد پیگیری: {ref_id}')
-            return redirect('checkout_complete', order_id=order.id)
-        else:
-            logger.error(
-                f"ZarinPal Payment Verification Failed in Callback - Order ID: {order.id}, "
-                f"Authority: {authority}, Error Message: {message}, "
-                f"Amount: {final_price}, User: {request.user.phone}"
-            )
-            messages.error(request, f'خطا در تایید پرداخت: {message}')
-            return redirect('checkout')
+        messages.success(request, f'پرداخت با موفقیت انجام شد. کد پیگیری: {attempt.ref_id}')
+        return redirect('checkout_complete', order_id=order.id)
     else:
-        logger.warning(
-            f"ZarinPal Payment Cancelled or Invalid - Order ID: {order.id}, "
-            f"Status: {status}, Authority: {authority}, "
-            f"Session Authority: {session_authority}, User: {request.user.phone}"
+        logger.error(
+            f"ZarinPal Payment Verification Failed in Callback - Order ID: {order.id}, "
+            f"Authority: {authority}, Error Message: {message}, Amount: {attempt.amount}"
         )
-        messages.warning(request, 'پرداخت لغو شد')
+        messages.error(request, f'خطا در تایید پرداخت: {message}')
         return redirect('checkout')
 
 
@@ -288,8 +253,7 @@ def retry_payment(request, order_id):
     
     # Check if order is expired
     if order.is_pending_payment_expired():
-        order.status = 'cancelled'
-        order.save()
+        cancel_order(order)
         messages.error(request, 'زمان پرداخت این سفارش به پایان رسیده است')
         return redirect('dashboard-orders')
     
@@ -311,10 +275,7 @@ def retry_payment(request, order_id):
     )
     
     if payment_url:
-        # Store authority in session for use in callback
-        request.session['zarinpal_authority'] = authority
-        request.session['zarinpal_order_id'] = order.id
-        request.session.modified = True
+        PaymentAttempt.objects.create(order=order, authority=authority, amount=final_price)
         logger.info(
             f"Retry Payment - Redirecting to ZarinPal - Order ID: {order.id}, "
             f"User: {request.user.phone}, Authority: {authority}"
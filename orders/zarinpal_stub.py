@@ -0,0 +1,133 @@
+"""
+In-process stand-in for the Zarinpal v4 gateway, for tests and offline load tests.
+
+StubGateway().start() serves on a background thread:
+
+    POST /pg/v4/payment/request.json   a new authority (code 100)
+    GET  /pg/StartPay/<authority>      pays it and redirects to its callback with Status=OK
+                                       (?cancel=1 redirects with Status=NOK instead)
+    POST /pg/v4/payment/verify.json    100 the first time, 101 after that,
+                                       -51 while unpaid and -50 for a wrong amount
+
+`latency` delays every answer and `failure_rate` turns that share of API
+calls into HTTP 503s, to exercise timeouts, retries and the circuit breaker.
+"""
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode, urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so pooled clients can reuse their connections
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one segment instead of waiting on delayed ACKs
+    disable_nagle_algorithm = True
+    wbufsize = 64 * 1024
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        gateway = self.server.gateway
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if gateway.latency:
+            time.sleep(gateway.latency)
+        if gateway.failure_rate and random.random() < gateway.failure_rate:
+            return self.send_json(503, {'errors': {'message': 'Service unavailable'}})
+        if self.path == '/pg/v4/payment/request.json':
+            return self.send_json(200, gateway.request(payload))
+        if self.path == '/pg/v4/payment/verify.json':
+            return self.send_json(200, gateway.verify(payload))
+        self.send_json(404, {'errors': {'message': 'Not found'}})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if not url.path.startswith('/pg/StartPay/'):
+            return self.send_json(404, {'errors': {'message': 'Not found'}})
+        authority = url.path.rsplit('/', 1)[-1]
+        cancel = 'cancel' in parse_qs(url.query)
+        callback_url = self.server.gateway.pay(authority, cancel)
+        if callback_url is None:
+            return self.send_json(404, {'errors': {'message': 'Unknown authority'}})
+        status = 'NOK' if cancel else 'OK'
+        separator = '&' if '?' in callback_url else '?'
+        self.send_response(302)
+        self.send_header('Location', f"{callback_url}{separator}{urlencode({'Authority': authority, 'Status': status})}")
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class StubGateway:
+    """Zarinpal look-alike keeping its payments in memory"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, failure_rate=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.payments = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), StubHandler)
+        self.server.daemon_threads = True
+        self.server.gateway = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def request(self, payload):
+        authority = 'S' + uuid.uuid4().hex[:35].upper()
+        with self.lock:
+            self.payments[authority] = {
+                'amount': payload.get('amount'),
+                'callback_url': payload.get('callback_url'),
+                'paid': False,
+                'ref_id': None,
+            }
+        return {'data': {'code': 100, 'message': 'Success', 'authority': authority, 'fee': 0}, 'errors': []}
+
+    def pay(self, authority, cancel=False):
+        """Settle a payment as the customer would; returns its callback URL"""
+        with self.lock:
+            payment = self.payments.get(authority)
+            if payment is None:
+                return None
+            if not cancel:
+                payment['paid'] = True
+            return payment['callback_url']
+
+    def verify(self, payload):
+        with self.lock:
+            payment = self.payments.get(payload.get('authority'))
+            if payment is None or not payment['paid']:
+                return {'data': [], 'errors': {'code': -51, 'message': 'Session is not valid'}}
+            if payment['amount'] != payload.get('amount'):
+                return {'data': [], 'errors': {'code': -50, 'message': 'Amount mismatch'}}
+            if payment['ref_id'] is not None:
+                return {'data': {'code': 101, 'message': 'Verified', 'ref_id': payment['ref_id']}, 'errors': []}
+            payment['ref_id'] = random.randint(10 ** 9, 10 ** 10 - 1)
+            return {'data': {'code': 100, 'message': 'Paid', 'ref_id': payment['ref_id']}, 'errors': []}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
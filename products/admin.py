@@ -131,6 +131,7 @@ class ProductAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
     list_per_page = 25
     list_display_links = ['title']
+    list_select_related = ['category', 'cover_image']
     
     fieldsets = (
         ('اطلاعات اصلی', {
@@ -149,8 +150,8 @@ class ProductAdmin(admin.ModelAdmin):
     )
     
     def get_image_preview(self, obj):
-        if obj.images.first():
-            return format_html('<img src="{}" style="max-height: 50px; max-width: 50px;" />', obj.images.first().image.url)
+        if obj.cover_image:
+            return format_html('<img src="{}" style="max-height: 50px; max-width: 50px;" />', obj.cover_image.image.url)
         return "بدون تصویر"
     get_image_preview.short_description = "تصویر"
     
@@ -0,0 +1,378 @@
+"""
+In-memory columnar index of the filterable product attributes.
+
+Every worker can keep the listing attributes of the whole catalog in a
+few megabytes: numeric columns live in `array` buffers and categorical
+attributes (category, brand, color, flags) in Python-int bitmaps with one
+bit per row. Filtering is a handful of bitwise ANDs, sorting walks a
+precomputed argsort, and the database is only hit to hydrate the rows of
+the requested page.
+
+A published index is never modified. Each write bumps the 'catalog-index'
+cache version after commit and records the changed product id under the
+new generation; a worker behind the current generation re-reads just the
+products named by the deltas it missed into a copy of its index and swaps
+the module reference, so requests already holding the old index are
+unaffected. Only a missing delta (expired, or an invalidate()) costs a
+full rebuild.
+"""
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from core.cache_utils import get_version, bump_version
+from .models import Product
+
+GENERATION_KEY = 'catalog-index'
+
+# Published per-product changes are kept this long; a worker further
+# behind than MAX_DELTAS generations rebuilds instead of catching up
+DELTA_TIMEOUT = 60 * 60
+MAX_DELTAS = 500
+
+COLUMNS = (
+    'id', 'price', 'stock', 'reserved_stock', 'sales', 'views', 'created_at', 'category_id', 'brand_id', 'is_amazing',
+)
+
+# Selections under 1/SPARSE_RATIO of the catalog are sorted directly,
+# larger ones are read off the precomputed order
+SPARSE_RATIO = 64
+
+# Sort key columns for each listing sort, mirroring products.query.SORT_ORDERINGS
+SORT_COLUMNS = {
+    'created_at': ('created_at', True),
+    'price_asc': ('price', False),
+    'price_desc': ('price', True),
+    'sales': ('sales', True),
+    'views': ('views', True),
+}
+
+
+def bitmap_from_positions(positions, size):
+    """Build an int bitmap from row positions in O(n)"""
+    buffer = bytearray((size + 7) // 8)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def positions_in(bits):
+    """Row positions set in a little-endian bitmap byte string"""
+    for byte_index, byte in enumerate(bits):
+        if byte:
+            base = byte_index << 3
+            for bit in range(8):
+                if byte >> bit & 1:
+                    yield base + bit
+
+
+class CatalogIndex:
+    def __init__(self, generation=None):
+        self.generation = generation
+        self.ids = array('q')
+        self.price = array('q')
+        self.stock = array('q')
+        self.reserved_stock = array('q')
+        self.sales = array('q')
+        self.views = array('q')
+        self.created_at = array('d')
+        self.positions = {}
+        self.alive = 0
+        self.categories = defaultdict(int)
+        self.brands = defaultdict(int)
+        self.colors = defaultdict(int)
+        self.amazing = 0
+        self.available = 0
+        self.sold = 0
+        self._orders = {}
+
+    @classmethod
+    def build(cls, generation=None):
+        """Load the whole catalog with two queries"""
+        index = cls(generation)
+        colors = defaultdict(list)
+        for product_id, color_id in Product.colors.through.objects.values_list('product_id', 'color_id'):
+            colors[product_id].append(color_id)
+        for row in Product.objects.order_by('id').values_list(*COLUMNS):
+            index._append(row, colors.get(row[0], ()))
+        return index
+
+    def copy(self, generation):
+        """Unpublished copy to apply changes to; the bitmaps are ints, so the dicts copy shallowly"""
+        index = CatalogIndex(generation)
+        for column in ('ids', 'price', 'stock', 'reserved_stock', 'sales', 'views', 'created_at'):
+            setattr(index, column, getattr(self, column)[:])
+        index.positions = dict(self.positions)
+        index.alive = self.alive
+        index.categories = defaultdict(int, self.categories)
+        index.brands = defaultdict(int, self.brands)
+        index.colors = defaultdict(int, self.colors)
+        index.amazing = self.amazing
+        index.available = self.available
+        index.sold = self.sold
+        return index
+
+    def __len__(self):
+        return self.alive.bit_count()
+
+    def _append(self, row, color_ids):
+        product_id, price, stock, reserved_stock, sales, views, created_at, category_id, brand_id, is_amazing = row
+        position = len(self.ids)
+        self.positions[product_id] = position
+        self.ids.append(product_id)
+        self.price.append(price)
+        self.stock.append(stock)
+        self.reserved_stock.append(reserved_stock)
+        self.sales.append(sales)
+        self.views.append(views)
+        self.created_at.append(created_at.timestamp())
+        self._set_bits(position, category_id, brand_id, color_ids, is_amazing)
+
+    def _set_bits(self, position, category_id, brand_id, color_ids, is_amazing):
+        bit = 1 << position
+        # Units held for unpaid orders are not for sale, as in the stock__gt=F('reserved_stock') filter
+        if self.stock[position] > self.reserved_stock[position]:
+            self.available |= bit
+        if self.sales[position] > 0:
+            self.sold |= bit
+        self.alive |= bit
+        self.categories[category_id] |= bit
+        if brand_id is not None:
+            self.brands[brand_id] |= bit
+        for color_id in color_ids:
+            self.colors[color_id] |= bit
+        if is_amazing:
+            self.amazing |= bit
+
+    def _clear_bits(self, position):
+        clear = ~(1 << position)
+        self.alive &= clear
+        self.amazing &= clear
+        self.available &= clear
+        self.sold &= clear
+        for bitmaps in (self.categories, self.brands, self.colors):
+            for key in bitmaps:
+                bitmaps[key] &= clear
+
+    def upsert(self, row, color_ids):
+        """Insert or replace one product row; only for an index not yet published"""
+        product_id = row[0]
+        position = self.positions.get(product_id)
+        if position is None:
+            self._append(row, color_ids)
+        else:
+            self._clear_bits(position)
+            _, price, stock, reserved_stock, sales, views, created_at, category_id, brand_id, is_amazing = row
+            self.price[position] = price
+            self.stock[position] = stock
+            self.reserved_stock[position] = reserved_stock
+            self.sales[position] = sales
+            self.views[position] = views
+            self.created_at[position] = created_at.timestamp()
+            self._set_bits(position, category_id, brand_id, color_ids, is_amazing)
+        self._orders = {}
+
+    def remove(self, product_id):
+        position = self.positions.get(product_id)
+        if position is not None:
+            self._clear_bits(position)
+
+    def order(self, sort):
+        """Row positions sorted for a listing sort, ties broken by id"""
+        # Computed lazily by whichever request needs it first; a concurrent
+        # duplicate computes the same value, so the unlocked store is safe
+        orders = self._orders.get(sort)
+        if orders is None:
+            column, descending = SORT_COLUMNS[sort]
+            values = getattr(self, column)
+            ids = self.ids
+            if descending:
+                key = lambda position: (-values[position], ids[position])
+            else:
+                key = lambda position: (values[position], ids[position])
+            order = sorted(range(len(ids)), key=key)
+            rank = array('q', bytes(8 * len(order)))
+            for place, position in enumerate(order):
+                rank[position] = place
+            orders = self._orders[sort] = (order, rank)
+        return orders
+
+    def _price_mask(self, min_price, max_price):
+        order, _ = self.order('price_asc')
+        prices = self._orders.get('prices')
+        if prices is None:
+            prices = self._orders['prices'] = array('q', (self.price[position] for position in order))
+        start = bisect_left(prices, min_price) if min_price is not None else 0
+        stop = bisect_right(prices, max_price) if max_price is not None else len(prices)
+        return bitmap_from_positions(order[start:stop], len(self.ids))
+
+    def mask(self, spec, category_ids=None, brand_id=None):
+        """
+        Bitmap of rows matching a ProductFilter. Category and brand arrive
+        already resolved to ids (None means unfiltered). Text search is not
+        indexed here; callers must not pass a spec with search text.
+        """
+        mask = self.alive
+        if category_ids is not None:
+            category_mask = 0
+            for category_id in category_ids:
+                category_mask |= self.categories.get(category_id, 0)
+            mask &= category_mask
+        if brand_id is not None:
+            mask &= self.brands.get(brand_id, 0)
+        if spec.color is not None:
+            mask &= self.colors.get(spec.color, 0)
+        if spec.is_amazing:
+            mask &= self.amazing
+        if spec.only_available:
+            mask &= self.available
+        if spec.bestsellers:
+            mask &= self.sold
+        if spec.min_price is not None or spec.max_price is not None:
+            mask &= self._price_mask(spec.min_price, spec.max_price)
+        return mask
+
+    def _sorted_positions(self, mask, sort):
+        """
+        Matching positions in sort order. Dense masks walk the precomputed
+        order; sparse ones sort just their own rows by rank.
+        """
+        order, rank = self.order(sort)
+        bits = mask.to_bytes((len(self.ids) + 7) // 8 or 1, 'little')
+        if mask.bit_count() * SPARSE_RATIO < len(order):
+            return sorted(positions_in(bits), key=rank.__getitem__)
+        return (
+            position for position in order
+            if bits[position >> 3] >> (position & 7) & 1
+        )
+
+    def select(self, mask, sort, offset, limit):
+        """Ids of rows in the mask, in sort order, from offset"""
+        if limit <= 0:
+            return []
+        positions = islice(self._sorted_positions(mask, sort), offset, offset + limit)
+        return [self.ids[position] for position in positions]
+
+    def price_range(self, mask):
+        """Cheapest and most expensive matching prices"""
+        if not mask:
+            return {'min_price': None, 'max_price': None}
+        order, _ = self.order('price_asc')
+        bits = mask.to_bytes((len(self.ids) + 7) // 8, 'little')
+        if mask.bit_count() * SPARSE_RATIO < len(order):
+            prices = [self.price[position] for position in positions_in(bits)]
+            return {'min_price': min(prices), 'max_price': max(prices)}
+        # Dense masks find a match quickly from both ends of the price order
+        matches = lambda positions: (p for p in positions if bits[p >> 3] >> (p & 7) & 1)
+        return {
+            'min_price': self.price[next(matches(order))],
+            'max_price': self.price[next(matches(reversed(order)))],
+        }
+
+
+class IndexedResult:
+    """
+    Sequence view of a filtered, sorted index selection for Paginator.
+    Slicing hydrates just the sliced rows with one in_bulk query.
+    """
+
+    def __init__(self, index, mask, sort):
+        self.index = index
+        self.mask = mask
+        self.sort = sort
+
+    def __len__(self):
+        return self.mask.bit_count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start = item.start or 0
+        stop = len(self) if item.stop is None else item.stop
+        ids = self.index.select(self.mask, self.sort, start, stop - start)
+        if not ids:
+            return []
+        products = Product.objects.select_related('cover_image').in_bulk(ids)
+        return [products[pk] for pk in ids if pk in products]
+
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def is_enabled():
+    return getattr(settings, 'PRODUCT_CATALOG_INDEX', False)
+
+
+def _delta_key(generation):
+    return f'{GENERATION_KEY}:delta:{generation}'
+
+
+def _catch_up(index, generation):
+    """
+    Copy of index brought up to generation by re-reading the products the
+    missed deltas name, or None when a delta is gone and only a rebuild
+    will do.
+    """
+    if not 0 < generation - index.generation <= MAX_DELTAS:
+        return None
+    keys = [_delta_key(missed) for missed in range(index.generation + 1, generation + 1)]
+    deltas = cache.get_many(keys)
+    if len(deltas) != len(keys):
+        return None
+    product_ids = set().union(*deltas.values())
+    rows = {row[0]: row for row in Product.objects.filter(pk__in=product_ids).values_list(*COLUMNS)}
+    colors = defaultdict(list)
+    for product_id, color_id in Product.colors.through.objects.filter(
+        product_id__in=rows
+    ).values_list('product_id', 'color_id'):
+        colors[product_id].append(color_id)
+    updated = index.copy(generation)
+    for product_id in product_ids:
+        if product_id in rows:
+            updated.upsert(rows[product_id], colors[product_id])
+        else:
+            updated.remove(product_id)
+    return updated
+
+
+def get_catalog_index():
+    """The worker's index, caught up with or rebuilt after other workers' changes"""
+    global _index
+    generation = get_version(GENERATION_KEY)
+    index = _index
+    if index is None or index.generation != generation:
+        with _build_lock:
+            generation = get_version(GENERATION_KEY)
+            index = _index
+            if index is None or index.generation != generation:
+                updated = None if index is None else _catch_up(index, generation)
+                index = _index = CatalogIndex.build(generation) if updated is None else updated
+    return index
+
+
+def _refresh_products(product_ids):
+    generation = bump_version(GENERATION_KEY)
+    # A worker reading the new version before this lands just rebuilds
+    cache.set(_delta_key(generation), product_ids, DELTA_TIMEOUT)
+    if _index is not None:
+        get_catalog_index()
+
+
+def invalidate():
+    """Force every worker, this one included, to rebuild on next use"""
+    global _index
+    bump_version(GENERATION_KEY)
+    _index = None
+
+
+def schedule_refresh(*product_ids):
+    """Update the local index and publish one new generation for the products once the write commits"""
+    if is_enabled() and product_ids:
+        transaction.on_commit(lambda: _refresh_products(list(product_ids)))
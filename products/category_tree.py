@@ -0,0 +1,57 @@
+"""
+Per-worker cache of the category navigation tree.
+
+The tree is built once per CATEGORY_TREE_CACHE version with
+cache_tree_children(), so rendering the menus costs a single version
+lookup in the shared cache. A tree older than CACHE_MAX_STALENESS is
+rebuilt as well, since a per-process cache never sees other workers bump
+the version. The nodes are shared by every request the
+worker serves and must be treated as read-only; walk them with
+get_children(), which reads the cached children without queries.
+"""
+import threading
+import time
+
+from django.conf import settings
+from mptt.templatetags.mptt_tags import cache_tree_children
+
+from core.cache_utils import get_version
+from .models import Category
+from .query import CATEGORY_TREE_CACHE
+
+# Levels below the roots shown in the navigation
+MENU_DEPTH = 3
+
+_tree = None
+_tree_lock = threading.Lock()
+
+
+class CategoryTree:
+    """Root categories with their children cached, for one tree version"""
+
+    def __init__(self, version, roots):
+        self.version = version
+        self.roots = tuple(roots)
+        self.built_at = time.monotonic()
+
+    def is_current(self, version):
+        return self.version == version and time.monotonic() - self.built_at < settings.CACHE_MAX_STALENESS
+
+    @classmethod
+    def build(cls, version):
+        nodes = Category.objects.filter(level__lte=MENU_DEPTH).order_by('tree_id', 'lft')
+        roots = [root for root in cache_tree_children(nodes) if root.slug]
+        return cls(version, sorted(roots, key=lambda root: root.name))
+
+
+def get_category_tree():
+    """The worker's tree, rebuilt after any category change"""
+    global _tree
+    version = get_version(CATEGORY_TREE_CACHE)
+    tree = _tree
+    if tree is None or not tree.is_current(version):
+        with _tree_lock:
+            if _tree is None or not _tree.is_current(version):
+                _tree = CategoryTree.build(version)
+            tree = _tree
+    return tree
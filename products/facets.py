@@ -0,0 +1,88 @@
+"""
+Facet counts for the product listing sidebar.
+
+Each facet is counted with one grouped query over the current filter set
+minus that facet's own filter, so selecting a brand still shows how many
+products the other brands would give. Results are cached per filter
+signature under the 'catalog' cache version, which products.signals
+bumps whenever products or categories change.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Q
+
+from core.cache_utils import make_key
+from .models import Product
+
+CACHE_NAMESPACE = 'catalog'
+
+
+class FacetCounter:
+    """Count brand, color, category and availability facets for a ProductQuery"""
+
+    def __init__(self, query, categories):
+        self.query = query
+        self.categories = categories
+
+    def base_queryset(self, exclude):
+        return self.query.filter_queryset(Product.objects.order_by(), exclude=exclude)
+
+    def count_brands(self):
+        rows = (
+            self.base_queryset({'brand'})
+            .filter(brand__isnull=False)
+            .values('brand_id')
+            .annotate(count=Count('id'))
+        )
+        return {row['brand_id']: row['count'] for row in rows}
+
+    def count_colors(self):
+        through = Product.colors.through
+        rows = (
+            through.objects
+            .filter(product_id__in=self.base_queryset({'color'}).values('id'))
+            .values('color_id')
+            .annotate(count=Count('product_id'))
+            .order_by()
+        )
+        return {row['color_id']: row['count'] for row in rows}
+
+    def count_categories(self):
+        """Product counts of the displayed categories, including their subtrees"""
+        if not self.categories:
+            return {}
+        rows = (
+            self.base_queryset({'category'})
+            .values('category__tree_id', 'category__lft')
+            .annotate(count=Count('id'))
+        )
+        counts = dict.fromkeys((category.id for category in self.categories), 0)
+        for row in rows:
+            for category in self.categories:
+                if (category.tree_id == row['category__tree_id']
+                        and category.lft <= row['category__lft'] <= category.rght):
+                    counts[category.id] += row['count']
+                    break
+        return counts
+
+    def count_available(self):
+        return self.base_queryset({'only_available'}).aggregate(
+            available=Count('id', filter=Q(stock__gt=F('reserved_stock')))
+        )['available']
+
+    def compute(self):
+        return {
+            'brands': self.count_brands(),
+            'colors': self.count_colors(),
+            'categories': self.count_categories(),
+            'available': self.count_available(),
+        }
+
+    def get_counts(self):
+        """Facet counts for the query, served from cache when possible"""
+        key = make_key(CACHE_NAMESPACE, 'facets', self.query.spec.signature())
+        counts = cache.get(key)
+        if counts is None:
+            counts = self.compute()
+            cache.set(key, counts, settings.PRODUCT_FACET_CACHE_TIMEOUT)
+        return counts
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'تنظیم دوباره تصویر شاخص همه محصولات از اولین تصویر گالری'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='تعداد محصولات در هر دستور UPDATE',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+        updated = 0
+        for start in range(0, len(ids), batch_size):
+            updated += Product.refresh_cover_images(ids[start:start + batch_size])
+
+        missing = Product.objects.filter(cover_image__isnull=True).count()
+        self.stdout.write(self.style.SUCCESS(f'✓ تصویر شاخص {updated} محصول به‌روزرسانی شد'))
+        if missing:
+            self.stdout.write(self.style.WARNING(f'{missing} محصول تصویری ندارد'))
@@ -0,0 +1,109 @@
+import random
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from products.catalog_index import CatalogIndex
+from products.models import Product, Brand, Category, Color
+from products.query import ProductFilter, ProductQuery, SORT_ORDERINGS
+
+
+class Command(BaseCommand):
+    help = 'مقایسه زمان فیلتر و مرتب‌سازی محصولات با ایندکس حافظه و با پایگاه داده'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=50,
+            help='تعداد تکرار برای هر فیلتر',
+        )
+        parser.add_argument(
+            '--synthetic',
+            type=int,
+            default=0,
+            help='ساخت ایندکس با این تعداد محصول ساختگی (بدون پایگاه داده)',
+        )
+
+    def handle(self, *args, **options):
+        if options['synthetic']:
+            self.benchmark_synthetic(options['synthetic'], options['repeat'])
+            return
+
+        specs = self.sample_specs()
+        build = timeit.timeit(CatalogIndex.build, number=1)
+        self.stdout.write(f'products: {Product.objects.count()}, index build: {build * 1000:.1f} ms')
+
+        for label, spec in specs:
+            self.stdout.write(f'{label}:')
+            for enabled in (False, True):
+                with override_settings(PRODUCT_CATALOG_INDEX=enabled):
+                    elapsed = timeit.timeit(
+                        lambda: ProductQuery(spec).run(with_facets=False), number=options['repeat']
+                    )
+                name = 'index' if enabled else 'orm'
+                self.stdout.write(f'  {name}: {elapsed / options["repeat"] * 1000:.2f} ms per listing')
+
+    def sample_specs(self):
+        specs = [('all, newest', ProductFilter())]
+        brand = Brand.objects.filter(is_active=True).first()
+        if brand:
+            specs.append((f'brand {brand.slug}, cheapest', ProductFilter(brand=brand.slug, sort='price_asc')))
+        category = Category.objects.exclude(slug='').first()
+        if category:
+            specs.append((
+                f'category {category.slug}, available, most viewed',
+                ProductFilter(category=category.slug, only_available=True, sort='views'),
+            ))
+        color = Color.objects.first()
+        if color:
+            specs.append((f'color {color.pk}, price 0-50m', ProductFilter(color=color.pk, max_price=50_000_000)))
+        specs.append(('bestsellers', ProductFilter(bestsellers=True, sort='sales')))
+        return specs
+
+    def benchmark_synthetic(self, size, repeat):
+        """Time pure in-memory filtering on a generated catalog of the given size"""
+        rng = random.Random(1)
+        now = datetime.now(timezone.utc)
+        index = CatalogIndex()
+        for pk in range(1, size + 1):
+            index._append(
+                (
+                    pk,
+                    rng.randrange(100_000, 100_000_000),
+                    rng.randrange(0, 20),
+                    rng.randrange(0, 500),
+                    rng.randrange(0, 10_000),
+                    now - timedelta(minutes=rng.randrange(0, 500_000)),
+                    rng.randrange(1, 60),
+                    rng.randrange(1, 40),
+                    rng.random() < 0.1,
+                ),
+                rng.sample(range(1, 15), 3),
+            )
+        self.stdout.write(f'synthetic products: {size}')
+
+        for sort in SORT_ORDERINGS:
+            elapsed = timeit.timeit(lambda: index.order(sort), number=1)
+            self.stdout.write(f'  argsort {sort}: {elapsed * 1000:.1f} ms (once per change)')
+
+        cases = [
+            ('all, page 1', ProductFilter(), None, None),
+            ('brand, cheapest, page 1', ProductFilter(sort='price_asc'), None, 7),
+            ('category + color + available', ProductFilter(color=3, only_available=True, sort='views'), [5], None),
+            ('price range, page 50', ProductFilter(min_price=1_000_000, max_price=5_000_000), None, None),
+        ]
+        for label, spec, category_ids, brand_id in cases:
+            offset = 49 * 12 if 'page 50' in label else 0
+
+            def run():
+                mask = index.mask(spec, category_ids, brand_id)
+                index.select(mask, spec.sort, offset, 12)
+                return mask.bit_count()
+
+            elapsed = timeit.timeit(run, number=repeat)
+            self.stdout.write(self.style.SUCCESS(
+                f'  {label}: {run()} matches, {elapsed / repeat * 1000:.3f} ms per listing'
+            ))
@@ -0,0 +1,50 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from products.models import Product
+from products.search.normalization import index_text, stem
+
+SAMPLE_DOCUMENT = (
+    'گوشي موبايل سامسونگ مدل Galaxy A54 5G ظرفیت ۲۵۶ گیگابایت و رم ۸ گیگابایت، '
+    'دارای نمایشگر‌های باکیفیت و دوربین‌های حرفه‌ای با قابلیت فیلم‌برداری ٤K. '
+    'این محصول با گارانتی ۱۸ ماهه عرضه می‌شود و یکی از پرفروش‌ترین گوشی‌ها است.'
+)
+
+
+class Command(BaseCommand):
+    help = 'اندازه‌گیری هزینه نرمال‌سازی متن جستجو برای هر سند'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=2000,
+            help='تعداد تکرار برای هر سند',
+        )
+        parser.add_argument(
+            '--from-db',
+            action='store_true',
+            help='استفاده از توضیحات محصولات موجود به جای متن نمونه',
+        )
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        documents = [SAMPLE_DOCUMENT]
+        if options['from_db']:
+            documents = [
+                f'{title} {description}'
+                for title, description in Product.objects.values_list('title', 'description')[:200]
+            ] or documents
+
+        # Cold pass fills the stemmer cache, the timed pass measures steady state
+        stem.cache_clear()
+        cold = timeit.timeit(lambda: [index_text(doc) for doc in documents], number=1)
+        warm = timeit.timeit(lambda: [index_text(doc) for doc in documents], number=repeat)
+
+        characters = sum(len(doc) for doc in documents)
+        per_document = warm / (repeat * len(documents)) * 1e6
+        self.stdout.write(f'documents: {len(documents)}, average length: {characters // len(documents)} chars')
+        self.stdout.write(f'cold pass: {cold / len(documents) * 1e6:.1f} µs per document')
+        self.stdout.write(self.style.SUCCESS(f'warm: {per_document:.1f} µs per document'))
+        self.stdout.write(f'stemmer cache: {stem.cache_info()}')
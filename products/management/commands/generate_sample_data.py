@@ -8,7 +8,9 @@ from faker import Faker
 import random
 import io
 from urllib.parse import quote_plus
+from slugify import slugify as slugify_persian
 
+from core.slugs import allocate_slugs
 from products.models import Category, Product, ProductImage, ProductSpecification, Color, Brand
 from blog.models import Post, Category as BlogCategory
 from core.models import (
@@ -422,6 +424,9 @@ class Command(BaseCommand):
                 for child_cat in sub_cat['children']:
                     all_categories.append(child_cat)
         
+        # All product slugs in one query instead of an exists() loop per save
+        slugs = allocate_slugs(Product, [slugify_persian(title, allow_unicode=True) for title in product_titles])
+        
         for i, title in enumerate(product_titles):
             # Select random category
             category = random.choice(all_categories)
@@ -432,6 +437,7 @@ class Command(BaseCommand):
             # Create product
             product = Product.objects.create(
                 title=title,
+                slug=slugs[i],
                 english_title=f"{self.fake.word().title()} {i+1}",
                 description=' '.join(self.fake.paragraphs(nb=3)),
                 category=category,
@@ -538,21 +544,14 @@ class Command(BaseCommand):
             }
         )
         
-        from django.utils.text import slugify
+        # Unique slugs for the whole batch in one query
+        slugs = allocate_slugs(Post, [slugify(title) for title in post_titles])
         
         posts = []
         for i, title in enumerate(post_titles):
-            # Create unique slug
-            base_slug = slugify(title)
-            slug = base_slug
-            counter = 1
-            while Post.objects.filter(slug=slug).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            
             post = Post.objects.create(
                 title=title,
-                slug=slug,
+                slug=slugs[i],
                 content=random.choice(SAMPLE_TEXTS) * 10,
                 excerpt=random.choice(SAMPLE_TEXTS),
                 author=user,
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products.models import CoPurchase, CoPurchaseCheckpoint, CoPurchaseTotal
+from products.recommendations import mine_co_purchases
+
+
+class Command(BaseCommand):
+    help = 'به‌روزرسانی جدول خرید مشترک محصولات از سفارش‌های جدید'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='تعداد سفارش در هر تراکنش',
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='پاک کردن جدول و پردازش دوباره همه سفارش‌ها',
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            with transaction.atomic():
+                CoPurchase.objects.all().delete()
+                CoPurchaseTotal.objects.all().delete()
+                CoPurchaseCheckpoint.objects.all().delete()
+
+        total = 0
+        while True:
+            mined = mine_co_purchases(options['batch_size'])
+            if not mined:
+                break
+            total += mined
+            self.stdout.write(f'{total} سفارش پردازش شد')
+
+        checkpoint = CoPurchaseCheckpoint.objects.filter(pk=1).first()
+        last = checkpoint.last_order_id if checkpoint else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ {total} سفارش جدید، {CoPurchase.objects.count()} ردیف، آخرین سفارش: {last}'
+        ))
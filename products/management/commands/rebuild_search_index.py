@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from products.models import Product
+from products.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'بازسازی کامل ایندکس جستجوی محصولات'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='تعداد محصولات در هر دسته',
+        )
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        if not backend.is_available():
+            self.stdout.write(self.style.WARNING('ایندکس جستجو در این پایگاه داده در دسترس نیست'))
+            return
+
+        batch_size = options['batch_size']
+        backend.clear()
+        products = Product.objects.only('id', 'title', 'english_title', 'description').order_by('id')
+        batch = []
+        count = 0
+        for product in products.iterator(chunk_size=batch_size):
+            batch.append(product)
+            if len(batch) >= batch_size:
+                backend.index(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            backend.index(batch)
+            count += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'✓ {count} محصول ایندکس شد'))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, Q
+
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'بررسی و اصلاح شمارنده‌های نظرات و پیشنهادهای محصولات'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='تعداد محصولات در هر دستور UPDATE',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='فقط گزارش اختلاف، بدون اصلاح',
+        )
+
+    def handle(self, *args, **options):
+        drifted = list(
+            Product.objects.annotate(
+                actual_comments=Count('comments'),
+                actual_recommends=Count('comments', filter=Q(comments__recommendation=True)),
+            )
+            .exclude(comment_count=F('actual_comments'), recommend_count=F('actual_recommends'))
+            .values_list('id', flat=True)
+        )
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('✓ همه شمارنده‌ها درست هستند'))
+            return
+
+        self.stdout.write(self.style.WARNING(f'{len(drifted)} محصول شمارنده نادرست دارد'))
+        if options['dry_run']:
+            return
+
+        batch_size = options['batch_size']
+        for start in range(0, len(drifted), batch_size):
+            Product.refresh_comment_counts(drifted[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f'✓ شمارنده‌های {len(drifted)} محصول اصلاح شد'))
@@ -0,0 +1,58 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    """Create the vendor specific full-text side table and fill it"""
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS products_product_fts "
+                "USING fts5(title, english_title, description, tokenize='unicode61 remove_diacritics 2')"
+            )
+        except Exception:
+            # SQLite built without FTS5: search keeps using icontains
+            return
+        insert = (
+            "INSERT INTO products_product_fts (rowid, title, english_title, description) "
+            "SELECT id, title, english_title, description FROM products_product"
+        )
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE IF NOT EXISTS products_product_search ("
+            "product_id bigint PRIMARY KEY REFERENCES products_product (id) "
+            "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS products_product_search_document_gin "
+            "ON products_product_search USING GIN (document)"
+        )
+        insert = (
+            "INSERT INTO products_product_search (product_id, document) "
+            "SELECT id, setweight(to_tsvector('simple', title), 'A') || "
+            "setweight(to_tsvector('simple', english_title), 'B') || "
+            "setweight(to_tsvector('simple', description), 'C') FROM products_product"
+        )
+    else:
+        return
+    schema_editor.execute(insert)
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS products_product_fts")
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS products_product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_category_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,97 @@
+import re
+
+from django.db import migrations
+
+# A frozen copy of products.search.normalization as of this migration, so
+# later changes to the live pipeline cannot change what this step does.
+# Run rebuild_search_index to re-index with the current pipeline.
+_CHARACTER_MAP = {
+    'ي': 'ی',
+    'ى': 'ی',
+    'ئ': 'ی',
+    'ك': 'ک',
+    'ة': 'ه',
+    'ۀ': 'ه',
+    'أ': 'ا',
+    'إ': 'ا',
+    'آ': 'ا',
+    'ٱ': 'ا',
+    'ؤ': 'و',
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)},
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+    '،': ' ',
+    '؛': ' ',
+    '؟': ' ',
+    '«': ' ',
+    '»': ' ',
+}
+_REMOVED = [chr(code) for code in range(0x064B, 0x0660)] + ['ٰ', 'ـ', '‍', '‎', '‏']
+_TRANSLATION_TABLE = str.maketrans({**_CHARACTER_MAP, **{char: None for char in _REMOVED}})
+_TOKEN_RE = re.compile(r'\w+')
+_ZWNJ_SUFFIX_RE = re.compile('‌' + r'(?:هایی|های|ها|ترین|تر)(?!\w)')
+_SUFFIXES = ('ترین', 'تر', 'ات')
+_UNSTEMMED_WORDS = frozenset({
+    'کامپیوتر', 'فیلتر', 'دفتر', 'دختر', 'چتر', 'بستر', 'کبوتر', 'انگشتر',
+    'متر', 'لیتر', 'سانتیمتر', 'میلیمتر', 'کیلومتر', 'پارامتر', 'پوستر',
+    'اسکوتر', 'پرینتر', 'روتر', 'تستر', 'توستر', 'اینورتر', 'هلیکوپتر',
+    'کاراکتر', 'تیاتر', 'نجات', 'حیات', 'ثبات',
+})
+
+
+def _stem(token):
+    if token in _UNSTEMMED_WORDS:
+        return token
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+
+def _index_text(text):
+    text = _ZWNJ_SUFFIX_RE.sub('', (text or '').translate(_TRANSLATION_TABLE).lower())
+    return ' '.join(_stem(token) for token in _TOKEN_RE.findall(text.replace('‌', ' ')))
+
+
+def reindex_normalized(apps, schema_editor):
+    """Re-fill the search index with Persian-normalized text"""
+    connection = schema_editor.connection
+    Product = apps.get_model('products', 'Product')
+    rows = [
+        (pk, _index_text(title), _index_text(english_title), _index_text(description))
+        for pk, title, english_title, description in Product.objects.using(connection.alias)
+        .values_list('id', 'title', 'english_title', 'description').iterator()
+    ]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_product_fts'"
+            )
+            if cursor.fetchone() is None:
+                # SQLite without FTS5: migration 0009 created no index
+                return
+            cursor.execute("DELETE FROM products_product_fts")
+            cursor.executemany(
+                "INSERT INTO products_product_fts (rowid, title, english_title, description) "
+                "VALUES (%s, %s, %s, %s)",
+                rows
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute("TRUNCATE products_product_search")
+            cursor.executemany(
+                "INSERT INTO products_product_search (product_id, document) VALUES (%s, "
+                "setweight(to_tsvector('simple', %s), 'A') || "
+                "setweight(to_tsvector('simple', %s), 'B') || "
+                "setweight(to_tsvector('simple', %s), 'C'))",
+                rows
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(reindex_normalized, migrations.RunPython.noop),
+    ]
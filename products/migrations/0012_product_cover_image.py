@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_cover_images(apps, schema_editor):
+    """Point every product at its first gallery image"""
+    Product = apps.get_model('products', 'Product')
+    ProductImage = apps.get_model('products', 'ProductImage')
+    first_image = ProductImage.objects.filter(product=models.OuterRef('pk')).order_by('id').values('id')[:1]
+    Product.objects.update(cover_image=models.Subquery(first_image))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_category_interval_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='cover_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.productimage', verbose_name='تصویر شاخص'),
+        ),
+        migrations.RunPython(fill_cover_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_product_cover_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='brand',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='نسخه\u200cهای تصویر'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='نسخه\u200cهای تصویر'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='نسخه\u200cهای تصویر'),
+        ),
+    ]
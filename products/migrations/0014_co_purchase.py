@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoPurchaseCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_order_id', models.PositiveBigIntegerField(default=0, verbose_name='آخرین سفارش پردازش\u200cشده')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='آخرین بروزرسانی')),
+            ],
+            options={
+                'verbose_name': 'وضعیت استخراج خرید مشترک',
+                'verbose_name_plural': 'وضعیت استخراج خرید مشترک',
+            },
+        ),
+        migrations.CreateModel(
+            name='CoPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='تعداد خرید مشترک')),
+                ('score', models.FloatField(default=0, verbose_name='امتیاز')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='co_purchases', to='products.product', verbose_name='محصول')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='co_purchased_with', to='products.product', verbose_name='محصول مرتبط')),
+            ],
+            options={
+                'verbose_name': 'خرید مشترک',
+                'verbose_name_plural': 'خریدهای مشترک',
+                'indexes': [models.Index(fields=['product', '-score'], name='products_copurchase_top')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'related'), name='unique_co_purchase_pair')],
+            },
+        ),
+    ]
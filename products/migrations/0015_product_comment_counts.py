@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:51
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_comment_counts(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Comment = apps.get_model('products', 'Comment')
+    comments = Comment.objects.filter(Product=models.OuterRef('pk')).order_by().values('Product')
+    Product.objects.update(
+        comment_count=Coalesce(models.Subquery(comments.annotate(n=models.Count('id')).values('n')), 0),
+        recommend_count=Coalesce(models.Subquery(
+            comments.filter(recommendation=True).annotate(n=models.Count('id')).values('n')
+        ), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_co_purchase'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='تعداد نظرات'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='recommend_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='تعداد پیشنهادها'),
+        ),
+        migrations.RunPython(fill_comment_counts, migrations.RunPython.noop),
+    ]
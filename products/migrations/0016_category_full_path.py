@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:54
+
+from django.db import migrations, models
+
+
+def fill_category_paths(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    crumbs = {}
+    nodes = list(Category.objects.order_by('tree_id', 'lft'))
+    for node in nodes:
+        node.ancestors = crumbs.get(node.parent_id, [])
+        crumbs[node.pk] = [*node.ancestors, {'id': node.pk, 'slug': node.slug, 'name': node.name}]
+        node.full_path = '/'.join(crumb['slug'] for crumb in crumbs[node.pk] if crumb['slug'])
+    Category.objects.bulk_update(nodes, ['full_path', 'ancestors'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0015_product_comment_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='ancestors',
+            field=models.JSONField(blank=True, default=list, editable=False, verbose_name='دسته\u200cبندی\u200cهای والد'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='full_path',
+            field=models.CharField(blank=True, editable=False, max_length=1000, verbose_name='مسیر کامل'),
+        ),
+        migrations.RunPython(fill_category_paths, migrations.RunPython.noop),
+    ]
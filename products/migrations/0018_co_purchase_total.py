@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+
+
+def move_diagonal(apps, schema_editor):
+    CoPurchase = apps.get_model('products', 'CoPurchase')
+    CoPurchaseTotal = apps.get_model('products', 'CoPurchaseTotal')
+    diagonal = CoPurchase.objects.filter(related_id=F('product_id'))
+    CoPurchaseTotal.objects.bulk_create(
+        [CoPurchaseTotal(product_id=product_id, count=count) for product_id, count in diagonal.values_list('product_id', 'count')],
+        batch_size=500,
+    )
+    diagonal.delete()
+
+
+def restore_diagonal(apps, schema_editor):
+    CoPurchase = apps.get_model('products', 'CoPurchase')
+    CoPurchaseTotal = apps.get_model('products', 'CoPurchaseTotal')
+    CoPurchase.objects.bulk_create(
+        [CoPurchase(product_id=total.product_id, related_id=total.product_id, count=total.count) for total in CoPurchaseTotal.objects.all()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0017_product_reserved_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoPurchaseTotal',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='co_purchase_total', serialize=False, to='products.product', verbose_name='محصول')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='تعداد سفارش')),
+            ],
+            options={
+                'verbose_name': 'تعداد خرید محصول',
+                'verbose_name_plural': 'تعداد خرید محصولات',
+            },
+        ),
+        migrations.RunPython(move_diagonal, restore_diagonal),
+    ]
@@ -1,9 +1,11 @@
 from persiantools.jdatetime import JalaliDateTime
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.utils.text import slugify
 from mptt.models import MPTTModel, TreeForeignKey
 from mptt.fields import TreeForeignKey as MPTTTreeForeignKey
 from accounts.models import MyUser
+from core.slugs import save_with_unique_slug
 from slugify import slugify as slugify_persian
 
 
@@ -18,6 +20,7 @@ class Category(MPTTModel):
         verbose_name="تصویر",
         help_text="سایز بهینه: 200x200 پیکسل (مربع). فرمت پیشنهادی: PNG یا JPG"
     )
+    variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name="نسخه‌های تصویر")
     parent = TreeForeignKey(
         'self',
         on_delete=models.CASCADE,
@@ -26,6 +29,9 @@ class Category(MPTTModel):
         related_name='children',
         verbose_name="دسته‌بندی والد"
     )
+    # Materialized from the tree by refresh_paths() so URLs and breadcrumbs need no queries
+    full_path = models.CharField(max_length=1000, blank=True, editable=False, verbose_name="مسیر کامل")
+    ancestors = models.JSONField(default=list, blank=True, editable=False, verbose_name="دسته‌بندی‌های والد")
     
     class MPTTMeta:
         order_insertion_by = ['name']
@@ -33,27 +39,50 @@ class Category(MPTTModel):
     class Meta:
         verbose_name = "دسته‌بندی"
         verbose_name_plural = "دسته‌بندی‌ها"
+        indexes = [
+            # Subtree lookups join on the nested-set interval
+            models.Index(fields=['tree_id', 'lft'], name='products_category_interval'),
+        ]
     
     def get_full_slug(self):
-        """Generate full slug path from root to current category"""
-        slugs = []
-        current = self
-        while current:
-            if current.slug:
-                slugs.insert(0, current.slug)
-            current = current.parent
-        return '/'.join(slugs)
+        """Full slug path from root to current category"""
+        return self.full_path
+    
+    @property
+    def ancestor_ids(self):
+        return [ancestor['id'] for ancestor in self.ancestors]
+    
+    @property
+    def parent_crumb(self):
+        """Stored id, slug and name of the parent, without loading it"""
+        return self.ancestors[-1] if self.ancestors else None
+    
+    def get_breadcrumbs(self):
+        """Id, slug and name of every category from the root down to this one"""
+        return [*self.ancestors, {'id': self.pk, 'slug': self.slug, 'name': self.name}]
+    
+    def refresh_paths(self):
+        """
+        Recompute full_path and ancestors of this category and its subtree
+        from the parent's stored values; the subtree interval lists parents
+        before their children.
+        """
+        crumbs = {}
+        if self.parent_id:
+            crumbs[self.parent_id] = Category.objects.get(pk=self.parent_id).get_breadcrumbs()
+        nodes = list(self.get_descendants(include_self=True).order_by('lft'))
+        for node in nodes:
+            node.ancestors = crumbs.get(node.parent_id, [])
+            crumbs[node.pk] = node.get_breadcrumbs()
+            node.full_path = '/'.join(crumb['slug'] for crumb in crumbs[node.pk] if crumb['slug'])
+        Category.objects.bulk_update(nodes, ['full_path', 'ancestors'], batch_size=500)
+        self.full_path, self.ancestors = nodes[0].full_path, nodes[0].ancestors
     
     def save(self, *args, **kwargs):
         """Auto-generate slug if not provided"""
         if not self.slug:
             base_slug = slugify_persian(self.name, allow_unicode=True)
-            slug = base_slug
-            counter = 1
-            while Category.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
+            return save_with_unique_slug(self, base_slug, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
     
     def __str__(self):
@@ -69,6 +98,7 @@ class Brand(models.Model):
         verbose_name="لوگو",
         help_text="سایز بهینه: 200x200 پیکسل (مربع). فرمت پیشنهادی: PNG با پس‌زمینه شفاف"
     )
+    variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name="نسخه‌های تصویر")
     is_active = models.BooleanField(default=True, verbose_name="فعال است")
     order = models.PositiveIntegerField(default=0, verbose_name="ترتیب نمایش")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاریخ ایجاد")
@@ -85,12 +115,7 @@ class Brand(models.Model):
         """Auto-generate slug if not provided"""
         if not self.slug:
             base_slug = slugify_persian(self.name, allow_unicode=True)
-            slug = base_slug
-            counter = 1
-            while Brand.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
+            return save_with_unique_slug(self, base_slug, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
 
@@ -123,6 +148,8 @@ class Product(models.Model):
     )
     price = models.PositiveIntegerField(verbose_name="قیمت (تومان)")
     stock = models.PositiveIntegerField(default=0, verbose_name="موجودی انبار")
+    # Units held by unpaid online orders (orders.StockReservation), still counted in stock
+    reserved_stock = models.PositiveIntegerField(default=0, editable=False, verbose_name="موجودی رزرو شده")
     is_amazing = models.BooleanField(default=False, verbose_name="شگفت‌انگیز است")
     sales = models.IntegerField(verbose_name='فروش ها', default=0)
     views = models.IntegerField(verbose_name='بازدید ها', default=0)
@@ -131,6 +158,19 @@ class Product(models.Model):
     satisfaction_percent = models.PositiveSmallIntegerField(default=100, verbose_name="درصد رضایت")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاریخ ثبت")
     delivery_date = models.PositiveSmallIntegerField(default=0, verbose_name='ارسال طی ... روز کاری')
+    # Maintained from Comment signals; reconcile_comment_counts repairs drift
+    comment_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="تعداد نظرات")
+    recommend_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="تعداد پیشنهادها")
+    # First gallery image, kept in sync by products.signals so cards need no extra query
+    cover_image = models.ForeignKey(
+        'ProductImage',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='+',
+        verbose_name="تصویر شاخص"
+    )
 
     class Meta:
         verbose_name = "محصول"
@@ -147,13 +187,38 @@ class Product(models.Model):
         """Auto-generate slug if not provided"""
         if not self.slug:
             base_slug = slugify_persian(self.title, allow_unicode=True)
-            slug = base_slug
-            counter = 1
-            while Product.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
+            return save_with_unique_slug(self, base_slug, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
+
+    @classmethod
+    def refresh_cover_images(cls, product_ids=None):
+        """Point cover_image at each product's first image in one UPDATE"""
+        products = cls.objects.all() if product_ids is None else cls.objects.filter(pk__in=product_ids)
+        first_image = ProductImage.objects.filter(product=models.OuterRef('pk')).order_by('id').values('id')[:1]
+        return products.update(cover_image=models.Subquery(first_image))
+
+    @classmethod
+    def refresh_comment_counts(cls, product_ids=None):
+        """Recount comments and recommendations from the comment rows in one UPDATE"""
+        products = cls.objects.all() if product_ids is None else cls.objects.filter(pk__in=product_ids)
+        comments = Comment.objects.filter(Product=models.OuterRef('pk')).order_by().values('Product')
+        return products.update(
+            comment_count=Coalesce(models.Subquery(comments.annotate(n=models.Count('id')).values('n')), 0),
+            recommend_count=Coalesce(models.Subquery(
+                comments.filter(recommendation=True).annotate(n=models.Count('id')).values('n')
+            ), 0),
+        )
+
+    @property
+    def available_stock(self):
+        """Stock that is not reserved for unpaid orders"""
+        return max(0, self.stock - self.reserved_stock)
+
+    def get_recommend_percent(self):
+        """Share of reviewers recommending the product, or None without reviews"""
+        if not self.comment_count:
+            return None
+        return round(100 * self.recommend_count / self.comment_count)
     
     def __str__(self):
         return self.title
@@ -167,6 +232,7 @@ class ProductImage(models.Model):
         help_text="سایز بهینه: 800x800 پیکسل (مربع) یا 800x600 پیکسل (نسبت 4:3). فرمت پیشنهادی: JPG یا WebP"
     )
     alt = models.CharField(max_length=255, blank=True, verbose_name="متن جایگزین")
+    variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name="نسخه‌های تصویر")
 
     class Meta:
         verbose_name = "تصویر محصول"
@@ -209,3 +275,54 @@ class Comment(models.Model):
 
     def __str__(self):
         return f"نظر {self.author.phone} برای {self.Product.title}"
+
+
+class CoPurchase(models.Model):
+    """
+    Sparse product co-purchase matrix mined from order history, pruned to
+    each product's best-scoring neighbours. `count` is the number of
+    orders containing both products; the diagonal lives in CoPurchaseTotal.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='co_purchases', verbose_name="محصول")
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='co_purchased_with', verbose_name="محصول مرتبط")
+    count = models.PositiveIntegerField(default=0, verbose_name="تعداد خرید مشترک")
+    score = models.FloatField(default=0, verbose_name="امتیاز")
+
+    class Meta:
+        verbose_name = "خرید مشترک"
+        verbose_name_plural = "خریدهای مشترک"
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'related'], name='unique_co_purchase_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-score'], name='products_copurchase_top'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} ↔ {self.related_id}: {self.count}"
+
+
+class CoPurchaseTotal(models.Model):
+    """Diagonal of the co-purchase matrix: mined orders containing each product"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='co_purchase_total', verbose_name="محصول")
+    count = models.PositiveIntegerField(default=0, verbose_name="تعداد سفارش")
+
+    class Meta:
+        verbose_name = "تعداد خرید محصول"
+        verbose_name_plural = "تعداد خرید محصولات"
+
+    def __str__(self):
+        return f"{self.product_id}: {self.count}"
+
+
+class CoPurchaseCheckpoint(models.Model):
+    """Last order folded into CoPurchase; mining resumes after it"""
+    last_order_id = models.PositiveBigIntegerField(default=0, verbose_name="آخرین سفارش پردازش‌شده")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="آخرین بروزرسانی")
+
+    class Meta:
+        verbose_name = "وضعیت استخراج خرید مشترک"
+        verbose_name_plural = "وضعیت استخراج خرید مشترک"
+
+    def __str__(self):
+        return f"سفارش {self.last_order_id}"
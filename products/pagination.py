@@ -0,0 +1,122 @@
+"""
+Keyset (cursor) pagination for product listings.
+
+Instead of COUNT(*) plus a growing OFFSET, each page is fetched with a
+WHERE clause on the sort key of the last row seen, so page 800 costs the
+same as page 1. Cursors are signed, opaque tokens.
+"""
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'products.pagination.cursor'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _split(field):
+    """('-price') -> ('price', True)"""
+    return (field[1:], True) if field.startswith('-') else (field, False)
+
+
+class KeysetPage:
+    """Page of a keyset paginator, mirroring the parts of Page templates use"""
+    is_keyset = True
+
+    def __init__(self, object_list, next_cursor, previous_cursor, approximate_count):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.approximate_count = approximate_count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset ordered by `ordering`, whose last field must be
+    unique (the primary key) so every row has a distinct position.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = [_split(field) for field in ordering]
+        self.per_page = per_page
+        self.model = queryset.model
+
+    def encode(self, obj, direction):
+        values = [
+            self.model._meta.get_field(name).value_to_string(obj) for name, _ in self.ordering
+        ]
+        return signing.dumps([direction, values], salt=CURSOR_SALT, compress=True)
+
+    def decode(self, cursor):
+        try:
+            direction, values = signing.loads(cursor, salt=CURSOR_SALT)
+            if direction not in ('next', 'prev') or len(values) != len(self.ordering):
+                raise InvalidCursor(cursor)
+            values = [
+                self.model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(self.ordering, values)
+            ]
+        except (signing.BadSignature, ValueError, TypeError) as exc:
+            raise InvalidCursor(cursor) from exc
+        return direction, values
+
+    def seek(self, values, forward):
+        """Rows strictly after (forward) or before the given sort key"""
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(self.ordering, values):
+            # Ascending keys move forward with gt, descending ones with lt
+            lookup = 'lt' if descending == forward else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def order(self, forward):
+        return [
+            f'-{name}' if descending == forward else name
+            for name, descending in self.ordering
+        ]
+
+    def get_page(self, cursor=None, approximate_count=None):
+        """Return the page addressed by cursor; bad cursors restart at the top"""
+        direction, values = 'next', None
+        if cursor:
+            try:
+                direction, values = self.decode(cursor)
+            except InvalidCursor:
+                direction, values = 'next', None
+
+        forward = direction == 'next'
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self.seek(values, forward))
+        rows = list(queryset.order_by(*self.order(forward))[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if (forward and has_more) or (not forward and values is not None):
+                next_cursor = self.encode(rows[-1], 'next')
+            if (forward and values is not None) or (not forward and has_more):
+                previous_cursor = self.encode(rows[0], 'prev')
+        return KeysetPage(rows, next_cursor, previous_cursor, approximate_count)
@@ -0,0 +1,395 @@
+"""
+Catalog query engine shared by the shop, search and bestseller listings
+"""
+from dataclasses import dataclass, asdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import F, Q, Min, Max, Count
+from django.db.models.expressions import RawSQL
+
+from .models import Product, Color, Category, Brand
+from .search import safe_match_sql, safe_search
+from .facets import FacetCounter, CACHE_NAMESPACE
+from .pagination import KeysetPaginator
+from . import catalog_index
+from core.cache_utils import make_key
+
+
+PAGE_SIZE = 12
+
+# Every ordering ends with the primary key so pages are stable
+SORT_ORDERINGS = {
+    'created_at': ('-created_at', 'id'),
+    'price_asc': ('price', 'id'),
+    'price_desc': ('-price', 'id'),
+    'sales': ('-sales', 'id'),
+    'views': ('-views', 'id'),
+}
+DEFAULT_SORT = 'created_at'
+# Only meaningful for searches answered by the full-text index
+RELEVANCE_SORT = 'relevance'
+# Cache version of anything derived from the category tree shape
+CATEGORY_TREE_CACHE = 'category-tree'
+
+
+def _parse_int(value):
+    """Parse a GET value as a non-negative integer, ignoring bad input"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value >= 0 else None
+
+
+def get_subtree_ids(category):
+    """Ids of a category and all its descendants, cached until the tree changes or CACHE_MAX_STALENESS passes"""
+    key = make_key(CATEGORY_TREE_CACHE, 'subtree', category.pk)
+    ids = cache.get(key)
+    if ids is None:
+        ids = list(
+            Category.objects.filter(
+                tree_id=category.tree_id, lft__gte=category.lft, rght__lte=category.rght,
+            ).values_list('id', flat=True)
+        )
+        cache.set(key, ids, settings.CACHE_MAX_STALENESS)
+    return ids
+
+
+@dataclass(frozen=True)
+class ProductFilter:
+    """Normalized filter spec parsed from the listing GET parameters"""
+    category: str = ''
+    brand: str = ''
+    color: int | None = None
+    min_price: int | None = None
+    max_price: int | None = None
+    is_amazing: bool = False
+    only_available: bool = False
+    search: str = ''
+    sort: str = DEFAULT_SORT
+    bestsellers: bool = False
+    require_search: bool = False
+
+    @classmethod
+    def from_params(cls, params, search_param='search', bestsellers=False, require_search=False):
+        """Build a filter spec from a QueryDict"""
+        search = params.get(search_param, '').strip()
+        sort = params.get('sort', '')
+        if bestsellers:
+            # The bestseller listing is always ordered by sales
+            sort = 'sales'
+        elif search and sort in ('', RELEVANCE_SORT):
+            sort = RELEVANCE_SORT
+        elif sort not in SORT_ORDERINGS:
+            sort = DEFAULT_SORT
+
+        return cls(
+            category=params.get('category', '').strip(),
+            brand=params.get('brand', '').strip(),
+            color=_parse_int(params.get('color')),
+            min_price=_parse_int(params.get('min_price')),
+            max_price=_parse_int(params.get('max_price')),
+            is_amazing=params.get('is_amazing') == 'true',
+            only_available=params.get('only_available') == 'true',
+            search=search,
+            sort=sort,
+            bestsellers=bestsellers,
+            require_search=require_search,
+        )
+
+    def signature(self):
+        """Stable key for the filter set, independent of ordering"""
+        values = asdict(self)
+        values.pop('sort')
+        return values
+
+
+class RankedResult:
+    """
+    Sequence view of full-text matches in rank order for Paginator.
+    Slicing hydrates just the sliced rows with one in_bulk query.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        ids = self.ids[item]
+        if not ids:
+            return []
+        products = Product.objects.select_related('cover_image').in_bulk(ids)
+        return [products[pk] for pk in ids if pk in products]
+
+
+@dataclass
+class ProductQueryResult:
+    """Everything a listing template needs, fully evaluated"""
+    page: object
+    price_range: dict
+    total: int
+    selected_category: Category | None
+    filter_categories: list
+    colors: list
+    brands: list
+    available_count: int | None = None
+
+
+class ProductQuery:
+    """
+    Build and run the product listing query for a filter spec.
+
+    A full run costs at most QUERY_BUDGET queries: the selected category,
+    one aggregate for price range and total count, the page itself and one
+    query each for the category, color and brand facets. A text search
+    filters through a subquery on the full-text index; relevance sorting
+    adds one ranked lookup on top, and facet counts add up to
+    FACET_QUERY_BUDGET more when they are not cached yet. With
+    PRODUCT_CATALOG_INDEX enabled, listings without text search are
+    filtered and sorted in memory and only the page rows are fetched.
+    Relevance-sorted searches read the matching ids and prices in one query
+    and put them in the index's rank order in Python.
+    """
+    QUERY_BUDGET = 6
+    FACET_QUERY_BUDGET = 4
+
+    def __init__(self, spec, page_size=PAGE_SIZE):
+        self.spec = spec
+        self.page_size = page_size
+        self._selected_category = None
+        self._category_loaded = False
+        self._ranked_ids = None
+        self._search_loaded = False
+        self._match_sql = None
+        self._match_loaded = False
+
+    @classmethod
+    def from_request(cls, request, **options):
+        return cls(ProductFilter.from_params(request.GET, **options))
+
+    def get_selected_category(self):
+        """Return the category chosen in the filter (cached per query)"""
+        if not self._category_loaded:
+            self._category_loaded = True
+            if self.spec.category:
+                self._selected_category = Category.objects.filter(slug=self.spec.category).first()
+        return self._selected_category
+
+    def filter_queryset(self, queryset, exclude=()):
+        """
+        Apply every filter of the spec except ordering.
+
+        exclude names filter dimensions to skip ('category', 'brand',
+        'color', 'only_available'), which facet counts need.
+        """
+        spec = self.spec
+
+        if spec.require_search and not spec.search:
+            return queryset.none()
+
+        if spec.bestsellers:
+            queryset = queryset.filter(sales__gt=0)
+
+        if spec.category and 'category' not in exclude:
+            category = self.get_selected_category()
+            if category is None:
+                return queryset.none()
+            # The whole subtree, as one range join on the MPTT interval
+            queryset = queryset.filter(
+                category__tree_id=category.tree_id,
+                category__lft__gte=category.lft,
+                category__rght__lte=category.rght,
+            )
+
+        if spec.brand and 'brand' not in exclude:
+            queryset = queryset.filter(brand__slug=spec.brand)
+        if spec.color is not None and 'color' not in exclude:
+            queryset = queryset.filter(colors__id=spec.color)
+        if spec.min_price is not None:
+            queryset = queryset.filter(price__gte=spec.min_price)
+        if spec.max_price is not None:
+            queryset = queryset.filter(price__lte=spec.max_price)
+        if spec.is_amazing:
+            queryset = queryset.filter(is_amazing=True)
+        if spec.only_available and 'only_available' not in exclude:
+            queryset = queryset.filter(stock__gt=F('reserved_stock'))
+
+        if spec.search:
+            queryset = self.filter_search(queryset)
+        return queryset
+
+    def get_ranked_ids(self):
+        """Ids matching the search in rank order, or None without a full-text index (cached per query)"""
+        if not self._search_loaded:
+            self._search_loaded = True
+            self._ranked_ids = safe_search(self.spec.search)
+        return self._ranked_ids
+
+    def get_match_sql(self):
+        """Subquery selecting every match, or None without a full-text index (cached per query)"""
+        if not self._match_loaded:
+            self._match_loaded = True
+            self._match_sql = safe_match_sql(self.spec.search)
+        return self._match_sql
+
+    def filter_search(self, queryset):
+        """Restrict to full-text matches, or icontains when no index is available"""
+        match_sql = self.get_match_sql()
+        if match_sql is None:
+            return queryset.filter(
+                Q(title__icontains=self.spec.search) |
+                Q(description__icontains=self.spec.search) |
+                Q(english_title__icontains=self.spec.search)
+            )
+        # Not the ranked ids: those stop at PRODUCT_SEARCH_MAX_RESULTS
+        return queryset.filter(id__in=RawSQL(*match_sql))
+
+    def get_ordering(self):
+        if self.spec.sort == RELEVANCE_SORT:
+            # Only reached by the icontains fallback; ranked matches go through run_ranked()
+            return SORT_ORDERINGS[DEFAULT_SORT]
+        return SORT_ORDERINGS[self.spec.sort]
+
+    def use_ranking(self):
+        return self.spec.sort == RELEVANCE_SORT and bool(self.spec.search) and self.get_ranked_ids() is not None
+
+    def run_ranked(self, page_number):
+        """
+        Keep the index's rank order for the matches that pass the other filters.
+
+        Only the top PRODUCT_SEARCH_MAX_RESULTS matches are ranked; the rest
+        follow in the default order, so the count and price range still
+        cover every match.
+        """
+        prices = dict(
+            self.filter_queryset(Product.objects.all())
+            .order_by(*SORT_ORDERINGS[DEFAULT_SORT]).values_list('id', 'price')
+        )
+        ranked = [pk for pk in self.get_ranked_ids() if pk in prices]
+        ranked_set = set(ranked)
+        ids = ranked + [pk for pk in prices if pk not in ranked_set]
+        price_range = {'min_price': min(prices.values(), default=None), 'max_price': max(prices.values(), default=None)}
+        page = self.paginate(RankedResult(ids), len(ids), page_number)
+        return page, price_range, len(ids)
+
+    def get_queryset(self):
+        """Filtered and ordered product queryset"""
+        queryset = self.filter_queryset(Product.objects.select_related('cover_image'))
+        return queryset.order_by(*self.get_ordering())
+
+    def get_summary(self, queryset):
+        """Price range and total count in a single aggregate"""
+        summary = queryset.order_by().aggregate(
+            min_price=Min('price'),
+            max_price=Max('price'),
+            total=Count('id'),
+        )
+        price_range = {'min_price': summary['min_price'], 'max_price': summary['max_price']}
+        return price_range, summary['total']
+
+    def get_cached_summary(self, queryset):
+        """Summary shared by every page of a filter set; its count is approximate"""
+        key = make_key(CACHE_NAMESPACE, 'summary', self.spec.signature())
+        summary = cache.get(key)
+        if summary is None:
+            summary = self.get_summary(queryset)
+            cache.set(key, summary, settings.PRODUCT_FACET_CACHE_TIMEOUT)
+        return summary
+
+    def use_keyset(self, cursor):
+        """Keyset pagination is opt-in per request (cursor) or site-wide, never for relevance"""
+        if self.spec.sort == RELEVANCE_SORT:
+            return False
+        return bool(cursor) or settings.PRODUCT_LISTING_PAGINATION == 'keyset'
+
+    def paginate(self, queryset, total, page_number):
+        paginator = Paginator(queryset, self.page_size)
+        # Reuse the aggregate's count instead of a second COUNT(*)
+        paginator.count = total
+        page = paginator.get_page(page_number)
+        if not total:
+            # Nothing to fetch; keep the page from running its own query
+            page.object_list = []
+        return page
+
+    def use_index(self, cursor):
+        """The in-memory index answers offset pages of listings without text search"""
+        return (
+            catalog_index.is_enabled()
+            and not self.spec.search
+            and not self.spec.require_search
+            and not self.use_keyset(cursor)
+        )
+
+    def get_category_ids(self):
+        """Category ids the listing is restricted to, or None for all categories"""
+        if not self.spec.category:
+            return None
+        category = self.get_selected_category()
+        return [] if category is None else get_subtree_ids(category)
+
+    def run_indexed(self, page_number):
+        """Filter, count and sort in memory; only the page rows hit the database"""
+        brand_id = None
+        if self.spec.brand:
+            # An unknown slug must match nothing, not everything
+            brand_id = Brand.objects.filter(slug=self.spec.brand).values_list('id', flat=True).first() or 0
+        index = catalog_index.get_catalog_index()
+        mask = index.mask(self.spec, self.get_category_ids(), brand_id)
+        total = mask.bit_count()
+        price_range = index.price_range(mask)
+        page = self.paginate(catalog_index.IndexedResult(index, mask, self.spec.sort), total, page_number)
+        return page, price_range, total
+
+    def get_filter_categories(self):
+        """Children of the selected category, or the roots when nothing is selected"""
+        category = self.get_selected_category()
+        if category is not None:
+            return list(category.get_children().order_by('name'))
+        return list(Category.objects.filter(parent__isnull=True).exclude(slug='').order_by('name'))
+
+    def run(self, page_number=None, with_facets=True, cursor=None):
+        if self.use_index(cursor):
+            page, price_range, total = self.run_indexed(page_number)
+        elif self.use_ranking():
+            page, price_range, total = self.run_ranked(page_number)
+        elif self.use_keyset(cursor):
+            queryset = self.get_queryset()
+            price_range, total = self.get_cached_summary(queryset)
+            paginator = KeysetPaginator(queryset, self.get_ordering(), self.page_size)
+            page = paginator.get_page(cursor, approximate_count=total)
+        else:
+            queryset = self.get_queryset()
+            price_range, total = self.get_summary(queryset)
+            page = self.paginate(queryset, total, page_number)
+            if total:
+                page.object_list = list(page.object_list)
+
+        filter_categories = self.get_filter_categories()
+        colors = list(Color.objects.order_by('name'))
+        brands = list(Brand.objects.filter(is_active=True).order_by('order', 'name'))
+
+        available_count = None
+        if with_facets:
+            counts = FacetCounter(self, filter_categories).get_counts()
+            for objects, facet in ((filter_categories, 'categories'), (colors, 'colors'), (brands, 'brands')):
+                for obj in objects:
+                    obj.product_count = counts[facet].get(obj.id, 0)
+            available_count = counts['available']
+
+        return ProductQueryResult(
+            page=page,
+            price_range=price_range,
+            total=total,
+            selected_category=self.get_selected_category(),
+            filter_categories=filter_categories,
+            colors=colors,
+            brands=brands,
+            available_count=available_count,
+        )
@@ -0,0 +1,159 @@
+"""
+Co-purchase recommendations.
+
+mine_co_purchases() maintains the co-occurrence matrix C = BᵀB, where B
+is the order × product basket matrix: C[a, b] counts orders containing
+both a and b, and C[a, a] the orders containing a. Only the orders placed
+since the last checkpoint are folded in, touching the rows of products in
+those orders, which are rescored by cosine similarity
+C[a, b] / sqrt(C[a, a] · C[b, b]).
+
+The diagonal is kept in CoPurchaseTotal. CoPurchase keeps only the
+CO_PURCHASE_TOP_K best-scoring neighbours of each rescored product rather
+than the whole matrix; a pair dropped there and bought again later starts
+counting afresh, so the counts of weak pairs are lower bounds.
+
+Orders younger than CO_PURCHASE_ORDER_LAG_HOURS are left for a later run
+so that unpaid orders have expired by the time they are mined.
+"""
+import math
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import combinations
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Product, CoPurchase, CoPurchaseCheckpoint, CoPurchaseTotal
+
+
+def accumulate(baskets):
+    """Sparse BᵀB of a batch of baskets as {(a, b): count}, both triangles and the diagonal"""
+    counts = Counter()
+    for basket in baskets:
+        for product_id in basket:
+            counts[(product_id, product_id)] += 1
+        # Huge baskets (bulk buys) say little about affinity and cost O(n²)
+        if len(basket) > settings.CO_PURCHASE_MAX_BASKET_SIZE:
+            continue
+        for a, b in combinations(sorted(basket), 2):
+            counts[(a, b)] += 1
+            counts[(b, a)] += 1
+    return counts
+
+
+def merge_counts(counts):
+    """Add a batch's counts into CoPurchaseTotal and CoPurchase; returns the touched product ids"""
+    totals = {a: count for (a, b), count in counts.items() if a == b}
+    touched = set(totals)
+    existing_totals = CoPurchaseTotal.objects.in_bulk(touched)
+    changed_totals, created_totals = [], []
+    for product_id, count in totals.items():
+        total = existing_totals.get(product_id)
+        if total is None:
+            created_totals.append(CoPurchaseTotal(product_id=product_id, count=count))
+        else:
+            total.count += count
+            changed_totals.append(total)
+    CoPurchaseTotal.objects.bulk_update(changed_totals, ['count'], batch_size=500)
+    CoPurchaseTotal.objects.bulk_create(created_totals, batch_size=500)
+
+    existing = {
+        (row.product_id, row.related_id): row
+        for row in CoPurchase.objects.filter(product_id__in=touched, related_id__in=touched)
+    }
+    changed, created = [], []
+    for (a, b), count in counts.items():
+        if a == b:
+            continue
+        row = existing.get((a, b))
+        if row is None:
+            created.append(CoPurchase(product_id=a, related_id=b, count=count))
+        else:
+            row.count += count
+            changed.append(row)
+    CoPurchase.objects.bulk_update(changed, ['count'], batch_size=500)
+    CoPurchase.objects.bulk_create(created, batch_size=500)
+    return touched
+
+
+def rescore(product_ids):
+    """
+    Recompute cosine scores of every pair involving the given products,
+    then drop all but the top CO_PURCHASE_TOP_K neighbours of each of them.
+    """
+    rows = list(CoPurchase.objects.filter(Q(product_id__in=product_ids) | Q(related_id__in=product_ids)))
+    involved = {row.product_id for row in rows} | {row.related_id for row in rows}
+    totals = dict(CoPurchaseTotal.objects.filter(product_id__in=involved).values_list('product_id', 'count'))
+    neighbours = defaultdict(list)
+    for row in rows:
+        row.score = row.count / math.sqrt(totals[row.product_id] * totals[row.related_id])
+        if row.product_id in product_ids:
+            neighbours[row.product_id].append(row)
+
+    dropped = set()
+    for candidates in neighbours.values():
+        candidates.sort(key=lambda row: (-row.score, row.related_id))
+        dropped.update(row.pk for row in candidates[settings.CO_PURCHASE_TOP_K:])
+    CoPurchase.objects.bulk_update([row for row in rows if row.pk not in dropped], ['score'], batch_size=500)
+    dropped = list(dropped)
+    for start in range(0, len(dropped), 500):
+        CoPurchase.objects.filter(pk__in=dropped[start:start + 500]).delete()
+
+
+def mine_co_purchases(batch_size=1000):
+    """
+    Fold one batch of new orders into the matrix. Returns the number of
+    orders consumed; call repeatedly until it returns 0.
+    """
+    from orders.models import Order, OrderItem
+
+    until = timezone.now() - timedelta(hours=settings.CO_PURCHASE_ORDER_LAG_HOURS)
+    with transaction.atomic():
+        checkpoint, _ = CoPurchaseCheckpoint.objects.select_for_update().get_or_create(pk=1)
+        orders = list(
+            Order.objects.filter(id__gt=checkpoint.last_order_id, created_at__lte=until)
+            .order_by('id')
+            .values_list('id', 'status')[:batch_size]
+        )
+        if not orders:
+            return 0
+
+        mined = [order_id for order_id, status in orders if status != 'cancelled']
+        baskets = {}
+        items = OrderItem.objects.filter(order_id__in=mined, product__isnull=False).values_list('order_id', 'product_id')
+        for order_id, product_id in items:
+            baskets.setdefault(order_id, set()).add(product_id)
+
+        counts = accumulate(baskets.values())
+        if counts:
+            rescore(merge_counts(counts))
+
+        checkpoint.last_order_id = orders[-1][0]
+        checkpoint.save()
+    return len(orders)
+
+
+def get_related_products(product, limit=4):
+    """
+    Top co-purchased products in one indexed query, topped up with
+    products of the same category when the history is thin.
+    """
+    related = list(
+        Product.objects.filter(
+            co_purchased_with__product=product,
+            co_purchased_with__count__gte=settings.CO_PURCHASE_MIN_COUNT,
+        )
+        .exclude(pk=product.pk)
+        .select_related('cover_image')
+        .order_by('-co_purchased_with__score', 'id')[:limit]
+    )
+    if len(related) < limit:
+        related += list(
+            Product.objects.filter(category_id=product.category_id)
+            .exclude(pk__in=[product.pk, *(p.pk for p in related)])
+            .select_related('cover_image')[:limit - len(related)]
+        )
+    return related
@@ -0,0 +1,7 @@
+"""
+Full-text search over the product catalog
+"""
+from .backends import get_search_backend, safe_match_sql, safe_search, SearchBackend
+from .normalization import normalize, tokenize
+
+__all__ = ['get_search_backend', 'safe_match_sql', 'safe_search', 'SearchBackend', 'normalize', 'tokenize']
@@ -0,0 +1,238 @@
+"""
+Pluggable full-text index backends for products.
+
+SQLite keeps an FTS5 virtual table and PostgreSQL a tsvector table with a
+GIN index. Both are side tables keyed by product id, created by migration
+0009 and kept in sync by the signals in products.signals.
+"""
+import logging
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection, DatabaseError
+from django.utils.module_loading import import_string
+
+from .normalization import tokenize, index_text
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'products_product_fts'
+TSVECTOR_TABLE = 'products_product_search'
+
+# Default cap on ranked ids returned by one search; only relevance
+# ordering needs them, filters and counts use match_sql() instead
+MAX_RESULTS = 500
+
+# Seconds before a backend that found no index looks for it again
+AVAILABILITY_RECHECK = 60
+
+
+def product_document(product):
+    """Normalized indexed fields of a product, in weight order"""
+    return (index_text(product.title), index_text(product.english_title), index_text(product.description))
+
+
+class SearchBackend:
+    """
+    Base backend that keeps no index.
+
+    search() and match_sql() return None to tell callers to fall back to
+    the plain icontains filter.
+    """
+    def is_available(self):
+        return False
+
+    def index(self, products):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def search(self, text, limit=MAX_RESULTS):
+        return None
+
+    def match_sql(self, text):
+        """SQL and params selecting the ids of every match, for an id__in subquery"""
+        return None
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """FTS5 virtual table ranked with bm25"""
+    # bm25 column weights for title, english_title and description
+    WEIGHTS = (10.0, 5.0, 1.0)
+
+    def __init__(self):
+        self._available = False
+        self._checked_at = None
+
+    def is_available(self):
+        # Once found, the table stays; a missing one is looked for again every AVAILABILITY_RECHECK
+        # seconds, so migrating a running site picks the index up without a restart
+        if self._available:
+            return True
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= AVAILABILITY_RECHECK:
+            self._checked_at = now
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE]
+                )
+                self._available = cursor.fetchone() is not None
+            if not self._available:
+                logger.warning("FTS5 table %s is missing, product search falls back to icontains", FTS_TABLE)
+        return self._available
+
+    def index(self, products):
+        rows = [(product.pk, *product_document(product)) for product in products]
+        if not rows or not self.is_available():
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows]
+            )
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, english_title, description) VALUES (%s, %s, %s, %s)",
+                rows
+            )
+
+    def remove(self, product_ids):
+        if not product_ids or not self.is_available():
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pk,) for pk in product_ids])
+
+    def clear(self):
+        if self.is_available():
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {FTS_TABLE}")
+
+    def build_match(self, text):
+        """Quote every token and prefix-match it so partial words still hit"""
+        tokens = tokenize(text)
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def search(self, text, limit=MAX_RESULTS):
+        if not self.is_available():
+            return None
+        match = self.build_match(text)
+        if not match:
+            return []
+        weights = ', '.join(str(weight) for weight in self.WEIGHTS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s",
+                [match, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def match_sql(self, text):
+        if not self.is_available():
+            return None
+        match = self.build_match(text)
+        if not match:
+            return f"SELECT rowid FROM {FTS_TABLE} WHERE 0", []
+        return f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]
+
+
+class PostgresSearchBackend(SearchBackend):
+    """tsvector side table with a GIN index, ranked with ts_rank"""
+    CONFIG = 'simple'
+
+    def is_available(self):
+        return True
+
+    def index(self, products):
+        rows = [(product.pk, *product_document(product)) for product in products]
+        if not rows:
+            return
+        config = self.CONFIG
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {TSVECTOR_TABLE} (product_id, document) VALUES (%s, "
+                f"setweight(to_tsvector('{config}', %s), 'A') || "
+                f"setweight(to_tsvector('{config}', %s), 'B') || "
+                f"setweight(to_tsvector('{config}', %s), 'C')) "
+                f"ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                rows
+            )
+
+    def remove(self, product_ids):
+        if not product_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TSVECTOR_TABLE} WHERE product_id = ANY(%s)", [list(product_ids)])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {TSVECTOR_TABLE}")
+
+    def build_tsquery(self, text):
+        return ' & '.join(f'{token}:*' for token in tokenize(text))
+
+    def search(self, text, limit=MAX_RESULTS):
+        tsquery = self.build_tsquery(text)
+        if not tsquery:
+            return []
+        config = self.CONFIG
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT product_id FROM {TSVECTOR_TABLE}, to_tsquery('{config}', %s) query "
+                f"WHERE document @@ query ORDER BY ts_rank(document, query) DESC, product_id LIMIT %s",
+                [tsquery, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def match_sql(self, text):
+        tsquery = self.build_tsquery(text)
+        if not tsquery:
+            return f"SELECT product_id FROM {TSVECTOR_TABLE} WHERE false", []
+        return f"SELECT product_id FROM {TSVECTOR_TABLE} WHERE document @@ to_tsquery('{self.CONFIG}', %s)", [tsquery]
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+@lru_cache(maxsize=None)
+def _load_backend(path, vendor):
+    if path:
+        return import_string(path)()
+    return VENDOR_BACKENDS.get(vendor, SearchBackend)()
+
+
+def get_search_backend():
+    """
+    Return the configured search backend.
+
+    PRODUCT_SEARCH_BACKEND may name a backend class; otherwise one is
+    picked for the database vendor.
+    """
+    path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', '')
+    return _load_backend(path, connection.vendor)
+
+
+def safe_search(text, limit=None):
+    """Run a search, returning None (use the fallback) on database errors"""
+    backend = get_search_backend()
+    limit = limit or getattr(settings, 'PRODUCT_SEARCH_MAX_RESULTS', MAX_RESULTS)
+    try:
+        return backend.search(text, limit)
+    except DatabaseError:
+        logger.exception("Product search backend failed for query %r", text)
+        return None
+
+
+def safe_match_sql(text):
+    """match_sql() of the configured backend, or None (use the fallback) on database errors"""
+    try:
+        return get_search_backend().match_sql(text)
+    except DatabaseError:
+        logger.exception("Product search backend failed for query %r", text)
+        return None
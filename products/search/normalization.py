@@ -0,0 +1,92 @@
+"""
+Persian text normalization and tokenization for the search index.
+
+The same pipeline runs once per document at index time and once per
+query, so both sides agree on Arabic/Persian letter forms, digits,
+diacritics and the zero-width non-joiner. A ZWNJ separates words, except
+that a plural or comparative suffix written after one is dropped.
+"""
+import re
+from functools import lru_cache
+
+
+ZWNJ = '‌'
+
+_CHARACTER_MAP = {
+    # Arabic letter forms to their Persian equivalents
+    'ي': 'ی',
+    'ى': 'ی',
+    'ئ': 'ی',
+    'ك': 'ک',
+    'ة': 'ه',
+    'ۀ': 'ه',
+    'أ': 'ا',
+    'إ': 'ا',
+    'آ': 'ا',
+    'ٱ': 'ا',
+    'ؤ': 'و',
+    # Persian and Arabic-Indic digits to ASCII
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)},
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+    # Persian punctuation that should split words
+    '،': ' ',
+    '؛': ' ',
+    '؟': ' ',
+    '«': ' ',
+    '»': ' ',
+}
+
+# Characters removed outright: diacritics, superscript alef, tatweel and
+# zero-width marks other than ZWNJ
+_REMOVED = [chr(code) for code in range(0x064B, 0x0660)] + ['ٰ', 'ـ', '‍', '‎', '‏']
+
+TRANSLATION_TABLE = str.maketrans({**_CHARACTER_MAP, **{char: None for char in _REMOVED}})
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Suffixes dropped when written after a ZWNJ. Without one, ها is as
+# likely part of the word (تنها) as a plural
+ZWNJ_SUFFIX_RE = re.compile(ZWNJ + r'(?:هایی|های|ها|ترین|تر)(?!\w)')
+
+# Light suffixes stripped by the stemmer, longest first
+SUFFIXES = ('ترین', 'تر', 'ات')
+MIN_STEM_LENGTH = 3
+
+# Words that only look inflected (normalized forms)
+UNSTEMMED_WORDS = frozenset({
+    'کامپیوتر', 'فیلتر', 'دفتر', 'دختر', 'چتر', 'بستر', 'کبوتر', 'انگشتر',
+    'متر', 'لیتر', 'سانتیمتر', 'میلیمتر', 'کیلومتر', 'پارامتر', 'پوستر',
+    'اسکوتر', 'پرینتر', 'روتر', 'تستر', 'توستر', 'اینورتر', 'هلیکوپتر',
+    'کاراکتر', 'تیاتر', 'نجات', 'حیات', 'ثبات',
+})
+
+
+def _fold(text):
+    return (text or '').translate(TRANSLATION_TABLE).lower()
+
+
+def normalize(text):
+    """Fold letter forms, digits and diacritics, lowercase the text and split at ZWNJ"""
+    return _fold(text).replace(ZWNJ, ' ')
+
+
+@lru_cache(maxsize=65536)
+def stem(token):
+    """Strip one comparative/plural suffix from a normalized token"""
+    if token in UNSTEMMED_WORDS:
+        return token
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM_LENGTH:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    """Normalized, stemmed tokens of a text"""
+    text = ZWNJ_SUFFIX_RE.sub('', _fold(text))
+    return [stem(token) for token in TOKEN_RE.findall(text.replace(ZWNJ, ' '))]
+
+
+def index_text(text):
+    """Text as stored in the full-text index"""
+    return ' '.join(tokenize(text))
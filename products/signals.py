@@ -0,0 +1,116 @@
+from django.db.models.signals import post_init, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from mptt.signals import node_moved
+
+from core.cache_utils import bump_version
+from core.counters import views_flushed
+from . import catalog_index
+from .facets import CACHE_NAMESPACE as CATALOG_CACHE
+from .models import Product, Category, ProductImage, Comment
+from .query import CATEGORY_TREE_CACHE
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    """Keep the full-text index in sync with saved products"""
+    if raw:
+        return
+    get_search_backend().index([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog_cache(sender, **kwargs):
+    """Drop cached facet counts whenever listed data changes"""
+    bump_version(CATALOG_CACHE)
+
+
+@receiver(post_init, sender=Category)
+def remember_category_path(sender, instance, **kwargs):
+    # Deferred fields are left out rather than loaded one query at a time
+    instance._loaded_path = tuple(instance.__dict__.get(attname) for attname in ('parent_id', 'slug', 'name'))
+
+
+@receiver(post_save, sender=Category)
+def refresh_category_paths(sender, instance, created, raw=False, **kwargs):
+    """Rewrite stored paths of the subtree when the node is added, moved or renamed"""
+    if raw:
+        return
+    path = (instance.parent_id, instance.slug, instance.name)
+    if created or path != instance._loaded_path:
+        instance.refresh_paths()
+        instance._loaded_path = path
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+def invalidate_category_tree_cache(sender, **kwargs):
+    """Subtree ids change whenever a category is added, removed or moved"""
+    bump_version(CATEGORY_TREE_CACHE)
+    bump_version(CATALOG_CACHE)
+
+
+@receiver(m2m_changed, sender=Product.colors.through)
+def invalidate_catalog_cache_on_colors(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_version(CATALOG_CACHE)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def refresh_catalog_index(sender, instance, raw=False, **kwargs):
+    """Patch this worker's catalog index and publish a new generation"""
+    if raw:
+        return
+    catalog_index.schedule_refresh(instance.pk)
+
+
+@receiver(views_flushed, sender=Product)
+def refresh_catalog_index_on_views(sender, pks, **kwargs):
+    """View counts are written with UPDATE, which sends no post_save"""
+    catalog_index.schedule_refresh(*pks)
+
+
+@receiver(m2m_changed, sender=Product.colors.through)
+def refresh_catalog_index_on_colors(sender, instance, action, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear') or not catalog_index.is_enabled():
+        return
+    if reverse:
+        # Changed from the color side, possibly touching many products
+        catalog_index.invalidate()
+    else:
+        catalog_index.schedule_refresh(instance.pk)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def refresh_cover_image(sender, instance, raw=False, **kwargs):
+    """Re-point the product's cover after its gallery changes"""
+    if raw:
+        return
+    Product.refresh_cover_images([instance.product_id])
+
+
+@receiver(post_init, sender=Comment)
+def remember_comment_product(sender, instance, **kwargs):
+    instance._loaded_product_id = instance.__dict__.get('Product_id')
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def refresh_comment_counts(sender, instance, raw=False, **kwargs):
+    """Recount the product's reviews, and the previous product's if the comment moved"""
+    if raw:
+        return
+    product_ids = {instance.Product_id, instance._loaded_product_id} - {None}
+    Product.refresh_comment_counts(product_ids)
+    instance._loaded_product_id = instance.Product_id
@@ -1,3 +1,713 @@
-from django.test import TestCase
+from io import StringIO
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.cache_utils import bump_version
+from core.counters import ViewCounterBuffer
+
+from . import catalog_index, category_tree
+from accounts.models import MyUser
+from orders.models import Order, OrderItem
+from .facets import FacetCounter
+from .models import Product, Category, Brand, Color, ProductImage, CoPurchase, CoPurchaseTotal, Comment
+from .query import ProductQuery, ProductFilter, get_subtree_ids
+from .recommendations import get_related_products, mine_co_purchases
+from .search.backends import AVAILABILITY_RECHECK, SQLiteFTSBackend
+from .search.normalization import normalize, tokenize
+
+# Plain static storage so views render without a collectstatic manifest
+TEST_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+class CatalogTestData:
+    """Fifteen phones across brands, stock levels and one color, plus a laptop"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name='موبایل')
+        cls.laptops = Category.objects.create(name='لپ تاپ')
+        cls.basic_phones = Category.objects.create(name='گوشی ساده', parent=cls.phones)
+        cls.brand = Brand.objects.create(name='سامسونگ', logo='brands/samsung.png')
+        cls.black = Color.objects.create(name='مشکی', hex_code='#000000')
+        for i in range(15):
+            product = Product.objects.create(
+                title=f'گوشی {i}',
+                description='گوشی هوشمند',
+                category=cls.phones,
+                brand=cls.brand if i % 2 else None,
+                price=1000 + i,
+                stock=i % 3,
+                sales=i,
+            )
+            if i % 5 == 0:
+                product.colors.add(cls.black)
+        Product.objects.create(
+            title='لپ تاپ', description='لپ تاپ', category=cls.laptops, price=50000, stock=1,
+        )
+
+
+class ProductQueryTests(CatalogTestData, TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def run_query(self, params='', with_facets=False, **options):
+        spec = ProductFilter.from_params(QueryDict(params), **options)
+        return ProductQuery(spec).run(with_facets=with_facets)
+
+    def test_query_budget(self):
+        with self.assertNumQueries(ProductQuery.QUERY_BUDGET):
+            self.run_query('category=%s&color=%s&sort=price_asc' % (self.phones.slug, self.black.id))
+
+    def test_query_budget_without_category(self):
+        with self.assertNumQueries(ProductQuery.QUERY_BUDGET - 1):
+            self.run_query('only_available=true')
+
+    def test_filters_and_summary(self):
+        result = self.run_query('category=%s&min_price=1005&only_available=true' % self.phones.slug)
+        prices = [p.price for p in result.page]
+        self.assertEqual(result.total, len(prices))
+        self.assertTrue(all(price >= 1005 for price in prices))
+        self.assertEqual(result.price_range['min_price'], min(prices))
+        self.assertEqual(result.selected_category, self.phones)
+
+    def test_pagination_uses_aggregate_count(self):
+        result = self.run_query('sort=price_desc&page=2')
+        self.assertEqual(result.total, 16)
+        self.assertEqual(result.page.paginator.num_pages, 2)
+
+    def test_bestsellers_ignore_sort_param(self):
+        result = self.run_query('sort=price_asc', bestsellers=True)
+        sales = [p.sales for p in result.page]
+        self.assertEqual(sales, sorted(sales, reverse=True))
+        self.assertNotIn(0, sales)
+
+    def test_search_requires_query(self):
+        # Empty searches skip the aggregate and the page entirely
+        with self.assertNumQueries(ProductQuery.QUERY_BUDGET - 3):
+            result = self.run_query('', search_param='q', require_search=True)
+        self.assertEqual(result.total, 0)
+        self.assertEqual(list(result.page), [])
+
+    def test_invalid_params_are_ignored(self):
+        result = self.run_query('color=abc&min_price=-5&sort=bogus')
+        self.assertEqual(result.total, 16)
+        self.assertEqual(ProductFilter.from_params(QueryDict('sort=bogus')).sort, 'created_at')
+
+    def test_unknown_category_returns_nothing(self):
+        result = self.run_query('category=missing')
+        self.assertEqual(result.total, 0)
+
+    def test_parent_category_includes_subtree(self):
+        basic = Product.objects.create(title='گوشی ساده', description='-', category=self.basic_phones, price=10)
+        result = self.run_query('category=%s&sort=price_asc' % self.phones.slug)
+        self.assertEqual(result.total, 16)
+        self.assertEqual(result.page[0], basic)
+        self.assertEqual(self.run_query('category=%s' % self.basic_phones.slug).total, 1)
+
+    def test_subtree_ids_follow_tree_moves(self):
+        self.assertEqual(set(get_subtree_ids(self.phones)), {self.phones.pk, self.basic_phones.pk})
+        self.basic_phones.move_to(self.laptops)
+        self.phones.refresh_from_db()
+        self.laptops.refresh_from_db()
+        self.assertEqual(get_subtree_ids(self.phones), [self.phones.pk])
+        self.assertEqual(set(get_subtree_ids(self.laptops)), {self.laptops.pk, self.basic_phones.pk})
+
+    @override_settings(CACHE_MAX_STALENESS=60)
+    def test_subtree_ids_expire(self):
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            get_subtree_ids(self.phones)
+        self.assertEqual(cache_set.call_args.args[2], 60)
+
+    def test_facet_counts_skip_their_own_filter(self):
+        result = self.run_query('color=%s' % self.black.id, with_facets=True)
+        # Products 0, 5 and 10 are black; only odd products carry the brand
+        self.assertEqual(result.total, 3)
+        self.assertEqual(result.colors[0].product_count, 3)
+        self.assertEqual(result.brands[0].product_count, 1)
+        self.assertEqual({c.id: c.product_count for c in result.filter_categories}, {
+            self.laptops.id: 0, self.phones.id: 3,
+        })
+        self.assertEqual(result.available_count, 2)
+
+        result = self.run_query('color=%s&brand=%s' % (self.black.id, self.brand.slug), with_facets=True)
+        self.assertEqual(result.total, 1)
+        self.assertEqual(result.brands[0].product_count, 1)
+        self.assertEqual(result.colors[0].product_count, 1)
+
+    def test_facets_are_cached_per_filter_set(self):
+        with self.assertNumQueries(ProductQuery.QUERY_BUDGET - 1 + ProductQuery.FACET_QUERY_BUDGET):
+            self.run_query('sort=price_asc', with_facets=True)
+        with self.assertNumQueries(ProductQuery.QUERY_BUDGET - 1):
+            result = self.run_query('sort=views', with_facets=True)
+        self.assertEqual(result.available_count, 11)
+
+        Product.objects.filter(stock=0).first().save()
+        with self.assertNumQueries(ProductQuery.QUERY_BUDGET - 1 + ProductQuery.FACET_QUERY_BUDGET):
+            self.run_query('sort=views', with_facets=True)
+
+
+@override_settings(PRODUCT_CATALOG_INDEX=True)
+class CatalogIndexTests(CatalogTestData, TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_index._index = None
+
+    def run_both(self, params, **options):
+        params = QueryDict(params)
+        spec = ProductFilter.from_params(params, **options)
+        with self.settings(PRODUCT_CATALOG_INDEX=False):
+            expected = ProductQuery(spec).run(page_number=params.get('page'), with_facets=False)
+        result = ProductQuery(spec).run(page_number=params.get('page'), with_facets=False)
+        return expected, result
+
+    def test_matches_database_results(self):
+        for params in (
+            '',
+            'sort=price_asc&page=2',
+            'category=%s&only_available=true&sort=views' % self.phones.slug,
+            'brand=%s&min_price=1003&max_price=1011' % self.brand.slug,
+            'color=%s&sort=price_desc' % self.black.id,
+            'is_amazing=true',
+            'brand=missing',
+            'category=%s&sort=price_asc' % self.phones.slug,
+        ):
+            with self.subTest(params=params):
+                expected, result = self.run_both(params)
+                self.assertEqual([p.pk for p in result.page], [p.pk for p in expected.page])
+                self.assertEqual(result.total, expected.total)
+                self.assertEqual(result.price_range, expected.price_range)
+
+    def test_reserved_stock_is_not_available(self):
+        product = Product.objects.filter(stock__gt=0).first()
+        available = self.run_both('only_available=true')[1].total
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=product.pk).update(reserved_stock=product.stock)
+            catalog_index.schedule_refresh(product.pk)
+        expected, result = self.run_both('only_available=true&sort=price_asc')
+        self.assertEqual(expected.total, available - 1)
+        self.assertEqual([p.pk for p in result.page], [p.pk for p in expected.page])
+        self.assertEqual(result.total, expected.total)
+        spec = ProductFilter.from_params(QueryDict(''))
+        self.assertEqual(FacetCounter(ProductQuery(spec), []).count_available(), expected.total)
+
+    def test_bestsellers(self):
+        Product.objects.create(title='گوشی ساده', description='-', category=self.basic_phones, price=10, sales=99)
+        expected, result = self.run_both('category=%s' % self.phones.slug, bestsellers=True)
+        self.assertEqual([p.pk for p in result.page], [p.pk for p in expected.page])
+        self.assertEqual(result.page[0].category, self.basic_phones)
+
+    def test_page_is_one_query_once_built(self):
+        catalog_index.get_catalog_index()
+        spec = ProductFilter.from_params(QueryDict('sort=sales'))
+        # Page rows, filter categories, colors and brands
+        with self.assertNumQueries(4):
+            ProductQuery(spec).run(with_facets=False)
+
+    def test_local_writes_patch_a_copy(self):
+        index = catalog_index.get_catalog_index()
+        product = Product.objects.get(title='لپ تاپ')
+        old_price = index.price[index.positions[product.pk]]
+        with mock.patch.object(catalog_index.CatalogIndex, 'build') as build:
+            with self.captureOnCommitCallbacks(execute=True):
+                product.price = 10
+                product.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                product.colors.add(self.black)
+        build.assert_not_called()
+        # Requests still holding the old index see it unchanged
+        self.assertEqual(index.price[index.positions[product.pk]], old_price)
+        result = self.run_both('sort=price_asc&color=%s' % self.black.id)[1]
+        self.assertEqual(result.page[0], product)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertEqual(len(catalog_index.get_catalog_index()), 15)
+
+    def test_other_workers_changes_are_caught_up(self):
+        index = catalog_index.get_catalog_index()
+        product = Product.objects.get(title='لپ تاپ')
+        # Another worker's save: the row changes and only the delta is published
+        Product.objects.filter(pk=product.pk).update(price=1, stock=0)
+        generation = bump_version(catalog_index.GENERATION_KEY)
+        cache.set(catalog_index._delta_key(generation), [product.pk])
+        # Missed deltas, their rows and their colors
+        with self.assertNumQueries(2):
+            updated = catalog_index.get_catalog_index()
+        self.assertEqual(updated.generation, generation)
+        self.assertEqual(updated.price[updated.positions[product.pk]], 1)
+        self.assertFalse(updated.available >> updated.positions[product.pk] & 1)
+        self.assertTrue(index.available >> index.positions[product.pk] & 1)
+
+    def test_flushed_views_reach_the_index(self):
+        index = catalog_index.get_catalog_index()
+        least_viewed = min(Product.objects.all(), key=lambda product: (product.views, -product.pk))
+        buffer = ViewCounterBuffer()
+        with mock.patch.object(catalog_index.CatalogIndex, 'build') as build:
+            with self.captureOnCommitCallbacks(execute=True):
+                for _ in range(max(product.views for product in Product.objects.all()) + 1):
+                    buffer.record(least_viewed)
+                buffer.flush()
+            updated = catalog_index.get_catalog_index()
+        build.assert_not_called()
+        self.assertNotEqual(index.select(index.alive, 'views', 0, 1), [least_viewed.pk])
+        self.assertEqual(updated.select(updated.alive, 'views', 0, 1), [least_viewed.pk])
+
+    def test_missing_delta_triggers_rebuild(self):
+        index = catalog_index.get_catalog_index()
+        bump_version(catalog_index.GENERATION_KEY)
+        with mock.patch.object(catalog_index.CatalogIndex, 'build', return_value=index) as build:
+            catalog_index.get_catalog_index()
+        build.assert_called_once()
+
+
+class CoverImageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='موبایل')
+        cls.products = [
+            Product.objects.create(title=f'گوشی {i}', description='-', category=category, price=i)
+            for i in range(3)
+        ]
+
+    def add_image(self, product, name):
+        return ProductImage.objects.create(product=product, image=f'products/gallery/{name}.jpg')
+
+    def test_cover_follows_gallery_changes(self):
+        product = self.products[0]
+        first = self.add_image(product, 'first')
+        second = self.add_image(product, 'second')
+        product.refresh_from_db()
+        self.assertEqual(product.cover_image, first)
+
+        first.delete()
+        product.refresh_from_db()
+        self.assertEqual(product.cover_image, second)
+        second.delete()
+        product.refresh_from_db()
+        self.assertIsNone(product.cover_image)
+
+    def test_backfill_command(self):
+        images = [self.add_image(product, product.slug) for product in self.products]
+        Product.objects.update(cover_image=None)
+        call_command('backfill_cover_images', stdout=StringIO())
+        self.assertEqual(
+            [product.cover_image_id for product in Product.objects.order_by('id')],
+            [image.pk for image in images],
+        )
+
+    def test_listing_cards_need_no_image_queries(self):
+        for product in self.products:
+            self.add_image(product, product.slug)
+        result = ProductQuery(ProductFilter()).run(with_facets=False)
+        with self.assertNumQueries(0):
+            urls = [product.cover_image.image.url for product in result.page]
+        self.assertEqual(len(urls), 3)
+
+
+class CategoryPathTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.digital = Category.objects.create(name='دیجیتال', slug='digital')
+        cls.mobile = Category.objects.create(name='موبایل', slug='mobile', parent=cls.digital)
+        cls.phone = Category.objects.create(name='گوشی', slug='phone', parent=cls.mobile)
+        cls.home = Category.objects.create(name='خانه', slug='home')
+
+    def paths(self):
+        return dict(Category.objects.values_list('slug', 'full_path'))
+
+    def test_paths_stored_on_create(self):
+        phone = Category.objects.get(pk=self.phone.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(phone.get_full_slug(), 'digital/mobile/phone')
+            self.assertEqual(phone.ancestor_ids, [self.digital.pk, self.mobile.pk])
+            self.assertEqual([crumb['name'] for crumb in phone.get_breadcrumbs()], ['دیجیتال', 'موبایل', 'گوشی'])
+            self.assertEqual(phone.parent_crumb['slug'], 'mobile')
+
+    def test_move_rewrites_subtree(self):
+        mobile = Category.objects.get(pk=self.mobile.pk)
+        mobile.parent = self.home
+        mobile.save()
+        self.assertEqual(self.paths()['phone'], 'home/mobile/phone')
+        self.assertEqual(Category.objects.get(pk=self.phone.pk).ancestor_ids, [self.home.pk, self.mobile.pk])
+
+        Category.objects.get(pk=self.mobile.pk).move_to(None)
+        self.assertEqual(self.paths()['phone'], 'mobile/phone')
+        self.assertIsNone(Category.objects.get(pk=self.mobile.pk).parent_crumb)
+
+    def test_rename_rewrites_descendants(self):
+        digital = Category.objects.get(pk=self.digital.pk)
+        digital.slug, digital.name = 'electronics', 'الکترونیک'
+        digital.save()
+        phone = Category.objects.get(pk=self.phone.pk)
+        self.assertEqual(phone.full_path, 'electronics/mobile/phone')
+        self.assertEqual(phone.get_breadcrumbs()[0]['name'], 'الکترونیک')
+        self.assertEqual(self.paths()['home'], 'home')
+
+    def test_unchanged_save_skips_rewrite(self):
+        phone = Category.objects.get(pk=self.phone.pk)
+        with self.assertNumQueries(1):
+            phone.save(update_fields=['image'])
+
+    @override_settings(STORAGES=TEST_STORAGES)
+    def test_product_breadcrumb_needs_no_category_queries(self):
+        product = Product.objects.create(title='گوشی آزمایشی', description='-', category=self.phone, price=1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product', args=[product.slug]), HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertContains(response, 'دیجیتال')
+        self.assertContains(response, '?category=mobile')
+        # The mega menu still loads the tree; no category is fetched by id for the breadcrumb
+        self.assertFalse([q for q in queries if '"products_category"."id" =' in q['sql']])
+
+
+class CategoryTreeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.digital = Category.objects.create(name='دیجیتال', slug='digital')
+        cls.mobile = Category.objects.create(name='موبایل', slug='mobile', parent=cls.digital)
+        cls.phone = Category.objects.create(name='گوشی', slug='phone', parent=cls.mobile)
+        cls.home = Category.objects.create(name='خانه', slug='home')
+
+    def setUp(self):
+        cache.clear()
+        category_tree._tree = None
+
+    def menu(self, nodes):
+        return {node.slug: self.menu(node.get_children()) for node in nodes}
+
+    def test_tree_reused_until_categories_change(self):
+        tree = category_tree.get_category_tree()
+        with self.assertNumQueries(0):
+            self.assertIs(category_tree.get_category_tree(), tree)
+            self.assertEqual(self.menu(tree.roots), {'home': {}, 'digital': {'mobile': {'phone': {}}}})
+
+    def test_tree_rebuilt_after_move(self):
+        category_tree.get_category_tree()
+        Category.objects.get(pk=self.mobile.pk).move_to(self.home)
+        tree = category_tree.get_category_tree()
+        self.assertEqual(self.menu(tree.roots), {'home': {'mobile': {'phone': {}}}, 'digital': {}})
+
+    @override_settings(CACHE_MAX_STALENESS=60)
+    def test_tree_rebuilt_once_stale(self):
+        tree = category_tree.get_category_tree()
+        with mock.patch('products.category_tree.time.monotonic', return_value=tree.built_at + 59):
+            self.assertIs(category_tree.get_category_tree(), tree)
+        with mock.patch('products.category_tree.time.monotonic', return_value=tree.built_at + 60):
+            self.assertIsNot(category_tree.get_category_tree(), tree)
+
+    def test_tree_rebuilt_after_delete(self):
+        category_tree.get_category_tree()
+        Category.objects.get(pk=self.home.pk).delete()
+        self.assertEqual([root.slug for root in category_tree.get_category_tree().roots], ['digital'])
+
+
+@override_settings(CO_PURCHASE_ORDER_LAG_HOURS=0, CO_PURCHASE_MIN_COUNT=2, CO_PURCHASE_MAX_BASKET_SIZE=50)
+class CoPurchaseTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(phone='09120000000')
+        category = Category.objects.create(name='موبایل')
+        cls.phone, cls.case, cls.charger, cls.cable, cls.other = [
+            Product.objects.create(title=f'محصول {i}', description='-', category=category, price=1)
+            for i in range(5)
+        ]
+
+    def order(self, *products, status='paid'):
+        order = Order.objects.create(user=self.user, total_price=1, status=status)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=1)
+        return order
+
+    def test_mining_counts_pairs_and_diagonal(self):
+        self.order(self.phone, self.case)
+        self.order(self.phone, self.case, self.charger)
+        self.order(self.phone, self.charger, self.cable, status='cancelled')
+        self.assertEqual(mine_co_purchases(), 3)
+
+        counts = {(row.product_id, row.related_id): row.count for row in CoPurchase.objects.all()}
+        self.assertEqual(counts[(self.phone.pk, self.case.pk)], 2)
+        self.assertEqual(counts[(self.case.pk, self.phone.pk)], 2)
+        self.assertEqual(CoPurchaseTotal.objects.get(product=self.phone).count, 2)
+        self.assertNotIn((self.phone.pk, self.phone.pk), counts)
+        self.assertNotIn((self.phone.pk, self.cable.pk), counts)
+        # phone and case always appear together
+        self.assertAlmostEqual(CoPurchase.objects.get(product=self.phone, related=self.case).score, 1.0)
+
+    def test_mining_is_incremental(self):
+        self.order(self.phone, self.case)
+        mine_co_purchases()
+        self.assertEqual(mine_co_purchases(), 0)
+
+        self.order(self.phone, self.charger)
+        self.assertEqual(mine_co_purchases(), 1)
+        phone_case = CoPurchase.objects.get(product=self.phone, related=self.case)
+        self.assertEqual(phone_case.count, 1)
+        self.assertAlmostEqual(phone_case.score, 1 / 2 ** 0.5)
+
+    @override_settings(CO_PURCHASE_TOP_K=1)
+    def test_only_top_neighbours_are_kept(self):
+        self.order(self.phone, self.case)
+        self.order(self.phone, self.case, self.charger)
+        self.order(self.charger)
+        mine_co_purchases()
+        pairs = set(CoPurchase.objects.values_list('product_id', 'related_id'))
+        # The phone keeps the case over the charger; the charger's tie goes to the lower id
+        self.assertEqual(pairs, {
+            (self.phone.pk, self.case.pk), (self.case.pk, self.phone.pk), (self.charger.pk, self.phone.pk),
+        })
+        self.assertEqual(CoPurchaseTotal.objects.get(product=self.charger).count, 2)
+
+    def test_recent_orders_wait_for_the_lag(self):
+        self.order(self.phone, self.case)
+        with self.settings(CO_PURCHASE_ORDER_LAG_HOURS=1):
+            self.assertEqual(mine_co_purchases(), 0)
+
+    def test_related_products_fall_back_to_category(self):
+        for _ in range(2):
+            self.order(self.phone, self.cable)
+        self.order(self.phone, self.charger)
+        mine_co_purchases()
+        with self.assertNumQueries(2):
+            related = get_related_products(self.phone, limit=3)
+        # cable is bought with the phone twice; charger only once, below the minimum
+        self.assertEqual(related[0], self.cable)
+        self.assertEqual(len(related), 3)
+        self.assertNotIn(self.phone, related)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_related_products(self.phone, limit=1), [self.cable])
+
+
+class CommentCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [MyUser.objects.create_user(phone=f'0912000000{i}') for i in range(3)]
+        category = Category.objects.create(name='موبایل')
+        cls.product, cls.other = [
+            Product.objects.create(title=f'گوشی {i}', description='-', category=category, price=1)
+            for i in range(2)
+        ]
+
+    def comment(self, user, recommendation=True, product=None):
+        return Comment.objects.create(
+            Product=product or self.product, author=user, content='خوب بود', recommendation=recommendation,
+        )
+
+    def counts(self, product=None):
+        product = product or self.product
+        product.refresh_from_db()
+        return product.comment_count, product.recommend_count
+
+    def test_counts_follow_comment_changes(self):
+        first = self.comment(self.users[0])
+        self.comment(self.users[1], recommendation=False)
+        self.assertEqual(self.counts(), (2, 1))
+        self.assertEqual(self.product.get_recommend_percent(), 50)
+
+        first.recommendation = False
+        first.save()
+        self.assertEqual(self.counts(), (2, 0))
+
+        first.Product = self.other
+        first.save()
+        self.assertEqual(self.counts(), (1, 0))
+        self.assertEqual(self.counts(self.other), (1, 0))
+
+        first.delete()
+        self.assertEqual(self.counts(self.other), (0, 0))
+        self.assertIsNone(self.other.get_recommend_percent())
+
+    def test_reconcile_repairs_drift(self):
+        self.comment(self.users[0])
+        Product.objects.update(comment_count=7, recommend_count=0)
+        out = StringIO()
+        call_command('reconcile_comment_counts', stdout=out)
+        self.assertIn('2 محصول', out.getvalue())
+        self.assertEqual(self.counts(), (1, 1))
+        self.assertEqual(self.counts(self.other), (0, 0))
+
+    @override_settings(STORAGES=TEST_STORAGES)
+    def test_product_page_comment_queries_do_not_grow(self):
+        self.comment(self.users[0])
+        url = reverse('product', args=[self.product.slug])
+        self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        with CaptureQueriesContext(connection) as one_comment:
+            self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        for user in self.users[1:]:
+            self.comment(user)
+        with self.assertNumQueries(len(one_comment)):
+            response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(len(response.context['comments']), 3)
+        self.assertContains(response, '100٪ از 3 نفر')
+
+    @override_settings(STORAGES=TEST_STORAGES)
+    def test_listing_cards_show_recommend_percent(self):
+        self.comment(self.users[0])
+        self.comment(self.users[1], recommendation=False)
+        response = self.client.get('/shop/')
+        self.assertContains(response, '50٪ پیشنهاد کاربران', count=1)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='موبایل')
+        for i in range(30):
+            # Repeated prices exercise the id tie-breaker
+            Product.objects.create(title=f'محصول {i}', description='-', category=category, price=i // 3, sales=i % 4)
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, sort, backwards=False):
+        query = ProductQuery(ProductFilter.from_params(QueryDict(f'sort={sort}')))
+        page = query.run(with_facets=False, cursor='start').page
+        pages = [[p.id for p in page]]
+        while page.has_next():
+            page = query.run(with_facets=False, cursor=page.next_cursor).page
+            pages.append([p.id for p in page])
+        if backwards:
+            pages = [[p.id for p in page]]
+            while page.has_previous():
+                page = query.run(with_facets=False, cursor=page.previous_cursor).page
+                pages.insert(0, [p.id for p in page])
+        return pages
+
+    def expected(self, sort):
+        ids = list(ProductQuery(ProductFilter.from_params(QueryDict(f'sort={sort}'))).get_queryset().values_list('id', flat=True))
+        return [ids[i:i + 12] for i in range(0, len(ids), 12)]
+
+    def test_forward_walk_matches_offset_order(self):
+        for sort in ('created_at', 'price_asc', 'price_desc', 'sales', 'views'):
+            with self.subTest(sort=sort):
+                self.assertEqual(self.walk(sort), self.expected(sort))
+
+    def test_backward_walk_returns_same_pages(self):
+        self.assertEqual(self.walk('price_asc', backwards=True), self.expected('price_asc'))
+
+    def test_page_costs_one_query_once_summary_is_cached(self):
+        query = ProductQuery(ProductFilter.from_params(QueryDict('sort=sales')))
+        first = query.run(with_facets=False, cursor='start')
+        self.assertEqual(first.page.approximate_count, 30)
+        query = ProductQuery(ProductFilter.from_params(QueryDict('sort=sales')))
+        # Page plus the color and brand facet lists
+        with self.assertNumQueries(4):
+            query.run(with_facets=False, cursor=first.page.next_cursor)
+
+    def test_tampered_cursor_restarts(self):
+        query = ProductQuery(ProductFilter.from_params(QueryDict('sort=price_asc')))
+        page = query.run(with_facets=False, cursor='bogus').page
+        self.assertEqual([p.id for p in page], self.expected('price_asc')[0])
+
+    @override_settings(PRODUCT_LISTING_PAGINATION='keyset', STORAGES=TEST_STORAGES)
+    def test_shop_view_renders_cursor_links(self):
+        response = self.client.get('/shop/?sort=price_asc')
+        self.assertTrue(response.context['products'].is_keyset)
+        self.assertContains(response, 'cursor=')
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='موبایل')
+        cls.exact = Product.objects.create(
+            title='گوشی سامسونگ گلکسی', english_title='Samsung Galaxy', description='گوشی', category=category, price=10,
+        )
+        cls.described = Product.objects.create(
+            title='قاب گوشی', description='مناسب سامسونگ گلکسی', category=category, price=20,
+        )
+        cls.other = Product.objects.create(title='لپ تاپ', description='لپ تاپ', category=category, price=30)
+
+    def search(self, text):
+        spec = ProductFilter.from_params(QueryDict(urlencode({'q': text})), search_param='q', require_search=True)
+        return list(ProductQuery(spec).run().page)
+
+    def test_ranks_title_matches_first(self):
+        self.assertEqual(self.search('سامسونگ گلکسی'), [self.exact, self.described])
+
+    def test_prefix_and_english_matches(self):
+        self.assertEqual(self.search('galax'), [self.exact])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.other.title = 'لپ تاپ سامسونگ'
+        self.other.save()
+        self.assertIn(self.other, self.search('سامسونگ'))
+        self.exact.delete()
+        self.assertNotIn(self.exact, self.search('گلکسی'))
+
+    def test_ranked_results_keep_rank_under_filters(self):
+        spec = ProductFilter.from_params(QueryDict(urlencode({'q': 'گوشی', 'min_price': 15})), search_param='q')
+        result = ProductQuery(spec, page_size=1).run(with_facets=False)
+        self.assertEqual(list(result.page), [self.described])
+        self.assertEqual((result.total, result.price_range), (1, {'min_price': 20, 'max_price': 20}))
+
+        spec = ProductFilter.from_params(QueryDict(urlencode({'q': 'سامسونگ گلکسی', 'page': 2})), search_param='q')
+        # Ranked ids, ids and prices, the page rows, then the three filter lists
+        with self.assertNumQueries(6):
+            result = ProductQuery(spec, page_size=1).run(page_number=2, with_facets=False)
+            self.assertEqual(list(result.page), [self.described])
+
+    @override_settings(PRODUCT_SEARCH_MAX_RESULTS=1)
+    def test_result_cap_only_limits_ranking(self):
+        for sort in ('price_desc', 'relevance'):
+            with self.subTest(sort=sort):
+                spec = ProductFilter.from_params(QueryDict(urlencode({'q': 'سامسونگ', 'sort': sort})), search_param='q')
+                result = ProductQuery(spec).run()
+                self.assertEqual(result.total, 2)
+                self.assertEqual(result.price_range, {'min_price': 10, 'max_price': 20})
+                self.assertEqual(sum(category.product_count for category in result.filter_categories), 2)
+        self.assertEqual(list(result.page), [self.exact, self.described])
+
+    def test_missing_index_is_looked_for_again(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE products_product_fts RENAME TO products_product_fts_hidden')
+        backend = SQLiteFTSBackend()
+        with mock.patch('products.search.backends.time.monotonic', return_value=100):
+            self.assertFalse(backend.is_available())
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE products_product_fts_hidden RENAME TO products_product_fts')
+        with mock.patch('products.search.backends.time.monotonic', return_value=101):
+            self.assertFalse(backend.is_available())
+        with mock.patch('products.search.backends.time.monotonic', return_value=100 + AVAILABILITY_RECHECK):
+            self.assertTrue(backend.is_available())
+
+    def test_explicit_sort_overrides_relevance(self):
+        spec = ProductFilter.from_params(QueryDict('q=گوشی&sort=price_desc'), search_param='q')
+        self.assertEqual(spec.sort, 'price_desc')
+        self.assertEqual(ProductFilter.from_params(QueryDict('q=گوشی'), search_param='q').sort, 'relevance')
+
+
+class NormalizationTests(TestCase):
+    def test_arabic_forms_digits_and_diacritics(self):
+        self.assertEqual(normalize('كيف ٤ گِلَكسی ۱۲'), 'کیف 4 گلکسی 12')
+
+    def test_zwnj_and_suffixes(self):
+        self.assertEqual(tokenize('گوشی‌های سامسونگ'), ['گوشی', 'سامسونگ'])
+        self.assertEqual(tokenize('گوشی‌ها'), ['گوشی'])
+        self.assertEqual(tokenize('بزرگ‌ترین'), tokenize('بزرگترین'))
+        self.assertEqual(normalize('می‌خواهم'), 'می خواهم')
+
+    def test_words_that_only_look_inflected(self):
+        for word in ('کامپیوتر', 'فیلتر', 'دفتر', 'تنها', 'بهترین', 'بهتر'):
+            with self.subTest(word=word):
+                self.assertEqual(tokenize(word), [word])
+        self.assertEqual(tokenize('کامپیوتر‌ها'), ['کامپیوتر'])
+
+    def test_search_matches_across_forms(self):
+        category = Category.objects.create(name='موبایل')
+        product = Product.objects.create(title='گوشي موبايل', description='-', category=category, price=1)
+        spec = ProductFilter.from_params(QueryDict(urlencode({'q': 'گوشی‌ها'})), search_param='q')
+        self.assertEqual(list(ProductQuery(spec).run().page), [product])
@@ -1,132 +1,55 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
-from django.db.models import Q, Min, Max
 from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
+from django.core.paginator import Paginator
 from urllib.parse import unquote
 
-from .models import Product, Color, Category, Comment, Brand
+from .models import Product, Comment
 from .forms import CommentForm
+from .query import ProductQuery
+from .recommendations import get_related_products
 from accounts.models import Favorite
+from core.counters import record_view
 
+COMMENTS_PAGE_SIZE = 10
 
-def shop(request):
-    """Shop page with filters and search"""
-    products = Product.objects.all()
-    
-    # Filter by category
-    category_slug = request.GET.get('category')
-    if category_slug:
-        products = products.filter(category__slug=category_slug)
-    
-    # Filter by brand
-    brand_slug = request.GET.get('brand')
-    if brand_slug:
-        products = products.filter(brand__slug=brand_slug)
-    
-    # Filter by color
-    color_id = request.GET.get('color')
-    if color_id:
-        products = products.filter(colors__id=color_id)
-    
-    # Filter by price
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    if min_price:
-        try:
-            products = products.filter(price__gte=int(min_price))
-        except ValueError:
-            pass
-    if max_price:
-        try:
-            products = products.filter(price__lte=int(max_price))
-        except ValueError:
-            pass
-    
-    # Filter amazing products
-    is_amazing = request.GET.get('is_amazing')
-    if is_amazing == 'true':
-        products = products.filter(is_amazing=True)
-    
-    # Filter only available products
-    only_available = request.GET.get('only_available')
-    if only_available == 'true':
-        products = products.filter(stock__gt=0)
-    
-    # Search
-    search_query = request.GET.get('search')
-    if search_query:
-        products = products.filter(
-            Q(title__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(english_title__icontains=search_query)
-        )
-    
-    # Sorting
-    sort_by = request.GET.get('sort', 'created_at')
-    if sort_by == 'price_asc':
-        products = products.order_by('price')
-    elif sort_by == 'price_desc':
-        products = products.order_by('-price')
-    elif sort_by == 'sales':
-        products = products.order_by('-sales')
-    elif sort_by == 'views':
-        products = products.order_by('-views')
-    else:
-        products = products.order_by('-created_at')
-    
-    # Calculate price range for filter
-    price_range = products.aggregate(
-        min_price=Min('price'),
-        max_price=Max('price')
-    )
-    
-    # Pagination
-    paginator = Paginator(products, 12)  # 12 products per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
-    # Get categories suitable for filter (not for main menu)
-    # If category is selected, show its children
-    # Otherwise, show root categories
-    selected_category_obj = None
-    if category_slug:
-        try:
-            selected_category_obj = Category.objects.get(slug=category_slug)
-            # Show children of selected category
-            filter_categories = selected_category_obj.get_children().order_by('name')
-        except Category.DoesNotExist:
-            filter_categories = Category.objects.filter(parent__isnull=True).exclude(slug='').order_by('name')
-    else:
-        # Show root categories
-        filter_categories = Category.objects.filter(parent__isnull=True).exclude(slug='').order_by('name')
-    colors = Color.objects.distinct()
-    brands = Brand.objects.filter(is_active=True).order_by('order', 'name')
-    
-    # Check favorites for logged-in users
-    user_favorites = set()
+
+def get_user_favorites(request):
+    """Product ids favorited by the current user"""
     if request.user.is_authenticated:
-        user_favorites = set(Favorite.objects.filter(user=request.user).values_list('product_id', flat=True))
-    
-    context = {
-        'products': page_obj,
-        'filter_categories': filter_categories,  # Only for right sidebar filter
-        'selected_category_obj': selected_category_obj,  # For displaying category path
-        'colors': colors,
-        'brands': brands,
-        'selected_category': category_slug,
-        'selected_brand': brand_slug,
-        'selected_color': color_id,
-        'search_query': search_query,
-        'price_range': price_range,
-        'sort_by': sort_by,
-        'user_favorites': user_favorites,
-        'only_available': only_available == 'true',
+        return set(Favorite.objects.filter(user=request.user).values_list('product_id', flat=True))
+    return set()
+
+
+def get_listing_context(request, query):
+    """Run a listing query and build the context shared by listing templates"""
+    spec = query.spec
+    result = query.run(request.GET.get('page'), cursor=request.GET.get('cursor'))
+    return {
+        'products': result.page,
+        'filter_categories': result.filter_categories,  # Only for right sidebar filter
+        'selected_category_obj': result.selected_category,  # For displaying category path
+        'colors': result.colors,
+        'brands': result.brands,
+        'selected_category': spec.category or None,
+        'selected_brand': spec.brand or None,
+        'selected_color': str(spec.color) if spec.color is not None else None,
+        'price_range': result.price_range,
+        'sort_by': spec.sort,
+        'user_favorites': get_user_favorites(request),
+        'only_available': spec.only_available,
+        'available_count': result.available_count,
     }
-    
+
+
+def shop(request):
+    """Shop page with filters and search"""
+    query = ProductQuery.from_request(request)
+    context = get_listing_context(request, query)
+    context['search_query'] = query.spec.search or None
     return render(request, 'products/shop.html', context)
 
 
@@ -134,19 +57,18 @@ def single_product(request, slug):
     """Product details page"""
     # Decode URL-encoded slug to handle Persian characters properly
     slug = unquote(slug)
-    product = get_object_or_404(Product, slug=slug)
+    product = get_object_or_404(Product.objects.select_related('cover_image', 'category'), slug=slug)
     
-    # Increment view count
-    product.views += 1
-    product.save(update_fields=['views'])
+    # Buffered view count, written in batches
+    record_view(request, product)
     
-    # Related products (from same category)
-    related_products = Product.objects.filter(
-        category=product.category
-    ).exclude(pk=product.pk)[:4]
+    # Frequently bought together, falling back to the same category
+    related_products = get_related_products(product)
     
-    # Approved comments
-    comments = product.comments.all().order_by('-created_at')
+    # Approved comments, a page at a time; the stored counter saves a COUNT(*)
+    paginator = Paginator(product.comments.select_related('author').order_by('-created_at'), COMMENTS_PAGE_SIZE)
+    paginator.count = product.comment_count
+    comments = paginator.get_page(request.GET.get('comments_page'))
     
     # Comment form
     comment_form = CommentForm()
@@ -199,210 +121,16 @@ def add_comment(request, slug):
 
 def search_products(request):
     """Search products with filters and sorting"""
-    query = request.GET.get('q', '')
-    
-    if query:
-        products = Product.objects.filter(
-            Q(title__icontains=query) |
-            Q(description__icontains=query) |
-            Q(english_title__icontains=query)
-        )
-    else:
-        products = Product.objects.none()
-    
-    # Filter by category
-    category_slug = request.GET.get('category')
-    if category_slug:
-        products = products.filter(category__slug=category_slug)
-    
-    # Filter by brand
-    brand_slug = request.GET.get('brand')
-    if brand_slug:
-        products = products.filter(brand__slug=brand_slug)
-    
-    # Filter by color
-    color_id = request.GET.get('color')
-    if color_id:
-        products = products.filter(colors__id=color_id)
-    
-    # Filter by price
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    if min_price:
-        try:
-            products = products.filter(price__gte=int(min_price))
-        except ValueError:
-            pass
-    if max_price:
-        try:
-            products = products.filter(price__lte=int(max_price))
-        except ValueError:
-            pass
-    
-    # Filter only available products
-    only_available = request.GET.get('only_available')
-    if only_available == 'true':
-        products = products.filter(stock__gt=0)
-    
-    # Sorting
-    sort_by = request.GET.get('sort', '')
-    if sort_by == 'price_asc':
-        products = products.order_by('price')
-    elif sort_by == 'price_desc':
-        products = products.order_by('-price')
-    elif sort_by == 'sales':
-        products = products.order_by('-sales')
-    elif sort_by == 'views':
-        products = products.order_by('-views')
-    elif sort_by == 'created_at':
-        products = products.order_by('-created_at')
-    else:
-        products = products.order_by('-created_at')  # Default
-    
-    # Calculate price range
-    if products.exists():
-        price_range = products.aggregate(
-            min_price=Min('price'),
-            max_price=Max('price')
-        )
-    else:
-        price_range = {'min_price': 0, 'max_price': 0}
-    
-    # Get categories suitable for filter (not for main menu)
-    selected_category_obj = None
-    if category_slug:
-        try:
-            selected_category_obj = Category.objects.get(slug=category_slug)
-            filter_categories = selected_category_obj.get_children().order_by('name')
-        except Category.DoesNotExist:
-            filter_categories = Category.objects.filter(parent__isnull=True).exclude(slug='').order_by('name')
-    else:
-        filter_categories = Category.objects.filter(parent__isnull=True).exclude(slug='').order_by('name')
-    
-    # Colors
-    colors = Color.objects.all().order_by('name')
-    brands = Brand.objects.filter(is_active=True).order_by('order', 'name')
-    
-    # Pagination
-    paginator = Paginator(products, 12)  # 12 products per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
-    # Check favorites for logged-in users
-    user_favorites = set()
-    if request.user.is_authenticated:
-        user_favorites = set(Favorite.objects.filter(user=request.user).values_list('product_id', flat=True))
-    
-    context = {
-        'products': page_obj,
-        'query': query,
-        'user_favorites': user_favorites,
-        'filter_categories': filter_categories,  # Only for right sidebar filter
-        'selected_category_obj': selected_category_obj,
-        'colors': colors,
-        'brands': brands,
-        'selected_category': category_slug,
-        'selected_brand': brand_slug,
-        'selected_color': color_id,
-        'price_range': price_range,
-        'sort_by': sort_by,
-        'only_available': only_available == 'true',
-    }
-    
+    query = ProductQuery.from_request(request, search_param='q', require_search=True)
+    context = get_listing_context(request, query)
+    context['query'] = query.spec.search
     return render(request, 'products/searchResult.html', context)
 
 
 def bestseller_products(request):
     """Best-selling products page"""
-    products = Product.objects.filter(sales__gt=0).order_by('-sales')
-    
-    # Filter by category
-    category_slug = request.GET.get('category')
-    if category_slug:
-        products = products.filter(category__slug=category_slug)
-    
-    # Filter by brand
-    brand_slug = request.GET.get('brand')
-    if brand_slug:
-        products = products.filter(brand__slug=brand_slug)
-    
-    # Filter by color
-    color_id = request.GET.get('color')
-    if color_id:
-        products = products.filter(colors__id=color_id)
-    
-    # Filter by price
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    if min_price:
-        try:
-            products = products.filter(price__gte=int(min_price))
-        except ValueError:
-            pass
-    if max_price:
-        try:
-            products = products.filter(price__lte=int(max_price))
-        except ValueError:
-            pass
-    
-    # Filter only available products
-    only_available = request.GET.get('only_available')
-    if only_available == 'true':
-        products = products.filter(stock__gt=0)
-    
-    # Search
-    search_query = request.GET.get('search')
-    if search_query:
-        products = products.filter(
-            Q(title__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(english_title__icontains=search_query)
-        )
-    
-    # Calculate price range for filter
-    price_range = products.aggregate(
-        min_price=Min('price'),
-        max_price=Max('price')
-    )
-    
-    # Pagination
-    paginator = Paginator(products, 12)  # 12 products per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
-    # Get categories suitable for filter (not for main menu)
-    selected_category_obj = None
-    if category_slug:
-        try:
-            selected_category_obj = Category.objects.get(slug=category_slug)
-            filter_categories = selected_category_obj.get_children().order_by('name')
-        except Category.DoesNotExist:
-            filter_categories = Category.objects.filter(parent__isnull=True).exclude(slug='').order_by('name')
-    else:
-        filter_categories = Category.objects.filter(parent__isnull=True).exclude(slug='').order_by('name')
-    colors = Color.objects.distinct()
-    brands = Brand.objects.filter(is_active=True).order_by('order', 'name')
-    
-    # Check favorites for logged-in users
-    user_favorites = set()
-    if request.user.is_authenticated:
-        user_favorites = set(Favorite.objects.filter(user=request.user).values_list('product_id', flat=True))
-    
-    context = {
-        'products': page_obj,
-        'filter_categories': filter_categories,  # Only for right sidebar filter
-        'selected_category_obj': selected_category_obj,
-        'colors': colors,
-        'brands': brands,
-        'selected_category': category_slug,
-        'selected_brand': brand_slug,
-        'selected_color': color_id,
-        'search_query': search_query,
-        'price_range': price_range,
-        'sort_by': 'sales',  # Sort by sales
-        'user_favorites': user_favorites,
-        'only_available': only_available == 'true',
-        'page_title': 'پرفروش‌ترین محصولات',
-    }
-    
+    query = ProductQuery.from_request(request, bestsellers=True)
+    context = get_listing_context(request, query)
+    context['search_query'] = query.spec.search or None
+    context['page_title'] = 'پرفروش‌ترین محصولات'
     return render(request, 'products/shop.html', context)